@@ -14,14 +14,103 @@ FACE_RECOGNITION = {
     'tolerance': 0.6,  # Độ chặt chẽ: 0.4 (chặt) - 0.8 (lỏng)
     'model': 'hog',  # 'hog' (nhanh) hoặc 'cnn' (chính xác)
     'known_face_encodings_cache': True,  # Cache encoding từ DB
+    'snapshot_save_delay': 5.0,  # Giây gộp các thay đổi gallery trước khi ghi lại snapshot trên đĩa
+    'index_mode': 'exact',  # 'exact' (quét toàn bộ) hoặc 'ivf' (xấp xỉ, cho gallery lớn)
+    'index_params': {
+        'exact': {'block_size': 0},  # Số template mỗi khối (0 = một khối)
+        # nlist: số cụm (0 = ~sqrt(N)), nprobe: số cụm quét mỗi truy vấn (tăng = recall cao, chậm hơn)
+        'ivf': {'nlist': 0, 'nprobe': 8, 'train_iters': 10, 'min_size': 1000},
+    },
 }
 
 # ==================== CAMERA CONFIG ====================
 CAMERA = {
-    'frame_skip': 0,  # Bỏ qua N frame (tăng tốc độ)
+    'frame_skip': 0,  # Số frame tối thiểu bỏ qua giữa hai lần phát hiện khi camera có hoạt động (CADENCE)
     'buffer_size': 1,  # Kích thước buffer frame
     'reconnect_interval': 5,  # Giây đợi trước khi reconnect
     'timeout': 30,  # Timeout mở kết nối
+    'decode_on_demand': True,  # Chỉ giải mã frame khi có consumer cần (grab/retrieve)
+    'frame_pool_size': 3,  # Số buffer frame cấp phát sẵn mỗi camera (tái sử dụng vòng)
+    'read_retry_delay': 0.03,  # Giây chờ sau một lần grab/read lỗi trước khi thử lại
+}
+
+# ==================== SCHEDULER CONFIG ====================
+SCHEDULER = {
+    'max_cameras_per_batch': 16,  # Số camera tối đa gộp vào một lô nhận diện
+    'idle_timeout': 0.5,  # Giây chờ frame mới khi không camera nào có frame
+    'default_priority': 1.0,  # Trọng số mặc định (0.5 = xử lý mỗi 2 vòng, >1 = ưu tiên khi lô đầy)
+    'camera_priorities': {},  # {camera_id: trọng số}
+}
+
+# ==================== DETECTION CONFIG ====================
+DETECTION = {
+    'detection_width': 0,  # Chiều rộng ảnh chạy Haar (0 = gốc); vd 960 cho luồng 2560x1440, ROI vẫn cắt từ ảnh gốc
+    'min_face_size': 0,  # Cạnh khuôn mặt nhỏ nhất cần tìm (pixel frame gốc, 0 = không giới hạn)
+    'max_face_size': 0,  # Cạnh khuôn mặt lớn nhất cần tìm (pixel frame gốc, 0 = không giới hạn)
+    'coarse_to_fine': False,  # Quét thô bước lớn rồi chỉ quét mịn quanh ứng viên
+    'coarse_scale_factor': 1.3,
+    'coarse_min_neighbors': 3,
+    'refine_padding': 0.5,  # Nới rộng ứng viên khi quét mịn (tỷ lệ cạnh)
+    'tile_grid': (1, 1),  # (cột, hàng): chia frame lớn (4K) thành ô chồng lấn, phát hiện song song; (1, 1) = tắt
+                          # Chỉ chia ô khi cạnh khuôn mặt bị chặn trên (max_face_size > 0 hoặc dải đã học của
+                          # face_size_learning); không chặn thì quét nguyên frame để không sót mặt lớn ở đường nối
+    'tile_overlap': 0.25,  # Phần chồng lấn giữa các ô (tỷ lệ cạnh ô, tối thiểu bằng max_face_size)
+    'tile_workers': 0,  # Số thread phát hiện theo ô (0 = số CPU)
+    'face_size_learning': {  # Học dải kích thước khuôn mặt của từng camera từ các lần phát hiện trước
+        'enabled': True,
+        'min_samples': 50,  # Số khuôn mặt cần thấy trước khi bắt đầu giới hạn
+        'window': 500,  # Số mẫu gần nhất được giữ
+        'low_percentile': 2,
+        'high_percentile': 98,
+        'margin': 0.25,  # Nới rộng dải đã học
+        'explore_interval': 50,  # Cứ N lần phát hiện quét toàn dải một lần
+    },
+    'cameras': {},  # Ghi đè theo camera: {camera_id: {'tile_grid': (2, 2), 'face_size_learning': {'enabled': False}}}
+}
+
+# ==================== QUALITY GATE CONFIG ====================
+QUALITY = {
+    'enabled': True,  # Khuôn mặt kém chất lượng chỉ hiển thị, không trích xuất / so khớp / ghi lịch sử
+    'min_size': 40,  # Cạnh khuôn mặt nhỏ nhất (pixel frame gốc)
+    'min_sharpness': 30.0,  # Phương sai Laplacian tối thiểu (đo trên ROI 64x64)
+    'min_brightness': 30.0,  # Độ sáng trung bình chấp nhận (0-255)
+    'max_brightness': 225.0,
+    'min_contrast': 15.0,  # Độ lệch chuẩn mức xám tối thiểu
+    'check_eyes': False,  # Xác minh mắt bằng haarcascade_eye (tốn thêm CPU)
+    'min_eyes': 1,
+    'cameras': {},  # Ghi đè theo camera: {camera_id: {'check_eyes': True}}
+}
+
+# ==================== MOTION GATE CONFIG ====================
+MOTION = {
+    'enabled': False,  # Chỉ chạy phát hiện khuôn mặt trên frame có chuyển động
+    'method': 'diff',  # 'diff' (hiệu frame, rẻ nhất) hoặc 'mog2' (trừ nền, chịu nhiễu tốt hơn)
+    'scale_width': 160,  # Chiều rộng frame thu nhỏ để dò chuyển động
+    'diff_threshold': 25,  # Ngưỡng sai khác mức xám (diff)
+    'min_area_ratio': 0.002,  # Vùng chuyển động nhỏ hơn tỷ lệ này bị bỏ qua
+    'padding': 0.25,  # Nới rộng vùng chuyển động để bao trọn khuôn mặt
+    'hold_frames': 5,  # Giữ vùng chuyển động thêm N frame sau khi cảnh đứng yên
+    'cameras': {},  # Ghi đè theo camera: {camera_id: {'enabled': True, 'method': 'mog2', ...}}
+}
+
+# ==================== TRACKING CONFIG ====================
+TRACKING = {
+    'enabled': True,  # Theo vết khuôn mặt giữa các frame, dùng lại danh tính thay vì nhận diện lại
+    'iou_threshold': 0.3,  # IoU tối thiểu để ghép khuôn mặt với track
+    'centroid_ratio': 0.5,  # Ghép theo tâm nếu khoảng cách tâm < tỷ lệ này x cạnh hộp
+    'max_misses': 5,  # Xoá track sau N frame liên tiếp không thấy
+    'reverify_interval': 15,  # Nhận diện lại track sau mỗi N frame
+    'cameras': {},  # Ghi đè theo camera: {camera_id: {...}}
+}
+
+# ==================== CADENCE CONFIG ====================
+CADENCE = {
+    'enabled': True,  # Điều tiết nhịp phát hiện theo ngân sách CPU và hoạt động của camera
+    'cpu_budget': 1.0,  # Ngân sách CPU cho phát hiện (số core)
+    'idle_skip': 5,  # Số frame bỏ qua khi camera không có khuôn mặt/chuyển động
+    'max_skip': 50,  # Giới hạn số frame bỏ qua khi vượt ngân sách
+    'active_hold': 3.0,  # Giây giữ nhịp nhanh sau lần cuối thấy khuôn mặt/chuyển động
+    'smoothing': 0.2,  # Hệ số EMA khi đo chi phí/FPS
 }
 
 # ==================== GUI CONFIG ====================
@@ -73,7 +162,7 @@ STATISTICS = {
 ADVANCED = {
     'enable_profiling': False,  # Bật profiling để debug
     'enable_gpu': False,  # Bật GPU acceleration (nếu có)
-    'num_workers': 1,  # Số thread worker (mở rộng)
+    'num_workers': 1,  # Số process nhận diện (phát hiện + trích xuất); 1 = chạy trong process GUI
     'max_cameras': 16,  # Số camera tối đa
 }
 
@@ -102,6 +191,30 @@ CLOUD = {
     'cloud_api_key': '',
 }
 
+# Hàm lấy cấu hình của một camera (chung + ghi đè theo camera)
+def camera_settings(section: dict, camera_id=None, key: str = None):
+    """
+    Gộp cấu hình chung của section với phần ghi đè section['cameras'][camera_id].
+
+    Args:
+        section: Dict cấu hình như MOTION, TRACKING, QUALITY, DETECTION
+        camera_id: ID camera (None = chỉ cấu hình chung)
+        key: Lấy mục con (vd 'face_size_learning') ở cả cấu hình chung lẫn phần ghi đè
+
+    Returns:
+        Dict tham số (đã bỏ 'cameras' và 'enabled'), hoặc None nếu 'enabled' là False;
+        section không có 'enabled' luôn được bật
+    """
+    override = section.get('cameras', {}).get(camera_id, {})
+    if key is not None:
+        section, override = section.get(key, {}), override.get(key, {})
+    settings = {k: v for k, v in section.items() if k != 'cameras'}
+    settings.update(override)
+    if not settings.pop('enabled', True):
+        return None
+    return settings
+
+
 # Hàm load config từ file (tuỳ chọn)
 def load_config_from_file(config_file: str = 'config/config.json'):
     """
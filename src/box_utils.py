@@ -0,0 +1,42 @@
+"""
+Module tiện ích hình học cho hộp (x, y, w, h)
+Được sử dụng chung bởi motion_gate.py, face_detector.py và detection_mask.py
+"""
+
+
+def intersect(a, b):
+    """Giao của hai hộp (x, y, w, h); None nếu không giao nhau"""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def merge_boxes(boxes):
+    """
+    Gộp các hộp chồng lấn thành hộp bao của chúng (lặp tới khi không còn cặp nào giao nhau).
+
+    Dùng để mỗi vùng ảnh chỉ được quét một lần khi các vùng quét chồng lên nhau.
+
+    Returns:
+        Danh sách hộp (x, y, w, h) đôi một không giao nhau
+    """
+    boxes = list(boxes)
+    merged = True
+    while merged and len(boxes) > 1:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                if intersect(boxes[i], boxes[j]) is not None:
+                    ax, ay, aw, ah = boxes[i]
+                    bx, by, bw, bh = boxes[j]
+                    x0, y0 = min(ax, bx), min(ay, by)
+                    x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+                    boxes[i] = (x0, y0, x1 - x0, y1 - y0)
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
@@ -0,0 +1,187 @@
+"""
+Module điều tiết nhịp phát hiện khuôn mặt theo camera (cadence governor)
+Quyết định frame nào của mỗi camera được chạy phát hiện đầy đủ, dựa trên ngân
+sách CPU, chi phí đo được mỗi lần phát hiện và hoạt động gần đây (khuôn mặt /
+chuyển động); các frame còn lại chỉ để hiển thị
+"""
+
+import math
+import threading
+import logging
+from config.config import CAMERA, CADENCE
+
+logger = logging.getLogger(__name__)
+
+
+class CameraCadence:
+    """Trạng thái điều tiết của một camera"""
+
+    def __init__(self, skip: int):
+        self.skip = skip  # Số frame bỏ qua giữa hai lần phát hiện
+        self.frames_since_detection = None  # None = chưa phát hiện lần nào (frame đầu luôn phát hiện)
+        self.cost = None  # Giây CPU mỗi lần phát hiện (EMA)
+        self.input_interval = None  # Giây giữa hai frame đầu vào (EMA)
+        self.detection_interval = None  # Giây giữa hai lần phát hiện (EMA)
+        self.last_frame_ts = None
+        self.last_detection_ts = None
+        self.active_until = 0.0  # Còn được coi là "có hoạt động" tới thời điểm này
+        self.detections = 0
+        self.display_only = 0
+
+
+def _ema(previous, value, alpha):
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+class CadenceGovernor:
+    """
+    Bộ điều tiết nhịp phát hiện cho nhiều camera dùng chung một ngân sách CPU.
+
+    - Camera có hoạt động (vừa thấy khuôn mặt hoặc chuyển động trong active_hold
+      giây) phát hiện mỗi (min_skip + 1) frame, với min_skip = CAMERA['frame_skip'];
+      camera đứng yên phát hiện mỗi (idle_skip + 1) frame.
+    - Tải ước tính = tổng (chi phí mỗi lần phát hiện x FPS đầu vào / (skip + 1)).
+      Nếu vượt cpu_budget (đơn vị: số core), mọi khoảng skip được giãn cùng một
+      hệ số để tổng tải về trong ngân sách (tối đa max_skip).
+    """
+
+    def __init__(self, cpu_budget: float = None, min_skip: int = None, idle_skip: int = None,
+                 max_skip: int = None, active_hold: float = None, smoothing: float = None):
+        """
+        Args:
+            cpu_budget: Ngân sách CPU cho phát hiện (số core, 1.0 = một core)
+            min_skip: Số frame bỏ qua khi có hoạt động (mặc định CAMERA['frame_skip'])
+            idle_skip: Số frame bỏ qua khi camera đứng yên
+            max_skip: Giới hạn trên của số frame bỏ qua khi vượt ngân sách
+            active_hold: Giây giữ trạng thái "có hoạt động" sau lần cuối thấy khuôn mặt/chuyển động
+            smoothing: Hệ số EMA khi đo chi phí và FPS
+        """
+        self.cpu_budget = cpu_budget if cpu_budget is not None else CADENCE.get('cpu_budget', 1.0)
+        self.min_skip = min_skip if min_skip is not None else CAMERA.get('frame_skip', 0)
+        self.idle_skip = max(self.min_skip, idle_skip if idle_skip is not None else CADENCE.get('idle_skip', 5))
+        self.max_skip = max(self.idle_skip, max_skip if max_skip is not None else CADENCE.get('max_skip', 50))
+        self.active_hold = active_hold if active_hold is not None else CADENCE.get('active_hold', 3.0)
+        self.smoothing = smoothing if smoothing is not None else CADENCE.get('smoothing', 0.2)
+        self.cameras = {}  # {camera_id: CameraCadence}
+        self._lock = threading.Lock()
+        self.load = 0.0  # Tải ước tính hiện tại (số core)
+        self._now = 0.0  # Timestamp frame mới nhất đã thấy
+
+    def register(self, camera_id):
+        with self._lock:
+            self.cameras[camera_id] = CameraCadence(self.min_skip)
+
+    def unregister(self, camera_id):
+        with self._lock:
+            self.cameras.pop(camera_id, None)
+            self._rebalance()
+
+    def should_detect(self, camera_id, timestamp: float) -> bool:
+        """
+        Ghi nhận frame mới của camera và quyết định có chạy phát hiện hay không.
+
+        Args:
+            timestamp: Thời điểm chụp frame (FramePacket.timestamp)
+
+        Returns:
+            True nếu frame này cần phát hiện đầy đủ; False = chỉ hiển thị
+        """
+        with self._lock:
+            state = self.cameras.get(camera_id)
+            if state is None:
+                return True
+            if state.last_frame_ts is not None and timestamp > state.last_frame_ts:
+                state.input_interval = _ema(state.input_interval, timestamp - state.last_frame_ts, self.smoothing)
+            state.last_frame_ts = timestamp
+            self._now = max(self._now, timestamp)
+
+            if state.frames_since_detection is None or state.frames_since_detection >= state.skip:
+                state.frames_since_detection = 0
+                return True
+            state.frames_since_detection += 1
+            state.display_only += 1
+            return False
+
+    def record(self, camera_id, timestamp: float, cost: float, faces: int, motion=None):
+        """
+        Ghi nhận kết quả một lần phát hiện.
+
+        Args:
+            timestamp: Thời điểm chụp frame đã phát hiện
+            cost: Giây CPU đã dùng cho frame này
+            faces: Số khuôn mặt tìm thấy
+            motion: True/False theo cổng chuyển động; None nếu camera không dùng cổng
+        """
+        with self._lock:
+            state = self.cameras.get(camera_id)
+            if state is None:
+                return
+            state.detections += 1
+            state.cost = _ema(state.cost, cost, self.smoothing)
+            if state.last_detection_ts is not None and timestamp > state.last_detection_ts:
+                state.detection_interval = _ema(state.detection_interval, timestamp - state.last_detection_ts,
+                                                self.smoothing)
+            state.last_detection_ts = timestamp
+            if faces > 0 or motion:
+                state.active_until = timestamp + self.active_hold
+            self._rebalance()
+
+    def _rebalance(self):
+        """Tính lại số frame bỏ qua của mọi camera theo hoạt động và ngân sách CPU"""
+        desired = {}
+        demand = {}
+        for camera_id, state in self.cameras.items():
+            active = state.active_until >= self._now
+            desired[camera_id] = self.min_skip if active else self.idle_skip
+            if state.cost is not None and state.input_interval:
+                # Giây CPU mỗi giây nếu phát hiện mọi frame
+                demand[camera_id] = state.cost / state.input_interval
+
+        load = sum(demand.get(c, 0.0) / (skip + 1) for c, skip in desired.items())
+        factor = max(1.0, load / self.cpu_budget) if self.cpu_budget > 0 else 1.0
+        for camera_id, skip in desired.items():
+            self.cameras[camera_id].skip = min(self.max_skip, math.ceil((skip + 1) * factor) - 1)
+        self.load = sum(demand.get(c, 0.0) / (self.cameras[c].skip + 1) for c in desired)
+
+    def get_stats(self) -> dict:
+        """
+        Thống kê theo camera: skip hiện tại, FPS đầu vào, FPS phát hiện thực tế,
+        chi phí mỗi lần phát hiện (ms), số frame chỉ hiển thị; kèm tải ước tính
+        """
+        with self._lock:
+            cameras = {}
+            for camera_id, state in self.cameras.items():
+                cameras[camera_id] = {
+                    'skip': state.skip,
+                    'input_fps': 1.0 / state.input_interval if state.input_interval else 0.0,
+                    'detection_fps': 1.0 / state.detection_interval if state.detection_interval else 0.0,
+                    'cost_ms': state.cost * 1000 if state.cost is not None else 0.0,
+                    'detections': state.detections,
+                    'display_only': state.display_only,
+                }
+            return {'cpu_budget': self.cpu_budget, 'load': self.load, 'cameras': cameras}
+
+
+def create_cadence_governor():
+    """Tạo CadenceGovernor theo CADENCE trong config, hoặc None nếu tắt (phát hiện mọi frame)"""
+    if not CADENCE.get('enabled', False):
+        return None
+    return CadenceGovernor()
+
+
+_shared_governor = None
+_shared_lock = threading.Lock()
+
+
+def get_cadence_governor():
+    """
+    CadenceGovernor dùng chung cho cả process, hoặc None nếu tắt.
+
+    Tab giám sát và bộ lập lịch nhiều camera cùng đăng ký vào một governor để
+    cpu_budget là ngân sách của toàn ứng dụng, không phải của từng tab.
+    """
+    global _shared_governor
+    with _shared_lock:
+        if _shared_governor is None:
+            _shared_governor = create_cadence_governor()
+        return _shared_governor
@@ -2,18 +2,239 @@ import cv2
 import threading
 import time
 import logging
+from typing import NamedTuple, Optional
+
+import numpy as np
+from config.config import CAMERA
 
 logger = logging.getLogger(__name__)
 
+
+class SubscriptionClosed(Exception):
+    """Handle đã bị đóng (close(), remove_camera() hoặc stop_all()); không còn frame nào nữa"""
+
+
+class FrameLease:
+    """
+    Bộ đếm người đang giữ một buffer frame.
+
+    Frame đang công bố giữ một lease; mỗi packet trả cho consumer qua
+    CameraSubscription giữ thêm một lease tới khi consumer gọi packet.release().
+    FramePool chỉ ghi đè buffer khi lease của nó về 0.
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self) -> bool:
+        return self._count > 0
+
+    def acquire(self):
+        with self._lock:
+            self._count += 1
+
+    def release(self):
+        with self._lock:
+            if self._count > 0:
+                self._count -= 1
+
+
+class FramePacket(NamedTuple):
+    """
+    Frame (chỉ đọc) kèm số thứ tự (tăng dần theo camera) và thời điểm chụp (time.time()).
+
+    Packet nhận từ CameraSubscription giữ lease trên buffer của frame: gọi
+    release() (hoặc dùng "with packet:") khi không còn đọc frame nữa; sau đó
+    buffer có thể bị ghi đè bởi frame mới, cần giữ lâu hơn thì copy.
+    """
+    frame: np.ndarray
+    seq: int
+    timestamp: float
+    lease: Optional[FrameLease] = None
+
+    def release(self):
+        """Trả lease của buffer frame (gọi đúng một lần cho mỗi packet đã nhận)"""
+        if self.lease is not None:
+            self.lease.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class FramePool:
+    """
+    Vòng buffer frame cấp phát sẵn cho một camera.
+
+    Capture giải mã thẳng vào buffer rảnh (cap.read(image=buf) / cap.retrieve(buf))
+    thay vì cấp phát mảng mới mỗi frame. Mỗi buffer có một FrameLease và chỉ
+    được ghi đè khi không còn ai giữ lease (frame đang công bố, consumer chưa
+    release packet); nếu mọi buffer đều bận thì cấp phát mới và thay vào vòng.
+    """
+
+    def __init__(self, size: int = 3):
+        self.size = max(2, size)
+        self.buffers = []
+        self.leases = []  # FrameLease của từng buffer
+        self.position = 0
+        self.allocations = 0  # Số lần phải cấp phát mảng mới
+        self._slot = None
+
+    def acquire(self) -> Optional[np.ndarray]:
+        """Lấy buffer rảnh để ghi frame kế tiếp, hoặc None nếu cần cấp phát mới"""
+        self._slot = None
+        for _ in range(len(self.buffers)):
+            index = self.position
+            self.position = (self.position + 1) % len(self.buffers)
+            if not self.leases[index].in_use:
+                buf = self.buffers[index]
+                buf.flags.writeable = True
+                self._slot = index
+                return buf
+        return None
+
+    def commit(self, buf, frame):
+        """
+        Ghi nhận frame vừa giải mã vào buffer buf.
+
+        Nếu OpenCV phải cấp phát mảng mới (chưa có buffer, mọi buffer đều bận,
+        hoặc kích thước frame thay đổi) thì mảng mới được đưa vào vòng.
+
+        Returns:
+            (frame, lease) - lease đã được giữ một lần cho frame sắp công bố
+        """
+        if frame is buf:
+            lease = self.leases[self._slot]
+        else:
+            self.allocations += 1
+            lease = FrameLease()
+            if self._slot is not None:
+                self.buffers[self._slot] = frame
+                self.leases[self._slot] = lease
+            elif len(self.buffers) < self.size:
+                self.buffers.append(frame)
+                self.leases.append(lease)
+            else:
+                # Buffer cũ vẫn sống (kèm lease cũ) tới khi consumer cuối cùng release
+                self.buffers[self.position] = frame
+                self.leases[self.position] = lease
+                self.position = (self.position + 1) % len(self.buffers)
+        lease.acquire()
+        return frame, lease
+
+
+def _source_frame_interval(cap) -> float:
+    """
+    Khoảng cách giữa hai frame (giây) cần giữ khi đọc nguồn không live.
+
+    File / bản ghi phát lại (có tổng số frame) được đọc đúng nhịp FPS của nó thay
+    vì rút cạn nhanh nhất có thể; luồng live (RTSP, webcam) trả về 0 vì grab()
+    đã tự chờ frame kế tiếp.
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0 and fps > 0:
+        return 1.0 / fps
+    return 0.0
+
+
+class CameraSubscription:
+    """
+    Handle đăng ký nhận frame của một camera.
+
+    Nhiều handle cùng camera dùng chung một kết nối RTSP và một lần giải mã;
+    mỗi handle tự nhớ seq đã xử lý nên không bỏ sót/lặp frame của riêng nó.
+    Lấy bằng CameraManager.subscribe() và trả lại bằng close().
+    """
+
+    def __init__(self, manager, camera_id):
+        self.manager = manager
+        self.camera_id = camera_id
+        self.last_seq = 0
+        self._closed = threading.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def get_next_frame(self, timeout: float = 1.0) -> Optional[FramePacket]:
+        """
+        Chờ frame mới hơn frame đã nhận gần nhất qua handle này.
+
+        Returns:
+            FramePacket (đã giữ lease, consumer phải release()) hoặc None nếu hết
+            thời gian chờ / camera đã dừng
+
+        Raises:
+            SubscriptionClosed: handle đã đóng, consumer phải thoát vòng lặp
+        """
+        if self.closed:
+            raise SubscriptionClosed(f"Camera {self.camera_id}: subscription closed")
+        packet = self.manager.get_next_frame(self.camera_id, self.last_seq, timeout)
+        if packet is None:
+            # Camera đã dừng: chờ hết timeout (hoặc tới khi close) thay vì quay vòng rỗng
+            if not self.manager.is_running(self.camera_id):
+                self._closed.wait(timeout)
+            if self.closed:
+                raise SubscriptionClosed(f"Camera {self.camera_id}: subscription closed")
+            return None
+        self.last_seq = packet.seq
+        return packet
+
+    def poll(self) -> Optional[FramePacket]:
+        """Lấy frame mới hơn frame đã nhận gần nhất nếu có (không chờ, đã giữ lease), ngược lại None"""
+        if self.closed:
+            return None
+        packet = self.manager.get_frame_packet(self.camera_id)
+        if packet is None:
+            return None
+        if packet.seq <= self.last_seq:
+            packet.release()
+            return None
+        self.last_seq = packet.seq
+        return packet
+
+    def get_frame(self):
+        """Lấy bản sao frame mới nhất (không chờ)"""
+        if self.closed:
+            return None
+        return self.manager.get_frame(self.camera_id)
+
+    def close(self):
+        """Huỷ đăng ký; camera dừng khi không còn handle nào"""
+        self.manager.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
 class CameraManager:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, decode_on_demand=None):
         self.db_manager = db_manager
         self.camera_info = {}
         self.captures = {}
         self.threads = {}
         self.running = {}
-        self.frames = {}
-        self.locks = {}  # Thêm lock cho mỗi camera
+        self.frames = {}  # {camera_id: FramePacket hoặc None}
+        self.locks = {}  # Condition cho mỗi camera (dùng như lock + báo frame mới)
+        self.frame_seq = {}  # {camera_id: số thứ tự frame gần nhất}
+        # Giải mã theo yêu cầu: {camera_id: True nếu consumer đang chờ frame mới}
+        self.decode_on_demand = CAMERA.get('decode_on_demand', True) if decode_on_demand is None else decode_on_demand
+        self.frame_demand = {}
+        self.capture_stats = {}  # {camera_id: {'grabbed': n, 'decoded': n, 'allocations': n}}
+        self.frame_pools = {}  # {camera_id: FramePool}
+        # Phiên capture hiện tại của camera: luồng capture cũ (join quá hạn, vẫn kẹt trong
+        # grab/read) chỉ dọn trạng thái khi camera chưa được mở lại bằng phiên mới
+        self.sessions = {}  # {camera_id: object}
+        self.subscribers = {}  # {camera_id: set(CameraSubscription)}
+        self._subscribe_lock = threading.RLock()
+        self.frame_listeners = set()  # threading.Event được set mỗi khi bất kỳ camera nào có frame mới
 
     def add_camera(self, camera_id, rtsp_url, name):
         """Thêm camera vào quản lý nhưng chưa khởi động"""
@@ -26,6 +247,9 @@ class CameraManager:
 
     def remove_camera(self, camera_id):
         """Xóa camera khỏi quản lý"""
+        with self._subscribe_lock:
+            for subscription in self.subscribers.pop(camera_id, ()):
+                subscription._closed.set()
         if camera_id in self.running and self.running[camera_id]:
             self.stop_camera(camera_id)
         
@@ -35,6 +259,7 @@ class CameraManager:
         self.frames.pop(camera_id, None)
         self.running.pop(camera_id, None)
         self.locks.pop(camera_id, None)
+        self.frame_seq.pop(camera_id, None)
         logger.info(f"Camera {camera_id} removed from manager.")
 
     def update_camera(self, camera_id, rtsp_url=None, name=None):
@@ -48,22 +273,57 @@ class CameraManager:
             # Nếu camera đang chạy, cần restart với URL mới
             if camera_id in self.running and self.running[camera_id]:
                 self.stop_camera(camera_id)
-                self.start_camera(camera_id)
+                self.start_camera(camera_id, self.camera_info[camera_id]['rtsp_url'])
             
             logger.info(f"Camera {camera_id} updated.")
 
-    def _update_frame(self, camera_id):
-        """Đọc frame từ camera với xử lý lỗi"""
+    def _owns_session(self, camera_id, session) -> bool:
+        """Luồng capture của phiên session còn là phiên hiện tại và chưa bị dừng"""
+        return self.sessions.get(camera_id) is session and self.running.get(camera_id, False)
+
+    def _update_frame(self, camera_id, session):
+        """
+        Đọc frame từ camera với xử lý lỗi.
+        
+        Chế độ decode_on_demand: luôn grab() để rút cạn buffer stream (giữ hình
+        ảnh "live"), nhưng chỉ retrieve() (giải mã) khi có consumer yêu cầu
+        frame mới kể từ lần giải mã trước. Chế độ thường: read() mọi frame.
+        Nguồn file được đọc theo FPS của nó; đọc lỗi thì chờ read_retry_delay
+        trước lần thử kế tiếp.
+        """
         cap = self.captures[camera_id]
+        cond = self.locks[camera_id]
+        stats = self.capture_stats[camera_id]
+        pool = self.frame_pools[camera_id]
         error_count = 0
         max_errors = 5
+        retry_delay = CAMERA.get('read_retry_delay', 0.03)
+        frame_interval = _source_frame_interval(cap)
+        next_frame_time = time.monotonic()
         
-        while self.running.get(camera_id, False):
+        while self._owns_session(camera_id, session):
             try:
-                ret, frame = cap.read()
-                if ret and frame is not None:
-                    with self.locks[camera_id]:  # Sử dụng lock
-                        self.frames[camera_id] = frame
+                if self.decode_on_demand:
+                    ret = cap.grab()
+                    if ret:
+                        stats['grabbed'] += 1
+                        if self.frame_demand.get(camera_id, False):
+                            self.frame_demand[camera_id] = False
+                            buf = pool.acquire()
+                            ret, frame = cap.retrieve(buf)
+                            if ret and frame is not None and self._owns_session(camera_id, session):
+                                stats['decoded'] += 1
+                                self._publish_frame(camera_id, *pool.commit(buf, frame))
+                else:
+                    buf = pool.acquire()
+                    ret, frame = cap.read(buf)
+                    if ret and frame is not None and self._owns_session(camera_id, session):
+                        stats['grabbed'] += 1
+                        stats['decoded'] += 1
+                        self._publish_frame(camera_id, *pool.commit(buf, frame))
+                stats['allocations'] = pool.allocations
+                
+                if ret:
                     error_count = 0
                 else:
                     error_count += 1
@@ -73,18 +333,51 @@ class CameraManager:
                     if error_count >= max_errors:
                         logger.error(f"Camera {camera_id}: Too many errors, attempting reconnect...")
                         break
+                    time.sleep(retry_delay)
+                    continue
                 
-                time.sleep(0.03)
+                if frame_interval:
+                    # Nguồn file: giữ đúng nhịp phát, không dồn frame sau khi bị trễ
+                    next_frame_time = max(next_frame_time + frame_interval, time.monotonic())
+                    time.sleep(max(0.0, next_frame_time - time.monotonic()))
+                elif not self.decode_on_demand:
+                    time.sleep(0.03)
                 
             except Exception as e:
                 logger.error(f"Camera {camera_id}: Error in update_frame: {e}")
                 time.sleep(1)
         
-        # Cleanup
+        # Cleanup: chỉ đụng tới trạng thái camera nếu phiên này vẫn là phiên hiện tại
         cap.release()
+        with cond:
+            if self.sessions.get(camera_id) is session:
+                self.frames[camera_id] = None
+                self.running[camera_id] = False
+            cond.notify_all()  # Đánh thức các consumer đang chờ
+        logger.info(f"Camera {camera_id}: grabbed {stats['grabbed']} frames, decoded {stats['decoded']}, "
+                    f"allocated {stats['allocations']} buffers")
+    
+    def _publish_frame(self, camera_id, frame, lease):
+        """
+        Lưu frame mới với số thứ tự tăng dần và báo cho các consumer đang chờ.
+        
+        Frame được khoá chỉ đọc (writeable=False) và chia sẻ nguyên trạng cho mọi
+        consumer, không copy; consumer cần vẽ phải tự tạo bản sao (thường là bản
+        đã thu nhỏ để hiển thị).
+        """
+        frame.flags.writeable = False
+        seq = self.frame_seq.get(camera_id, 0) + 1
+        self.frame_seq[camera_id] = seq
+        # Hoán đổi kép: packet cũ trả lease "đang công bố"; buffer của nó chỉ được ghi
+        # lại khi mọi consumer đã lấy packet (lấy lease dưới cùng khoá này) release xong
         with self.locks[camera_id]:
-            self.frames[camera_id] = None
-        self.running[camera_id] = False
+            previous = self.frames.get(camera_id)
+            self.frames[camera_id] = FramePacket(frame, seq, time.time(), lease)
+            if previous is not None:
+                previous.release()
+            self.locks[camera_id].notify_all()
+        for listener in tuple(self.frame_listeners):
+            listener.set()
     
     def start_camera(self, camera_id, rtsp_url):
         if camera_id in self.captures:
@@ -97,22 +390,143 @@ class CameraManager:
         self.captures[camera_id] = cap
         self.running[camera_id] = True
         self.frames[camera_id] = None
-        self.locks[camera_id] = threading.Lock()  # Thêm lock
+        self.locks[camera_id] = threading.Condition()
+        self.frame_demand[camera_id] = True  # Giải mã frame đầu tiên ngay
+        self.capture_stats[camera_id] = {'grabbed': 0, 'decoded': 0, 'allocations': 0}
+        self.frame_pools[camera_id] = FramePool(CAMERA.get('frame_pool_size', 3))
+        session = self.sessions[camera_id] = object()
         
-        t = threading.Thread(target=self._update_frame, args=(camera_id,), daemon=True)
+        t = threading.Thread(target=self._update_frame, args=(camera_id, session), daemon=True)
         self.threads[camera_id] = t
         t.start()
         logger.info(f"Camera {camera_id} started.")
 
+    def subscribe(self, camera_id, rtsp_url=None) -> Optional[CameraSubscription]:
+        """
+        Đăng ký nhận frame của camera, khởi động camera nếu chưa chạy.
+
+        Args:
+            camera_id: ID camera
+            rtsp_url: URL RTSP (mặc định lấy từ camera_info)
+
+        Returns:
+            CameraSubscription hoặc None nếu không mở được camera
+        """
+        with self._subscribe_lock:
+            if not self.is_running(camera_id):
+                if camera_id in self.captures:
+                    self.stop_camera(camera_id)  # Dọn luồng capture đã chết trước khi mở lại
+                if rtsp_url is None and camera_id in self.camera_info:
+                    rtsp_url = self.camera_info[camera_id]['rtsp_url']
+                if rtsp_url is None:
+                    logger.error(f"Camera {camera_id}: no RTSP URL to subscribe")
+                    return None
+                self.start_camera(camera_id, rtsp_url)
+                if not self.is_running(camera_id):
+                    return None
+            
+            subscription = CameraSubscription(self, camera_id)
+            self.subscribers.setdefault(camera_id, set()).add(subscription)
+            logger.info(f"Camera {camera_id}: subscriber added ({len(self.subscribers[camera_id])} active)")
+            return subscription
+
+    def unsubscribe(self, subscription: CameraSubscription):
+        """Huỷ đăng ký; dừng camera khi subscriber cuối cùng rời đi"""
+        with self._subscribe_lock:
+            if subscription.closed:
+                return
+            subscription._closed.set()
+            camera_id = subscription.camera_id
+            subscribers = self.subscribers.get(camera_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            logger.info(f"Camera {camera_id}: subscriber removed ({len(subscribers)} active)")
+            if not subscribers:
+                self.subscribers.pop(camera_id, None)
+                self.stop_camera(camera_id)
+
+    def add_frame_listener(self, event: threading.Event):
+        """Đăng ký Event được set khi bất kỳ camera nào công bố frame mới (cho bộ lập lịch nhiều camera)"""
+        self.frame_listeners.add(event)
+
+    def remove_frame_listener(self, event: threading.Event):
+        self.frame_listeners.discard(event)
+
+    def get_subscriber_count(self, camera_id) -> int:
+        """Số subscriber đang nhận frame của camera"""
+        with self._subscribe_lock:
+            return len(self.subscribers.get(camera_id, ()))
+
+    def is_running(self, camera_id) -> bool:
+        """Camera có đang capture hay không"""
+        return self.running.get(camera_id, False)
+
     def get_frame(self, camera_id):
-        """Lấy frame an toàn với thread"""
-        if camera_id in self.locks:
-            with self.locks[camera_id]:
-                return self.frames.get(camera_id, None)
-        return None
+        """Lấy bản sao frame mới nhất (an toàn với thread, giữ lâu được)"""
+        packet = self.get_frame_packet(camera_id)
+        if packet is None:
+            return None
+        with packet:
+            return packet.frame.copy()
+    
+    def get_frame_packet(self, camera_id) -> Optional[FramePacket]:
+        """Lấy FramePacket mới nhất (frame, seq, timestamp) đã giữ lease, hoặc None; gọi release() khi dùng xong"""
+        cond = self.locks.get(camera_id)
+        if cond is None:
+            return None
+        self.frame_demand[camera_id] = True  # Frame kế tiếp sẽ được giải mã
+        with cond:
+            return self._lease_packet(camera_id)
+    
+    def _lease_packet(self, camera_id) -> Optional[FramePacket]:
+        """Giữ lease cho packet đang công bố (gọi khi đang giữ khoá camera)"""
+        packet = self.frames.get(camera_id)
+        if packet is not None and packet.lease is not None:
+            packet.lease.acquire()
+        return packet
+    
+    def get_next_frame(self, camera_id, after_seq: int = 0, timeout: float = 1.0) -> Optional[FramePacket]:
+        """
+        Chờ frame có số thứ tự lớn hơn after_seq.
+        
+        Consumer truyền seq của frame đã xử lý gần nhất nên mỗi frame được xử lý
+        tối đa một lần, và không phải vòng lặp polling liên tục.
+        
+        Args:
+            camera_id: ID camera
+            after_seq: Số thứ tự frame đã xử lý gần nhất (0 = chưa có)
+            timeout: Thời gian chờ tối đa (giây)
+        
+        Returns:
+            FramePacket mới (đã giữ lease, gọi release() khi dùng xong) hoặc None
+            nếu hết thời gian chờ / camera đã dừng
+        """
+        cond = self.locks.get(camera_id)
+        if cond is None:
+            return None
+        
+        def has_new_frame():
+            packet = self.frames.get(camera_id)
+            return (packet is not None and packet.seq > after_seq) or not self.running.get(camera_id, False)
+        
+        with cond:
+            if not has_new_frame():
+                self.frame_demand[camera_id] = True  # Yêu cầu vòng capture giải mã frame kế tiếp
+            if not cond.wait_for(has_new_frame, timeout):
+                return None
+            packet = self.frames.get(camera_id)
+            if packet is None or packet.seq <= after_seq:
+                return None
+            return self._lease_packet(camera_id)
 
     def stop_camera(self, camera_id):
         self.running[camera_id] = False
+        self.sessions.pop(camera_id, None)  # Luồng capture cũ không còn sở hữu camera
+        cond = self.locks.get(camera_id)
+        if cond is not None:
+            with cond:
+                cond.notify_all()  # Consumer đang chờ get_next_frame trả về ngay
         if camera_id in self.threads:
             self.threads[camera_id].join(timeout=1)
         if camera_id in self.captures:
@@ -121,9 +535,19 @@ class CameraManager:
         self.threads.pop(camera_id, None)
         self.frames.pop(camera_id, None)
         self.running.pop(camera_id, None)
+        self.frame_pools.pop(camera_id, None)
         logger.info(f"Camera {camera_id} stopped.")
 
+    def get_capture_stats(self, camera_id) -> dict:
+        """Số frame đã grab, đã giải mã và số buffer frame phải cấp phát của camera"""
+        return dict(self.capture_stats.get(camera_id, {'grabbed': 0, 'decoded': 0, 'allocations': 0}))
+
     def stop_all(self):
+        with self._subscribe_lock:
+            for subscribers in self.subscribers.values():
+                for subscription in subscribers:
+                    subscription._closed.set()
+            self.subscribers.clear()
         for cam_id in list(self.captures.keys()):
             self.stop_camera(cam_id)
 
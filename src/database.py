@@ -5,6 +5,8 @@ Lưu trữ: Thông tin người dùng, khuôn mặt, lịch sử phát hiện
 
 import sqlite3
 import pickle
+import io
+import json
 import os
 import numpy as np
 import threading
@@ -16,6 +18,44 @@ from zoneinfo import ZoneInfo
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Định dạng lưu đặc trưng: byte float32 little-endian thô
+FEATURE_DTYPE = '<f4'
+# Phiên bản bộ trích xuất gán cho các BLOB pickle cũ khi chuyển đổi
+LEGACY_DESCRIPTOR_VERSION = 1
+
+
+def encode_features(features) -> Tuple[bytes, str, int]:
+    """Mã hoá vector đặc trưng thành (bytes, dtype, dim)"""
+    array = np.ascontiguousarray(np.asarray(features).ravel(), dtype=FEATURE_DTYPE)
+    return array.tobytes(), FEATURE_DTYPE, int(array.shape[0])
+
+
+def decode_features(blob, dtype: Optional[str], dim: Optional[int]) -> Optional['np.ndarray']:
+    """
+    Giải mã BLOB đặc trưng bằng np.frombuffer (không sao chép, mảng chỉ đọc).
+    
+    Returns:
+        numpy array hoặc None nếu không có / chưa chuyển đổi / không hợp lệ
+    """
+    if blob is None or not dtype or not dim or dim <= 0:
+        return None
+    try:
+        return np.frombuffer(blob, dtype=np.dtype(dtype), count=dim)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Invalid feature blob ({dtype}, {dim}): {e}")
+        return None
+
+
+class _LegacyFeatureUnpickler(pickle.Unpickler):
+    """Unpickler chỉ cho phép các lớp numpy cần để đọc BLOB đặc trưng cũ"""
+    
+    _ALLOWED = {'_reconstruct', 'ndarray', 'dtype', 'scalar', '_frombuffer'}
+    
+    def find_class(self, module, name):
+        if module.split('.')[0] == 'numpy' and name in self._ALLOWED:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Disallowed class in feature blob: {module}.{name}")
+
 
 class DatabaseManager:
     """
@@ -54,12 +94,23 @@ class DatabaseManager:
                     name TEXT NOT NULL,
                     category TEXT NOT NULL,  -- 'whitelist' hoặc 'blacklist'
                     image_path TEXT,
-                    features BLOB,  -- Pickle-serialized numpy array (Zernike moments)
+                    features BLOB,  -- Zernike moments dạng byte thô (xem feature_dtype/feature_dim)
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    feature_dtype TEXT,  -- VD: '<f4' (float32 little-endian)
+                    feature_dim INTEGER,  -- Số chiều vector; NULL = BLOB pickle cũ chưa chuyển đổi
+                    descriptor_version INTEGER,  -- Phiên bản bộ trích xuất đặc trưng
                     UNIQUE(name)
                 )
             ''')
             
+            # DB cũ: bổ sung các cột định dạng đặc trưng nếu chưa có
+            cursor.execute('PRAGMA table_info(users)')
+            user_columns = {row[1] for row in cursor.fetchall()}
+            for column, column_type in (('feature_dtype', 'TEXT'), ('feature_dim', 'INTEGER'),
+                                        ('descriptor_version', 'INTEGER')):
+                if column not in user_columns:
+                    cursor.execute(f'ALTER TABLE users ADD COLUMN {column} {column_type}')
+            
             # Bảng cameras: Quản lý danh sách camera
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS cameras (
@@ -68,10 +119,16 @@ class DatabaseManager:
                     rtsp_url TEXT NOT NULL,
                     status TEXT DEFAULT 'inactive',  -- 'active' hoặc 'inactive'
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    detection_masks TEXT,  -- JSON {"include": [đa giác], "exclude": [đa giác]}, toạ độ chuẩn hoá 0..1
                     UNIQUE(rtsp_url)
                 )
             ''')
             
+            # DB cũ: bổ sung cột vùng phát hiện nếu chưa có
+            cursor.execute('PRAGMA table_info(cameras)')
+            if 'detection_masks' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute('ALTER TABLE cameras ADD COLUMN detection_masks TEXT')
+            
             # Bảng detection_history: Lưu lịch sử phát hiện
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS detection_history (
@@ -86,12 +143,78 @@ class DatabaseManager:
                 )
             ''')
             
+            # Bảng metadata: Bộ đếm phiên bản dữ liệu (VD: users_version)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS metadata (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('users_version', 0)")
+            # Định danh ngẫu nhiên của file DB, phân biệt các DB khác nhau có cùng users_version
+            cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('db_uid', abs(random()))")
+            
+            # Mỗi thay đổi trên bảng users tăng users_version để gallery biết khi nào cần đồng bộ
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS users_version_{event.lower()}
+                    AFTER {event} ON users
+                    BEGIN
+                        UPDATE metadata SET value = value + 1 WHERE key = 'users_version';
+                    END
+                ''')
+            
             self.conn.commit()
             logger.info(f"Database initialized successfully at {self.db_path}")
         
         except sqlite3.Error as e:
             logger.error(f"Database initialization error: {e}")
             raise
+        
+        self.migrate_pickled_features()
+    
+    def migrate_pickled_features(self, chunk_size: int = 500) -> int:
+        """
+        Chuyển các BLOB đặc trưng dạng pickle cũ sang byte float32 thô, tại chỗ.
+        
+        Xử lý theo từng lô chunk_size dòng, commit sau mỗi lô. Dòng không giải
+        mã được giữ nguyên BLOB nhưng đánh dấu feature_dim = 0 để bị bỏ qua.
+        
+        Returns:
+            Số dòng đã chuyển đổi
+        """
+        migrated = 0
+        while True:
+            try:
+                with self.db_lock:
+                    cursor = self.conn.cursor()
+                    cursor.execute('''
+                        SELECT id, features FROM users
+                        WHERE features IS NOT NULL AND feature_dim IS NULL
+                        LIMIT ?
+                    ''', (chunk_size,))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    for user_id, blob in rows:
+                        try:
+                            features = np.asarray(_LegacyFeatureUnpickler(io.BytesIO(blob)).load(), dtype=np.float64)
+                            blob_raw, dtype, dim = encode_features(features)
+                            cursor.execute('''
+                                UPDATE users SET features = ?, feature_dtype = ?, feature_dim = ?, descriptor_version = ?
+                                WHERE id = ?
+                            ''', (blob_raw, dtype, dim, LEGACY_DESCRIPTOR_VERSION, user_id))
+                            migrated += 1
+                        except Exception as e:
+                            logger.warning(f"Cannot migrate features of user {user_id}: {e}")
+                            cursor.execute('UPDATE users SET feature_dim = 0 WHERE id = ?', (user_id,))
+                    self.conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error migrating features: {e}")
+                break
+        if migrated:
+            logger.info(f"Migrated {migrated} pickled feature rows to raw float32")
+        return migrated
     
     # ==================== USER MANAGEMENT ====================
     
@@ -129,7 +252,11 @@ class DatabaseManager:
         """Lấy danh sách tất cả người dùng"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT id, name, category, image_path, features, created_at FROM users')
+            cursor.execute('''
+                SELECT id, name, category, image_path, features, created_at,
+                       feature_dtype, feature_dim, descriptor_version
+                FROM users
+            ''')
             users = []
             for row in cursor.fetchall():
                 users.append({
@@ -137,19 +264,45 @@ class DatabaseManager:
                     'name': row[1],
                     'category': row[2],
                     'image_path': row[3],
-                    'features': row[4],
-                    'created_at': row[5]
+                    'features': decode_features(row[4], row[6], row[7]),
+                    'created_at': row[5],
+                    'descriptor_version': row[8]
                 })
             return users
         except sqlite3.Error as e:
             logger.error(f"Error fetching users: {e}")
             return []
     
+    def get_users_version(self) -> int:
+        """Lấy phiên bản hiện tại của bảng users (tăng sau mỗi thêm/sửa/xóa)"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT value FROM metadata WHERE key = 'users_version'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching users version: {e}")
+            return -1
+    
+    def get_database_uid(self) -> int:
+        """Lấy định danh ngẫu nhiên được sinh khi tạo file DB"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT value FROM metadata WHERE key = 'db_uid'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching database uid: {e}")
+            return 0
+    
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Lấy thông tin người dùng theo ID"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT id, name, category, image_path, features FROM users WHERE id = ?', (user_id,))
+            cursor.execute('''
+                SELECT id, name, category, image_path, features, feature_dtype, feature_dim, descriptor_version
+                FROM users WHERE id = ?
+            ''', (user_id,))
             row = cursor.fetchone()
             if row:
                 return {
@@ -157,7 +310,8 @@ class DatabaseManager:
                     'name': row[1],
                     'category': row[2],
                     'image_path': row[3],
-                    'features': row[4]
+                    'features': decode_features(row[4], row[5], row[6]),
+                    'descriptor_version': row[7]
                 }
             return None
         except sqlite3.Error as e:
@@ -191,13 +345,14 @@ class DatabaseManager:
     
     # ==================== FACE FEATURES MANAGEMENT ====================
     
-    def update_user_features(self, user_id: int, features: 'np.ndarray') -> bool:
+    def update_user_features(self, user_id: int, features: 'np.ndarray', descriptor_version: int = None) -> bool:
         """
         Cập nhật vector đặc trưng Zernike cho người dùng.
         
         Args:
             user_id: ID người dùng
             features: numpy array chứa Zernike moments
+            descriptor_version: Phiên bản bộ trích xuất đã tạo ra vector
         
         Returns:
             True nếu thành công
@@ -205,11 +360,12 @@ class DatabaseManager:
         try:
             with self.db_lock:
                 cursor = self.conn.cursor()
-                # Serialize numpy array thành BLOB
-                features_blob = pickle.dumps(features)
+                # Serialize numpy array thành byte float32 thô
+                features_blob, dtype, dim = encode_features(features)
                 cursor.execute('''
-                    UPDATE users SET features = ? WHERE id = ?
-                ''', (features_blob, user_id))
+                    UPDATE users SET features = ?, feature_dtype = ?, feature_dim = ?, descriptor_version = ?
+                    WHERE id = ?
+                ''', (features_blob, dtype, dim, descriptor_version, user_id))
                 self.conn.commit()
             logger.info(f"Features updated for user {user_id}")
             return True
@@ -229,11 +385,10 @@ class DatabaseManager:
         """
         try:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT features FROM users WHERE id = ?', (user_id,))
+            cursor.execute('SELECT features, feature_dtype, feature_dim FROM users WHERE id = ?', (user_id,))
             row = cursor.fetchone()
-            if row and row[0]:
-                features = pickle.loads(row[0])
-                return np.array(features)
+            if row:
+                return decode_features(row[0], row[1], row[2])
             return None
         except sqlite3.Error as e:
             logger.error(f"Error fetching user features: {e}")
@@ -248,12 +403,15 @@ class DatabaseManager:
         """
         try:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT id, features FROM users WHERE features IS NOT NULL')
+            cursor.execute('''
+                SELECT id, features, feature_dtype, feature_dim FROM users
+                WHERE features IS NOT NULL AND feature_dim > 0
+            ''')
             features_dict = {}
             for row in cursor.fetchall():
-                user_id = row[0]
-                features = pickle.loads(row[1])
-                features_dict[user_id] = np.array(features)
+                features = decode_features(row[1], row[2], row[3])
+                if features is not None:
+                    features_dict[row[0]] = features
             return features_dict
         except sqlite3.Error as e:
             logger.error(f"Error fetching all user features: {e}")
@@ -351,6 +509,40 @@ class DatabaseManager:
         except Exception as e:
             print(f"Lỗi DB: {e}")
             return None
+    
+    def get_camera_masks(self, camera_id: int) -> Optional[Dict]:
+        """
+        Lấy vùng phát hiện (đa giác include/exclude) của camera.
+        
+        Returns:
+            {'include': [...], 'exclude': [...]} - mỗi đa giác là danh sách [x, y]
+            chuẩn hoá 0..1; None nếu camera chưa có vùng
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT detection_masks FROM cameras WHERE id = ?', (camera_id,))
+            row = cursor.fetchone()
+            if row is None or not row[0]:
+                return None
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Error fetching detection masks for camera {camera_id}: {e}")
+            return None
+    
+    def update_camera_masks(self, camera_id: int, masks: Optional[Dict]) -> bool:
+        """Lưu vùng phát hiện của camera (None hoặc không có đa giác = xoá vùng)"""
+        if masks and not (masks.get('include') or masks.get('exclude')):
+            masks = None
+        try:
+            with self.db_lock:
+                cursor = self.conn.cursor()
+                cursor.execute('UPDATE cameras SET detection_masks = ? WHERE id = ?',
+                               (json.dumps(masks) if masks else None, camera_id))
+                self.conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error(f"Error updating detection masks for camera {camera_id}: {e}")
+            return False
     # ==================== DETECTION HISTORY ====================
     
     def log_detection(self, camera_id: int, detection_type: str, user_id: int = None, user_name: str = None) -> bool:
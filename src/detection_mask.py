@@ -0,0 +1,122 @@
+"""
+Module vùng phát hiện theo camera (đa giác include/exclude)
+Đa giác include được đổi thành các hình chữ nhật bao để Haar chỉ quét phần ảnh
+cần thiết; khuôn mặt có tâm nằm ngoài vùng include hoặc trong vùng exclude bị bỏ
+"""
+
+import logging
+import cv2
+import numpy as np
+from box_utils import intersect, merge_boxes
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionMask:
+    """
+    Vùng phát hiện của một camera.
+
+    Đa giác lưu theo toạ độ chuẩn hoá (0..1) nên không phụ thuộc độ phân giải
+    luồng; toạ độ pixel và hình chữ nhật bao được tính một lần cho mỗi kích
+    thước frame. Không có đa giác include = cả frame là vùng include.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        """
+        Args:
+            include: Danh sách đa giác [[x, y], ...] cần phát hiện
+            exclude: Danh sách đa giác [[x, y], ...] bỏ qua khuôn mặt
+        """
+        self.include = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in include if len(p) >= 3]
+        self.exclude = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in exclude if len(p) >= 3]
+        self._geometry = {}  # {(width, height): (crops, include_px, exclude_px)}
+
+    @classmethod
+    def from_dict(cls, masks):
+        """Tạo từ dict {'include': [...], 'exclude': [...]} như lưu trong bảng cameras"""
+        return cls(masks.get('include', []), masks.get('exclude', []))
+
+    def to_dict(self) -> dict:
+        return {
+            'include': [p.round(4).tolist() for p in self.include],
+            'exclude': [p.round(4).tolist() for p in self.exclude],
+        }
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def _get_geometry(self, width: int, height: int):
+        geometry = self._geometry.get((width, height))
+        if geometry is None:
+            size = np.array([width, height], dtype=np.float64)
+            include_px = [np.round(p * size).astype(np.int32) for p in self.include]
+            exclude_px = [np.round(p * size).astype(np.int32) for p in self.exclude]
+            crops = []
+            for polygon in include_px:
+                crop = intersect(cv2.boundingRect(polygon), (0, 0, width, height))
+                if crop is not None:
+                    crops.append(crop)
+            geometry = (merge_boxes(crops), include_px, exclude_px)
+            self._geometry[(width, height)] = geometry
+        return geometry
+
+    def clip_regions(self, regions, width: int, height: int):
+        """
+        Giới hạn các vùng quét vào hình chữ nhật bao của đa giác include.
+
+        Args:
+            regions: Danh sách (x, y, w, h) hoặc None (toàn frame)
+
+        Returns:
+            Danh sách vùng đã giới hạn ([] nếu không vùng nào giao vùng include);
+            regions giữ nguyên nếu không có đa giác include
+        """
+        if not self.include:
+            return regions
+        crops = self._get_geometry(width, height)[0]
+        if regions is None:
+            return list(crops)
+        clipped = []
+        for region in regions:
+            for crop in crops:
+                box = intersect(tuple(int(v) for v in region), crop)
+                if box is not None:
+                    clipped.append(box)
+        return clipped
+
+    def filter(self, faces, width: int, height: int):
+        """
+        Bỏ khuôn mặt có tâm nằm ngoài mọi đa giác include hoặc trong một đa giác exclude.
+
+        Returns:
+            numpy array (K, 4) int32 các khuôn mặt còn lại
+        """
+        faces = np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+        if len(faces) == 0:
+            return faces
+        _, include_px, exclude_px = self._get_geometry(width, height)
+        keep = []
+        for (x, y, w, h) in faces:
+            centre = (float(x + w / 2), float(y + h / 2))
+            inside = not include_px or any(cv2.pointPolygonTest(p, centre, False) >= 0 for p in include_px)
+            excluded = any(cv2.pointPolygonTest(p, centre, False) >= 0 for p in exclude_px)
+            keep.append(inside and not excluded)
+        return faces[np.asarray(keep, dtype=bool)]
+
+
+def load_detection_mask(db_manager, camera_id):
+    """
+    Đọc vùng phát hiện của camera từ bảng cameras.
+
+    Returns:
+        DetectionMask hoặc None nếu camera không có vùng
+    """
+    masks = db_manager.get_camera_masks(camera_id)
+    if not masks:
+        return None
+    mask = DetectionMask.from_dict(masks)
+    if not mask:
+        return None
+    logger.info(f"Camera {camera_id}: detection mask with {len(mask.include)} include / "
+                f"{len(mask.exclude)} exclude polygons")
+    return mask
@@ -0,0 +1,406 @@
+"""
+Module cung cấp bộ phát hiện khuôn mặt Haar Cascade dùng chung
+Mỗi thread worker nhận một instance CascadeClassifier riêng, chỉ tải XML một lần
+"""
+
+import os
+import cv2
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from config.config import DETECTION, camera_settings
+from box_utils import merge_boxes
+from detection_mask import load_detection_mask
+
+logger = logging.getLogger(__name__)
+
+FACE_CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+
+
+class DetectionProfile(NamedTuple):
+    """
+    Tham số phát hiện khuôn mặt riêng của một camera (bất biến, gửi được sang process worker).
+
+    detection_width: chiều rộng ảnh xám đưa vào cascade; frame rộng hơn được thu
+        nhỏ trước khi phát hiện rồi ánh xạ hộp về toạ độ gốc (0 = độ phân giải gốc)
+    min_face_size, max_face_size: giới hạn cạnh khuôn mặt (pixel frame gốc, 0 = không
+        giới hạn), chuyển thành minSize/maxSize của detectMultiScale
+    coarse_to_fine: quét thô (bước scale lớn, ít neighbor) rồi chỉ quét mịn quanh ứng viên
+    coarse_scale_factor, coarse_min_neighbors: tham số lượt quét thô
+    refine_padding: nới rộng mỗi ứng viên (tỷ lệ cạnh) khi quét mịn
+    tile_grid: (cột, hàng) - chia ảnh thành các ô chồng lấn, phát hiện song song
+        trên pool thread (OpenCV nhả GIL); (1, 1) = không chia ô. Chỉ có hiệu lực khi
+        cạnh khuôn mặt bị chặn trên (max_face_size hoặc dải học được của FaceSizeModel);
+        không chặn thì vẫn quét nguyên vùng để khuôn mặt lớn nằm vắt qua đường nối không bị sót
+    tile_overlap: phần chồng lấn giữa các ô (tỷ lệ cạnh ô, tối thiểu bằng max_face_size)
+    mask: DetectionMask của camera (đa giác include/exclude) hoặc None
+    quality: QualityGate kiểm tra khuôn mặt trước khi trích xuất, hoặc None
+    """
+    detection_width: int = 0
+    min_face_size: int = 0
+    max_face_size: int = 0
+    coarse_to_fine: bool = False
+    coarse_scale_factor: float = 1.3
+    coarse_min_neighbors: int = 3
+    refine_padding: float = 0.5
+    tile_grid: tuple = (1, 1)
+    tile_overlap: float = 0.25
+    mask: object = None
+    quality: object = None
+
+
+def create_detection_profile(camera_id=None, db_manager=None) -> DetectionProfile:
+    """
+    Tạo DetectionProfile cho camera theo DETECTION trong config (ghi đè theo camera qua DETECTION['cameras']).
+
+    Args:
+        db_manager: DatabaseManager để đọc vùng phát hiện của camera (None = không dùng vùng)
+    """
+    settings = {k: v for k, v in camera_settings(DETECTION, camera_id).items()
+                if k in DetectionProfile._fields and k not in ('mask', 'quality')}
+    mask = load_detection_mask(db_manager, camera_id) if db_manager is not None else None
+    # Import trong hàm: face_quality dùng CascadeProvider của module này
+    from face_quality import create_quality_gate
+    return DetectionProfile(mask=mask, quality=create_quality_gate(camera_id), **settings)
+
+
+class FaceSizeModel:
+    """
+    Thống kê kích thước khuôn mặt đã phát hiện của một camera.
+
+    Sau khi có đủ min_samples mẫu, apply() thu hẹp khoảng scale của cascade về
+    [percentile thấp x (1 - margin), percentile cao x (1 + margin)] của các mẫu
+    gần nhất (camera cố định chỉ thấy khuôn mặt trong một dải kích thước). Cứ
+    explore_interval lần phát hiện lại có một lần quét không giới hạn đã học,
+    để khuôn mặt có kích thước mới vẫn được ghi nhận và giới hạn tự điều chỉnh.
+    Mỗi track chỉ đóng góp một mẫu (lần đầu xuất hiện), nên một người đứng lâu
+    trước camera không chiếm hết cửa sổ mẫu và làm dải kích thước co lại.
+    """
+
+    def __init__(self, min_samples: int = 50, window: int = 500, low_percentile: float = 2,
+                 high_percentile: float = 98, margin: float = 0.25, explore_interval: int = 50):
+        """
+        Args:
+            min_samples: Số mẫu tối thiểu trước khi bắt đầu giới hạn
+            window: Số mẫu gần nhất được giữ lại
+            low_percentile, high_percentile: Percentile kích thước dùng làm biên
+            margin: Nới rộng biên theo tỷ lệ
+            explore_interval: Số lần phát hiện giữa hai lần quét toàn dải (0 = không bao giờ)
+        """
+        self.min_samples = min_samples
+        self.low_percentile = low_percentile
+        self.high_percentile = high_percentile
+        self.margin = margin
+        self.explore_interval = explore_interval
+        self.samples = deque(maxlen=window)
+        self._observed_tracks = deque(maxlen=window)  # track_id đã đóng góp mẫu
+        self.bounds = None  # (min_size, max_size) đã học, None = chưa đủ mẫu
+        self._calls = 0
+        self.bounded = 0  # Số lần phát hiện có giới hạn kích thước
+        self.explored = 0  # Số lần quét toàn dải
+
+    def observe(self, sizes, track_ids=None):
+        """
+        Ghi nhận cạnh (pixel frame gốc) của các khuôn mặt vừa phát hiện.
+
+        Args:
+            sizes: Cạnh của từng khuôn mặt
+            track_ids: track_id tương ứng (None = không theo dõi); khuôn mặt thuộc
+                track đã ghi nhận trước đó bị bỏ qua
+        """
+        if track_ids is None:
+            track_ids = [None] * len(sizes)
+        fresh = []
+        for size, track_id in zip(sizes, track_ids):
+            if track_id is not None:
+                if track_id in self._observed_tracks:
+                    continue
+                self._observed_tracks.append(track_id)
+            fresh.append(int(size))
+        if not fresh:
+            return
+        self.samples.extend(fresh)
+        if len(self.samples) >= self.min_samples:
+            low, high = np.percentile(self.samples, (self.low_percentile, self.high_percentile))
+            self.bounds = (int(low * (1 - self.margin)), int(np.ceil(high * (1 + self.margin))))
+
+    def apply(self, profile: DetectionProfile) -> DetectionProfile:
+        """
+        Trả profile kèm giới hạn kích thước đã học cho lần phát hiện kế tiếp.
+
+        Giới hạn cấu hình sẵn trong profile luôn được giữ; giới hạn đã học chỉ thu hẹp thêm.
+        """
+        self._calls += 1
+        if self.bounds is None:
+            return profile
+        if self.explore_interval and self._calls % self.explore_interval == 0:
+            self.explored += 1
+            return profile
+        self.bounded += 1
+        low, high = self.bounds
+        if profile.min_face_size:
+            low = max(low, profile.min_face_size)
+        if profile.max_face_size:
+            high = min(high, profile.max_face_size)
+        return profile._replace(min_face_size=low, max_face_size=max(low, high))
+
+    def get_stats(self) -> dict:
+        """Thống kê: số mẫu, giới hạn đã học, số lần phát hiện có giới hạn / quét toàn dải"""
+        return {
+            'samples': len(self.samples),
+            'bounds': self.bounds,
+            'bounded': self.bounded,
+            'explored': self.explored,
+        }
+
+
+def create_face_size_model(camera_id=None):
+    """
+    Tạo FaceSizeModel cho camera theo DETECTION['face_size_learning'].
+
+    Returns:
+        FaceSizeModel hoặc None nếu tắt học kích thước
+    """
+    settings = camera_settings(DETECTION, camera_id, key='face_size_learning')
+    if settings is None:
+        return None
+    return FaceSizeModel(**settings)
+
+
+def _suppress_duplicates(boxes, overlap: float = 0.5):
+    """
+    Loại hộp trùng ở đường nối giữa các ô (NMS tham lam).
+
+    Haar không trả điểm tin cậy nên hộp lớn hơn được giữ trước; hộp bị loại nếu
+    phần giao chiếm hơn overlap diện tích của hộp nhỏ hơn (khuôn mặt bị ô cắt
+    ngang chỉ cho hộp nhỏ nằm gần trọn trong hộp đầy đủ).
+    """
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+    if len(boxes) < 2:
+        return boxes
+    boxes = boxes[np.argsort(-(boxes[:, 2] * boxes[:, 3]), kind='stable')]
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    keep = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        inter_w = np.clip(np.minimum(x2[i], x2) - np.maximum(x1[i], x1), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2) - np.maximum(y1[i], y1), 0, None)
+        suppressed |= inter_w * inter_h > overlap * np.minimum(areas[i], areas)
+    return boxes[keep]
+
+
+class CascadeProvider:
+    """
+    Cấp phát CascadeClassifier theo thread.
+
+    CascadeClassifier không an toàn khi dùng chung giữa nhiều thread, nên mỗi
+    thread được tải lười một instance riêng ở lần gọi đầu tiên và dùng lại cho
+    các frame sau, thay vì parse lại file XML (~1 MB) ở mỗi frame.
+    """
+
+    def __init__(self, cascade_file: str = FACE_CASCADE_FILE, tile_workers: int = None):
+        """
+        Args:
+            cascade_file: Tên file cascade trong cv2.data.haarcascades
+            tile_workers: Số thread phát hiện theo ô (mặc định theo DETECTION; 0 = số CPU)
+        """
+        self.cascade_path = cv2.data.haarcascades + cascade_file
+        if tile_workers is None:
+            tile_workers = DETECTION.get('tile_workers', 0)
+        self.tile_workers = tile_workers or os.cpu_count() or 1
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.load_count = 0
+        self.load_time_total = 0.0
+        self.call_count = 0
+
+    def get(self) -> 'cv2.CascadeClassifier':
+        """Lấy CascadeClassifier của thread hiện tại (tải nếu chưa có)"""
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            start = time.perf_counter()
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+            elapsed = time.perf_counter() - start
+            if cascade.empty():
+                logger.error(f"Failed to load cascade: {self.cascade_path}")
+            with self._stats_lock:
+                self.load_count += 1
+                self.load_time_total += elapsed
+            self._local.cascade = cascade
+            logger.info(f"Cascade loaded for thread {threading.current_thread().name} in {elapsed * 1000:.1f} ms")
+        return cascade
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Pool thread phát hiện theo ô (tạo lười ở lần chia ô đầu tiên)"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.tile_workers, thread_name_prefix='FaceTile')
+            return self._executor
+
+    def detect(self, gray, scale_factor: float = 1.1, min_neighbors: int = 8, **kwargs):
+        """Chạy detectMultiScale bằng cascade của thread hiện tại"""
+        cascade = self.get()
+        with self._stats_lock:
+            self.call_count += 1
+        return cascade.detectMultiScale(gray, scale_factor, min_neighbors, **kwargs)
+
+    def detect_regions(self, gray, regions=None, scale_factor: float = 1.1, min_neighbors: int = 8,
+                       profile: DetectionProfile = None, **kwargs):
+        """
+        Chạy detectMultiScale chỉ trong các vùng (x, y, w, h) của ảnh xám.
+
+        Nếu profile.detection_width nhỏ hơn chiều rộng ảnh, mỗi vùng được thu nhỏ
+        cùng tỷ lệ trước khi chạy cascade (chi phí giảm xấp xỉ theo bình phương tỷ
+        lệ) và hộp tìm được được ánh xạ ngược về toạ độ ảnh gốc, nên ROI trích
+        xuất đặc trưng vẫn cắt từ ảnh độ phân giải gốc. Giới hạn kích thước khuôn
+        mặt của profile được đổi sang minSize/maxSize theo cùng tỷ lệ.
+
+        Vùng quét được giới hạn vào hình chữ nhật bao của đa giác include của
+        profile.mask, và khuôn mặt có tâm ngoài vùng include / trong vùng exclude bị bỏ.
+
+        Với profile.tile_grid khác (1, 1) và kích thước khuôn mặt bị chặn trên (maxSize),
+        mỗi vùng được chia thành các ô chồng lấn chạy song song trên pool thread; hộp
+        trùng ở đường nối được loại bằng NMS.
+
+        Args:
+            regions: Danh sách vùng cần quét; None = quét toàn ảnh
+            profile: DetectionProfile của camera (None = mặc định)
+
+        Returns:
+            numpy array (K, 4) int32 các khuôn mặt theo toạ độ ảnh gốc
+        """
+        height, width = gray.shape[:2]
+        scale = 1.0
+        if profile is not None and 0 < profile.detection_width < width:
+            scale = profile.detection_width / width
+        mask = profile.mask if profile is not None else None
+        if mask is not None:
+            regions = mask.clip_regions(regions, width, height)
+        if regions is None:
+            regions = [(0, 0, width, height)]
+        if profile is not None and profile.min_face_size > 0:
+            size = max(1, int(profile.min_face_size * scale))
+            kwargs.setdefault('minSize', (size, size))
+        if profile is not None and profile.max_face_size > 0:
+            size = max(1, int(np.ceil(profile.max_face_size * scale)))
+            kwargs.setdefault('maxSize', (size, size))
+        coarse_to_fine = profile is not None and profile.coarse_to_fine
+        # Chồng lấn >= maxSize bảo đảm mọi khuôn mặt nằm trọn trong một ô; không có maxSize
+        # thì khuôn mặt có thể lớn bằng cả vùng nên không chia ô
+        tiled = (profile is not None and profile.tile_grid[0] * profile.tile_grid[1] > 1
+                 and 'maxSize' in kwargs)
+
+        jobs = []  # (vùng, ảnh cần quét, offset ô trong ảnh phát hiện của vùng)
+        for region in regions:
+            rx, ry, rw, rh = region
+            roi = gray[ry:ry+rh, rx:rx+rw]
+            if scale < 1.0:
+                small_size = (max(1, int(round(rw * scale))), max(1, int(round(rh * scale))))
+                roi = cv2.resize(roi, small_size, interpolation=cv2.INTER_AREA)
+            tiles = self._tiles(roi.shape, profile, kwargs) if tiled else [(0, 0, roi.shape[1], roi.shape[0])]
+            for (tx, ty, tw, th) in tiles:
+                jobs.append((region, roi[ty:ty+th, tx:tx+tw], tx, ty))
+
+        def run(image):
+            if coarse_to_fine:
+                return self._detect_coarse_to_fine(image, scale_factor, min_neighbors, profile, **kwargs)
+            return self.detect(image, scale_factor, min_neighbors, **kwargs)
+
+        images = [image for _, image, _, _ in jobs]
+        if tiled and len(jobs) > 1:
+            results = list(self._get_executor().map(run, images))
+        else:
+            results = [run(image) for image in images]
+
+        found = []
+        for ((rx, ry, rw, rh), _, tx, ty), faces in zip(jobs, results):
+            for (x, y, w, h) in faces:
+                x, y = x + tx, y + ty
+                if scale < 1.0:
+                    x, y = int(x / scale), int(y / scale)
+                    w, h = min(int(round(w / scale)), rw - x), min(int(round(h / scale)), rh - y)
+                found.append((x + rx, y + ry, w, h))
+        faces = _suppress_duplicates(found) if tiled else np.asarray(found, dtype=np.int32).reshape(-1, 4)
+        if mask is not None:
+            faces = mask.filter(faces, width, height)
+        return faces
+
+    @staticmethod
+    def _tiles(shape, profile, kwargs):
+        """
+        Chia ảnh (h, w) thành lưới ô chồng lấn theo profile.tile_grid.
+
+        Phần chồng lấn không nhỏ hơn khuôn mặt lớn nhất cần tìm (maxSize, bắt buộc
+        khi chia ô), nên mọi khuôn mặt đủ điều kiện đều nằm trọn trong ít nhất một ô.
+        """
+        height, width = shape[:2]
+        cols, rows = profile.tile_grid
+        tile_w, tile_h = -(-width // cols), -(-height // rows)
+        overlap = max(int(profile.tile_overlap * min(tile_w, tile_h)), kwargs['maxSize'][0])
+        tiles = []
+        for row in range(rows):
+            for col in range(cols):
+                x0, y0 = col * tile_w, row * tile_h
+                if x0 >= width or y0 >= height:
+                    continue
+                x1, y1 = min(width, x0 + tile_w + overlap), min(height, y0 + tile_h + overlap)
+                tiles.append((x0, y0, x1 - x0, y1 - y0))
+        return tiles
+
+    def _detect_coarse_to_fine(self, gray, scale_factor, min_neighbors, profile, **kwargs):
+        """
+        Quét thô toàn ảnh (bước scale lớn, ít neighbor nên nhanh nhưng nhiều ứng
+        viên sai), rồi quét mịn với tham số gốc chỉ trong vùng quanh ứng viên,
+        giới hạn quanh kích thước ứng viên. Ứng viên sai bị loại ở lượt mịn.
+        """
+        height, width = gray.shape[:2]
+        candidates = self.detect(gray, profile.coarse_scale_factor, profile.coarse_min_neighbors, **kwargs)
+        windows = []
+        for (x, y, w, h) in candidates:
+            pad_x, pad_y = int(w * profile.refine_padding), int(h * profile.refine_padding)
+            x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+            x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+            windows.append((x0, y0, x1 - x0, y1 - y0))
+
+        found = []
+        for (wx, wy, ww, wh) in merge_boxes(windows):
+            # Kích thước ứng viên nằm trong cửa sổ (ước lượng thô, sai số ~ một bước scale)
+            sizes = [w for (x, y, w, h) in candidates
+                     if wx <= x and wy <= y and x + w <= wx + ww and y + h <= wy + wh]
+            fine_kwargs = dict(kwargs)
+            min_size = int(min(sizes) / profile.coarse_scale_factor)
+            max_size = int(np.ceil(max(sizes) * profile.coarse_scale_factor))
+            if 'minSize' in kwargs:
+                min_size = max(min_size, kwargs['minSize'][0])
+            if 'maxSize' in kwargs:
+                max_size = min(max_size, kwargs['maxSize'][0])
+            fine_kwargs['minSize'] = (min_size, min_size)
+            fine_kwargs['maxSize'] = (max(min_size, max_size), max(min_size, max_size))
+            for (x, y, w, h) in self.detect(gray[wy:wy+wh, wx:wx+ww], scale_factor, min_neighbors, **fine_kwargs):
+                found.append((x + wx, y + wy, w, h))
+        return found
+
+    def get_stats(self) -> dict:
+        """Thống kê: số lần tải, tổng thời gian tải (giây), số lần gọi detect"""
+        with self._stats_lock:
+            return {
+                'load_count': self.load_count,
+                'load_time_total': self.load_time_total,
+                'call_count': self.call_count,
+            }
+
+
+# Provider dùng chung cho toàn ứng dụng
+face_cascade_provider = CascadeProvider()
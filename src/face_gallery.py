@@ -0,0 +1,318 @@
+"""
+Module lưu trữ gallery khuôn mặt đã biết dưới dạng ma trận đặc trưng liền khối
+Dùng cho so khớp vector hoá (tất cả khuôn mặt x tất cả template trong một lần tính)
+"""
+
+import os
+import json
+import uuid
+import logging
+import numpy as np
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+
+def block_top2(queries, q_norms, matrix, sq_norms):
+    """
+    Tìm 2 template gần nhất trong một khối template cho từng truy vấn.
+
+    Args:
+        queries: (M, D) float32
+        q_norms: (M,) bình phương chuẩn của queries
+        matrix: (K, D) khối template
+        sq_norms: (K,) bình phương chuẩn của khối template
+
+    Returns:
+        Tuple (idx1, sq1, sq2): chỉ số cục bộ trong khối của template gần nhất,
+        bình phương khoảng cách gần nhất và gần thứ hai (inf nếu khối có 1 hàng)
+    """
+    count = queries.shape[0]
+    sq_dists = q_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(sq_dists, 0.0, out=sq_dists)
+    rows = np.arange(count)
+    if matrix.shape[0] > 1:
+        top2 = np.argpartition(sq_dists, 1, axis=1)[:, :2]
+        top2_sq = sq_dists[rows[:, None], top2]
+        order = np.argsort(top2_sq, axis=1)
+        return top2[rows, order[:, 0]], top2_sq[rows, order[:, 0]], top2_sq[rows, order[:, 1]]
+    return np.zeros(count, dtype=np.int64), sq_dists[:, 0], np.full(count, np.inf, dtype=sq_dists.dtype)
+
+
+def merge_top2(current, candidate):
+    """
+    Gộp hai kết quả top-2 (idx1, sq1, sq2) với chỉ số đã quy về toàn gallery.
+    """
+    idx_a, best_a, second_a = current
+    idx_b, best_b, second_b = candidate
+    take = best_b < best_a
+    idx = np.where(take, idx_b, idx_a)
+    best = np.where(take, best_b, best_a)
+    second = np.where(take, np.minimum(best_a, second_b), np.minimum(second_a, best_b))
+    return idx, best, second
+
+
+class FaceGallery:
+    """
+    Gallery các template Zernike (bất biến sau khi tạo).
+
+    - matrix: ma trận float32 (N, D) liền khối, hàng i là template thứ i
+    - sq_norms: bình phương chuẩn của từng hàng, tính sẵn để dùng trong
+      ||q - t||^2 = ||q||^2 + ||t||^2 - 2 q.t
+    - ids, names, categories: thông tin người dùng tương ứng với từng hàng
+
+    Mảng được khoá chỉ đọc và metadata là tuple; các thao tác thay đổi trả về
+    gallery mới, nên nhiều thread có thể đọc cùng một gallery mà không cần lock.
+    """
+
+    def __init__(self, encodings=None, ids=None, names=None, categories=None, dim: int = 0):
+        """
+        Args:
+            encodings: Danh sách vector đặc trưng (cùng số chiều)
+            ids: Danh sách user_id tương ứng
+            names: Danh sách tên tương ứng
+            categories: Danh sách phân loại ('whitelist'/'blacklist') tương ứng
+            dim: Số chiều khi gallery rỗng
+        """
+        encodings = encodings if encodings is not None else []
+        ids = tuple(ids) if ids is not None else ()
+        names = tuple(names) if names is not None else ()
+        categories = tuple(categories) if categories is not None else (None,) * len(ids)
+        if len(encodings):
+            matrix = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32)
+        else:
+            matrix = np.empty((0, dim), dtype=np.float32)
+        self._set(matrix, np.einsum('ij,ij->i', matrix, matrix), ids, names, categories)
+
+    def _set(self, matrix, sq_norms, ids, names, categories):
+        """Gán dữ liệu và khoá các mảng ở chế độ chỉ đọc"""
+        matrix.setflags(write=False)
+        sq_norms.setflags(write=False)
+        self.matrix = matrix
+        self.sq_norms = sq_norms
+        self.ids = ids
+        self.names = names
+        self.categories = categories
+
+    @classmethod
+    def _from_parts(cls, matrix, sq_norms, ids, names, categories):
+        """Tạo gallery từ các phần đã tính sẵn (không sao chép)"""
+        gallery = cls.__new__(cls)
+        gallery._set(matrix, sq_norms, tuple(ids), tuple(names), tuple(categories))
+        return gallery
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def with_template(self, user_id: int, name: str, category: str, features) -> 'FaceGallery':
+        """Trả về gallery mới có thêm một template ở cuối"""
+        row = np.asarray(features, dtype=np.float32).reshape(1, -1)
+        matrix = np.ascontiguousarray(row if len(self) == 0 else np.vstack([self.matrix, row]))
+        sq_norms = np.append(self.sq_norms, np.einsum('ij,ij->i', row, row))
+        return FaceGallery._from_parts(matrix, sq_norms, self.ids + (user_id,),
+                                       self.names + (name,), self.categories + (category,))
+
+    def without_user(self, user_id: int) -> 'FaceGallery':
+        """Trả về gallery mới không còn template nào của người dùng (self nếu không có gì để xóa)"""
+        keep = np.array([uid != user_id for uid in self.ids], dtype=bool)
+        if keep.all():
+            return self
+        return FaceGallery._from_parts(
+            np.ascontiguousarray(self.matrix[keep]), self.sq_norms[keep],
+            [v for v, k in zip(self.ids, keep) if k],
+            [v for v, k in zip(self.names, keep) if k],
+            [v for v, k in zip(self.categories, keep) if k],
+        )
+
+    def with_category(self, user_id: int, category: str) -> 'FaceGallery':
+        """Trả về gallery mới với phân loại đã cập nhật (dùng chung ma trận đặc trưng)"""
+        categories = [category if uid == user_id else cat for uid, cat in zip(self.ids, self.categories)]
+        return FaceGallery._from_parts(self.matrix, self.sq_norms, self.ids, self.names, categories)
+
+    def empty_result(self, count: int):
+        """Kết quả so khớp khi không có template nào"""
+        return np.full(count, -1, dtype=np.int64), np.full(count, np.inf), np.full(count, np.inf)
+
+    def finalize(self, queries, top2):
+        """
+        Chuyển kết quả top-2 (bình phương khoảng cách) thành kết quả so khớp.
+
+        Khoảng cách tới template tốt nhất được tính lại chính xác bằng float64
+        để tránh sai số triệt tiêu của công thức khai triển trên float32.
+        """
+        best_idx, best_sq, second_sq = top2
+        best_idx = best_idx.astype(np.int64)
+        diff = self.matrix[best_idx].astype(np.float64) - queries.astype(np.float64)
+        best_dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        second_dist = np.sqrt(second_sq.astype(np.float64))
+        # Truy vấn không có ứng viên nào (VD: chỉ mục xấp xỉ quét phải cụm rỗng)
+        missing = np.isinf(best_sq)
+        best_idx[missing] = -1
+        best_dist[missing] = np.inf
+        return best_idx, best_dist, second_dist
+
+    def match(self, queries, block_size: int = 0):
+        """
+        So khớp tất cả vector truy vấn với tất cả template (quét toàn bộ, chính xác).
+
+        Args:
+            queries: numpy array (M, D) vector đặc trưng của các khuôn mặt
+            block_size: Số template mỗi khối (0 = một khối duy nhất); khối nhỏ
+                giới hạn bộ nhớ trung gian (M, block_size) khi gallery rất lớn
+
+        Returns:
+            Tuple (best_idx, best_dist, second_dist), mỗi phần tử là mảng (M,):
+            - best_idx: chỉ số template gần nhất (-1 nếu gallery rỗng)
+            - best_dist: khoảng cách Euclidean tới template gần nhất
+            - second_dist: khoảng cách tới template gần thứ hai (inf nếu không có)
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        count = queries.shape[0]
+        if count == 0 or len(self) == 0:
+            return self.empty_result(count)
+
+        q_norms = np.einsum('ij,ij->i', queries, queries)
+        step = block_size if block_size > 0 else len(self)
+        top2 = None
+        for start in range(0, len(self), step):
+            stop = min(start + step, len(self))
+            idx, best, second = block_top2(queries, q_norms, self.matrix[start:stop], self.sq_norms[start:stop])
+            candidate = (idx + start, best, second)
+            top2 = candidate if top2 is None else merge_top2(top2, candidate)
+        return self.finalize(queries, top2)
+
+
+class GallerySnapshot(NamedTuple):
+    """
+    Ảnh chụp bất biến của gallery cùng chỉ mục tìm kiếm dựng trên nó.
+
+    Bộ nhận diện thay thế cả snapshot bằng một phép gán tham chiếu duy nhất,
+    nên thread đọc luôn thấy gallery, chỉ mục và phiên bản khớp nhau.
+    """
+    gallery: FaceGallery
+    index: object
+    version: Optional[int]
+
+
+def save_gallery_snapshot(gallery: FaceGallery, base_path: str, version: int, db_uid: int,
+                          descriptor_version: int = None, index_layout: dict = None) -> bool:
+    """
+    Lưu gallery ra file để lần khởi động sau mở bằng mmap thay vì đọc lại DB.
+
+    Gồm 2 file .npy (ma trận đặc trưng, bình phương chuẩn) mang hậu tố duy nhất
+    và file manifest <base_path>.json trỏ tới chúng. Manifest được ghi sau cùng
+    bằng os.replace nên người đọc không bao giờ thấy snapshot ghi dở; file .npy
+    cũ (có thể đang được mmap) chỉ bị xóa khi hệ điều hành cho phép.
+
+    Nếu có index_layout của chỉ mục IVF, các hàng được ghi theo thứ tự cụm và
+    tâm cụm / offsets được lưu kèm, để lần sau dựng lại chỉ mục trên ma trận
+    mmap mà không huấn luyện lại k-means hay sao chép ma trận.
+
+    Args:
+        gallery: FaceGallery cần lưu
+        base_path: Đường dẫn gốc (không phần mở rộng)
+        version: users_version của DB mà gallery phản ánh
+        db_uid: Định danh file DB
+        descriptor_version: Phiên bản descriptor Zernike của các template
+        index_layout: IVFIndex.layout() ({'order', 'centroids', 'offsets'}) hoặc None
+
+    Returns:
+        True nếu thành công
+    """
+    directory = os.path.dirname(base_path) or '.'
+    prefix = os.path.basename(base_path)
+    token = uuid.uuid4().hex[:12]
+    manifest_path = base_path + '.json'
+    try:
+        matrix, sq_norms = gallery.matrix, gallery.sq_norms
+        ids, names, categories = gallery.ids, gallery.names, gallery.categories
+        arrays = []
+        if index_layout is not None:
+            order = index_layout['order']
+            if order is not None:
+                matrix, sq_norms = matrix[order], sq_norms[order]
+                ids = [ids[i] for i in order]
+                names = [names[i] for i in order]
+                categories = [categories[i] for i in order]
+            arrays = [('ivf_centroids', index_layout['centroids']), ('ivf_offsets', index_layout['offsets'])]
+        files = {}
+        for key, array in [('matrix', matrix), ('sq_norms', sq_norms)] + arrays:
+            name = f"{prefix}_{key}_{token}.npy"
+            with open(os.path.join(directory, name), 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            files[key] = name
+
+        manifest = {
+            'format': SNAPSHOT_FORMAT,
+            'version': version,
+            'db_uid': db_uid,
+            'descriptor_version': descriptor_version,
+            'count': len(gallery),
+            'dim': int(gallery.matrix.shape[1]),
+            'files': files,
+            'index_mode': 'ivf' if index_layout is not None else None,
+            'ids': list(ids),
+            'names': list(names),
+            'categories': list(categories),
+        }
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to save gallery snapshot: {e}")
+        return False
+
+    # Dọn các file .npy của snapshot cũ
+    for name in os.listdir(directory):
+        if name.startswith(prefix + '_') and name.endswith('.npy') and name not in files.values():
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return True
+
+
+def load_gallery_snapshot(base_path: str, version: int, db_uid: int,
+                          descriptor_version: int = None):
+    """
+    Mở snapshot gallery bằng np.load(mmap_mode='r') nếu nó khớp phiên bản DB và
+    phiên bản descriptor (snapshot của descriptor khác bị bỏ qua để dựng lại từ DB).
+
+    Returns:
+        (gallery, index_layout) hoặc None nếu không có snapshot hợp lệ:
+        - gallery: FaceGallery (ma trận được mmap, chỉ trang nào được đọc mới nạp vào RAM)
+        - index_layout: {'mode': 'ivf', 'centroids', 'offsets'} nếu snapshot lưu kèm
+          chỉ mục IVF (hàng đã theo thứ tự cụm), ngược lại None
+    """
+    manifest_path = base_path + '.json'
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('version') != version
+                or manifest.get('db_uid') != db_uid or manifest.get('descriptor_version') != descriptor_version):
+            return None
+        directory = os.path.dirname(base_path) or '.'
+        matrix = np.load(os.path.join(directory, manifest['files']['matrix']), mmap_mode='r')
+        sq_norms = np.load(os.path.join(directory, manifest['files']['sq_norms']), mmap_mode='r')
+        count = manifest['count']
+        if matrix.shape != (count, manifest['dim']) or sq_norms.shape != (count,) or len(manifest['ids']) != count:
+            logger.warning("Gallery snapshot is inconsistent, ignoring it")
+            return None
+        gallery = FaceGallery._from_parts(matrix, sq_norms, manifest['ids'], manifest['names'],
+                                          manifest['categories'])
+        index_layout = None
+        if manifest.get('index_mode') == 'ivf':
+            index_layout = {
+                'mode': 'ivf',
+                'centroids': np.load(os.path.join(directory, manifest['files']['ivf_centroids'])),
+                'offsets': np.load(os.path.join(directory, manifest['files']['ivf_offsets'])),
+            }
+        return gallery, index_layout
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Failed to load gallery snapshot: {e}")
+        return None
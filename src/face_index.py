@@ -0,0 +1,188 @@
+"""
+Module chỉ mục tìm kiếm láng giềng gần nhất cho gallery khuôn mặt
+- 'exact': quét toàn bộ gallery (chính xác tuyệt đối)
+- 'ivf': lượng tử hoá thô kiểu IVF (k-means bằng NumPy), chỉ quét nprobe cụm gần nhất
+"""
+
+import time
+import logging
+import numpy as np
+from face_gallery import block_top2, merge_top2
+
+logger = logging.getLogger(__name__)
+
+
+class ExactIndex:
+    """
+    Chỉ mục quét toàn bộ (brute-force).
+
+    Knob: block_size - số template mỗi khối tính khoảng cách (0 = một khối).
+    """
+
+    mode = 'exact'
+
+    def __init__(self, gallery, block_size: int = 0):
+        self.gallery = gallery
+        self.block_size = block_size
+
+    def search(self, queries):
+        """Trả về (best_idx, best_dist, second_dist) giống FaceGallery.match"""
+        return self.gallery.match(queries, block_size=self.block_size)
+
+    def layout(self):
+        """Quét toàn bộ không có cấu trúc cần lưu cùng snapshot"""
+        return None
+
+
+class IVFIndex:
+    """
+    Chỉ mục xấp xỉ dạng inverted file.
+
+    Template được phân vào nlist cụm bằng k-means; khi tìm kiếm chỉ các
+    template thuộc nprobe cụm có tâm gần truy vấn nhất được so khớp.
+
+    Knobs:
+    - nlist: số cụm (0 = tự động ~ sqrt(N))
+    - nprobe: số cụm quét cho mỗi truy vấn (tăng = recall cao hơn, chậm hơn)
+    - train_iters: số vòng lặp k-means khi dựng chỉ mục
+    - min_size: gallery nhỏ hơn ngưỡng này được quét toàn bộ
+
+    Có thể truyền centroids của chỉ mục cũ để chỉ gán lại template mà không
+    huấn luyện lại k-means (dùng khi gallery chỉ thay đổi vài hàng). Nếu truyền
+    thêm offsets thì gallery được coi là đã xếp theo cụm (snapshot lưu bằng
+    layout()): ma trận của gallery (có thể là mmap) được dùng trực tiếp, không
+    gán lại và không sao chép.
+    """
+
+    mode = 'ivf'
+
+    def __init__(self, gallery, nlist: int = 0, nprobe: int = 8, train_iters: int = 10,
+                 min_size: int = 1000, seed: int = 0, centroids=None, offsets=None):
+        self.gallery = gallery
+        self.nprobe = max(1, nprobe)
+        self.train_iters = train_iters
+        self.min_size = min_size
+        self.seed = seed
+        self.centroids = None
+
+        count = len(gallery)
+        if count < max(min_size, 2):
+            return
+
+        start = time.perf_counter()
+        if centroids is not None and centroids.shape[1] == gallery.matrix.shape[1]:
+            self.centroids = centroids
+            self.nlist = centroids.shape[0]
+            if offsets is not None and len(offsets) == self.nlist + 1 and offsets[-1] == count:
+                self.order = None  # Hàng của gallery đã theo thứ tự cụm
+                self.matrix = gallery.matrix
+                self.sq_norms = gallery.sq_norms
+                self.offsets = np.asarray(offsets)
+                logger.info(f"IVF index loaded: {count} templates, {self.nlist} lists")
+                return
+        else:
+            self.nlist = nlist if nlist > 0 else int(np.sqrt(count))
+            self.nlist = max(1, min(self.nlist, count))
+            self.centroids = self._train(gallery.matrix)
+        assignments = self._assign(gallery.matrix)
+
+        # Sắp xếp template theo cụm để mỗi cụm là một khối liền trong bộ nhớ
+        self.order = np.argsort(assignments, kind='stable')
+        self.matrix = np.ascontiguousarray(gallery.matrix[self.order])
+        self.sq_norms = gallery.sq_norms[self.order]
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(self.nlist + 1))
+        logger.info(f"IVF index built: {count} templates, {self.nlist} lists in {time.perf_counter() - start:.2f}s")
+
+    def layout(self):
+        """
+        Cấu trúc cụm để lưu cùng snapshot gallery.
+
+        Returns:
+            dict {'order', 'centroids', 'offsets'} hoặc None nếu chưa phân cụm;
+            order = None nghĩa là gallery đã theo thứ tự cụm
+        """
+        if self.centroids is None:
+            return None
+        return {'order': self.order, 'centroids': self.centroids, 'offsets': self.offsets}
+
+    def _assign(self, data, chunk: int = 8192):
+        """Gán mỗi vector vào tâm cụm gần nhất"""
+        c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        labels = np.empty(data.shape[0], dtype=np.int64)
+        for start in range(0, data.shape[0], chunk):
+            block = data[start:start + chunk]
+            scores = c_norms[None, :] - 2.0 * (block @ self.centroids.T)
+            labels[start:start + chunk] = np.argmin(scores, axis=1)
+        return labels
+
+    def _train(self, data):
+        """K-means đơn giản trên một mẫu của gallery"""
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(data.shape[0], self.nlist * 256)
+        sample = data[rng.choice(data.shape[0], sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, self.nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            labels = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=self.nlist)
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+        return self.centroids
+
+    def search(self, queries):
+        """Trả về (best_idx, best_dist, second_dist) giống FaceGallery.match"""
+        if self.centroids is None:
+            return self.gallery.match(queries)
+
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        count = queries.shape[0]
+        if count == 0:
+            return self.gallery.empty_result(0)
+
+        q_norms = np.einsum('ij,ij->i', queries, queries)
+        c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        scores = c_norms[None, :] - 2.0 * (queries @ self.centroids.T)
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argpartition(scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        best_idx = np.zeros(count, dtype=np.int64)
+        best_sq = np.full(count, np.inf, dtype=np.float32)
+        second_sq = np.full(count, np.inf, dtype=np.float32)
+        for i in range(count):
+            q = queries[i:i + 1]
+            top2 = (best_idx[i:i + 1], best_sq[i:i + 1], second_sq[i:i + 1])
+            for cluster in probes[i]:
+                start, stop = self.offsets[cluster], self.offsets[cluster + 1]
+                if start == stop:
+                    continue
+                idx, best, second = block_top2(q, q_norms[i:i + 1], self.matrix[start:stop], self.sq_norms[start:stop])
+                rows = idx + start if self.order is None else self.order[idx + start]
+                top2 = merge_top2(top2, (rows, best, second))
+            best_idx[i], best_sq[i], second_sq[i] = top2[0][0], top2[1][0], top2[2][0]
+        return self.gallery.finalize(queries, (best_idx, best_sq, second_sq))
+
+
+INDEX_TYPES = {
+    ExactIndex.mode: ExactIndex,
+    IVFIndex.mode: IVFIndex,
+}
+
+
+def build_index(gallery, mode: str = 'exact', **params):
+    """
+    Dựng chỉ mục cho gallery.
+
+    Args:
+        gallery: FaceGallery
+        mode: 'exact' hoặc 'ivf'
+        **params: Knob của loại chỉ mục tương ứng
+
+    Returns:
+        ExactIndex hoặc IVFIndex
+    """
+    index_cls = INDEX_TYPES.get(mode)
+    if index_cls is None:
+        logger.warning(f"Unknown index mode '{mode}', falling back to exact")
+        index_cls = ExactIndex
+    return index_cls(gallery, **params)
@@ -0,0 +1,104 @@
+"""
+Module cổng chất lượng khuôn mặt đặt giữa bước phát hiện và trích xuất Zernike
+Kiểm tra kích thước, độ nét (phương sai Laplacian), độ phơi sáng và tuỳ chọn xác
+minh mắt bằng cascade; khuôn mặt kém chất lượng vẫn hiển thị nhưng không được
+trích xuất, so khớp hay ghi lịch sử
+"""
+
+import logging
+import cv2
+from config.config import QUALITY, camera_settings
+from face_detector import CascadeProvider
+
+logger = logging.getLogger(__name__)
+
+EYE_CASCADE_FILE = 'haarcascade_eye.xml'
+
+# Cascade mắt chỉ được tải (theo thread) khi có camera bật check_eyes
+eye_cascade_provider = CascadeProvider(EYE_CASCADE_FILE)
+
+# Kích thước chuẩn để đo độ nét: ngưỡng không phụ thuộc kích thước khuôn mặt
+SHARPNESS_SIZE = (64, 64)
+
+
+class QualityGate:
+    """
+    Cổng chất lượng khuôn mặt của một camera.
+
+    assess(roi) trả về None nếu khuôn mặt đạt, hoặc lý do bị loại:
+    'size', 'blur', 'exposure', 'eyes'. Các phép kiểm tra chạy theo thứ tự chi
+    phí tăng dần và dừng ở lỗi đầu tiên.
+    """
+
+    def __init__(self, min_size: int = 40, min_sharpness: float = 30.0, min_brightness: float = 30.0,
+                 max_brightness: float = 225.0, min_contrast: float = 15.0, check_eyes: bool = False,
+                 min_eyes: int = 1):
+        """
+        Args:
+            min_size: Cạnh khuôn mặt nhỏ nhất (pixel frame gốc)
+            min_sharpness: Phương sai Laplacian tối thiểu (đo trên ROI thu về 64x64)
+            min_brightness, max_brightness: Khoảng độ sáng trung bình chấp nhận
+            min_contrast: Độ lệch chuẩn mức xám tối thiểu (ảnh bệt do ngược sáng / tối)
+            check_eyes: Xác minh có mắt trong nửa trên khuôn mặt bằng cascade mắt
+            min_eyes: Số mắt tối thiểu khi check_eyes
+        """
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.check_eyes = check_eyes
+        self.min_eyes = min_eyes
+        self.passed = 0
+        self.rejected = {'size': 0, 'blur': 0, 'exposure': 0, 'eyes': 0}
+
+    def assess(self, roi):
+        """
+        Đánh giá ROI xám của một khuôn mặt.
+
+        Returns:
+            None nếu đạt; ngược lại lý do ('size', 'blur', 'exposure', 'eyes')
+        """
+        reason = self._assess(roi)
+        if reason is None:
+            self.passed += 1
+        else:
+            self.rejected[reason] += 1
+        return reason
+
+    def _assess(self, roi):
+        height, width = roi.shape[:2]
+        if min(width, height) < self.min_size:
+            return 'size'
+        small = cv2.resize(roi, SHARPNESS_SIZE, interpolation=cv2.INTER_AREA)
+        mean, std = cv2.meanStdDev(small)
+        if not self.min_brightness <= mean[0, 0] <= self.max_brightness or std[0, 0] < self.min_contrast:
+            return 'exposure'
+        if cv2.Laplacian(small, cv2.CV_64F).var() < self.min_sharpness:
+            return 'blur'
+        if self.check_eyes:
+            upper = roi[:int(height * 0.6)]
+            eye_size = max(1, width // 8)
+            eyes = eye_cascade_provider.detect(upper, 1.1, 3, minSize=(eye_size, eye_size))
+            if len(eyes) < self.min_eyes:
+                return 'eyes'
+        return None
+
+    def get_stats(self) -> dict:
+        """Thống kê: số khuôn mặt đạt và số bị loại theo lý do (chỉ trong process hiện tại)"""
+        return {'passed': self.passed, 'rejected': dict(self.rejected)}
+
+
+def create_quality_gate(camera_id=None):
+    """
+    Tạo QualityGate cho camera theo QUALITY trong config.
+
+    Cấu hình chung có thể bị ghi đè theo camera qua QUALITY['cameras'][camera_id].
+
+    Returns:
+        QualityGate hoặc None nếu tắt cổng chất lượng
+    """
+    settings = camera_settings(QUALITY, camera_id)
+    if settings is None:
+        return None
+    return QualityGate(**settings)
@@ -4,70 +4,464 @@ Module nhận diện khuôn mặt sử dụng Zernike Moments (mahotas)
 """
 import numpy as np
 import cv2
+import os
 import logging
-from zernike_utils import get_face_moments_zernike
+import threading
+from config.config import FACE_RECOGNITION
+from face_gallery import FaceGallery, GallerySnapshot, save_gallery_snapshot, load_gallery_snapshot
+from face_index import build_index
+from face_detector import face_cascade_provider
+from zernike_utils import DESCRIPTOR_VERSION, get_face_moments_zernike, get_faces_moments_zernike_batch
 
 logger = logging.getLogger(__name__)
 
+
+def select_face_rois(image, faces, profile=None):
+    """
+    Cắt ROI xám của các khuôn mặt và cho qua cổng chất lượng của profile.
+
+    Args:
+        image: Ảnh xám hoặc BGR
+        faces: Các (x, y, w, h)
+        profile: DetectionProfile của camera hoặc None (không có cổng chất lượng)
+
+    Returns:
+        (rois, reasons) - ROI xám của khuôn mặt đạt chất lượng và lý do bị loại
+        theo từng khuôn mặt (None = đạt)
+    """
+    gate = profile.quality if profile is not None else None
+    rois = []
+    reasons = []
+    for (x, y, w, h) in faces:
+        roi = image[y:y+h, x:x+w]
+        roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+        reason = gate.assess(roi) if gate is not None else None
+        if reason is None:
+            rois.append(roi)
+        reasons.append(reason)
+    return rois, reasons
+
+
 class FaceRecognizer:
     THRESHOLD = 0.06  # Ngưỡng nhận diện, có thể tinh chỉnh
     RADIUS = 100
     DEGREE = 8
 
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, index_mode=None, index_params=None):
         self.db_manager = db_manager
-        self.known_face_encodings = []  # Zernike vectors
-        self.known_face_ids = []
-        self.known_face_names = []
+        # Chỉ mục tìm kiếm: 'exact' hoặc 'ivf' (xem FACE_RECOGNITION trong config)
+        self.index_mode = index_mode or FACE_RECOGNITION.get('index_mode', 'exact')
+        if index_params is None:
+            index_params = FACE_RECOGNITION.get('index_params', {}).get(self.index_mode, {})
+        self.index_params = dict(index_params)
+        # Snapshot gallery trên đĩa (mmap) đặt cạnh file DB, VD: data/security_system_gallery.json
+        self.snapshot_path = None
+        if FACE_RECOGNITION.get('known_face_encodings_cache', True):
+            self.snapshot_path = os.path.splitext(db_manager.db_path)[0] + '_gallery'
+        # Lock chỉ dành cho các thao tác ghi; thread nhận diện đọc snapshot không cần lock
+        self._write_lock = threading.RLock()
+        self._snapshot = None
+        # Thay đổi từng người (thêm/xoá/đổi phân loại) chỉ đánh dấu snapshot trên đĩa là cũ;
+        # file được ghi một lần sau snapshot_save_delay giây, gộp nhiều thay đổi liên tiếp
+        self.snapshot_save_delay = FACE_RECOGNITION.get('snapshot_save_delay', 5.0)
+        self._snapshot_dirty = False
+        self._save_timer = None
+        # Đọc trên thread sở hữu kết nối sqlite; thread hẹn giờ ghi snapshot không được đụng tới DB
+        self._db_uid = None
+        self._publish(FaceGallery(), None)
         self.load_known_faces()
 
+    @property
+    def snapshot(self) -> GallerySnapshot:
+        """Snapshot gallery hiện tại (gallery, index, version)"""
+        return self._snapshot
+
+    @property
+    def gallery(self) -> FaceGallery:
+        return self._snapshot.gallery
+
+    @property
+    def index(self):
+        return self._snapshot.index
+
+    @property
+    def gallery_version(self):
+        """users_version của DB mà gallery đang phản ánh"""
+        return self._snapshot.version
+
+    def _publish(self, gallery, version, retrain=True, index_layout=None):
+        """
+        Dựng chỉ mục cho gallery mới và công bố snapshot bằng một phép gán nguyên tử.
+
+        Args:
+            retrain: False để giữ lại tâm cụm của chỉ mục cũ (nếu có) khi gallery
+                chỉ thay đổi vài hàng
+            index_layout: Cấu trúc chỉ mục lưu cùng snapshot trên đĩa; dựng lại chỉ
+                mục từ đó mà không huấn luyện lại (nếu cùng loại chỉ mục)
+        """
+        params = dict(self.index_params)
+        previous = self._snapshot.index if self._snapshot is not None else None
+        centroids = getattr(previous, 'centroids', None)
+        if index_layout is not None and index_layout['mode'] == self.index_mode:
+            params['centroids'] = index_layout['centroids']
+            params['offsets'] = index_layout['offsets']
+        elif not retrain and centroids is not None and previous.mode == self.index_mode:
+            params['centroids'] = centroids
+        index = build_index(gallery, self.index_mode, **params)
+        self._snapshot = GallerySnapshot(gallery, index, version)
+
+    def rebuild_index(self, retrain=True):
+        """Dựng lại chỉ mục tìm kiếm trên gallery hiện tại"""
+        with self._write_lock:
+            snapshot = self._snapshot
+            self._publish(snapshot.gallery, snapshot.version, retrain=retrain)
+
+    def set_index_mode(self, mode, **params):
+        """Đổi loại chỉ mục ('exact'/'ivf') và các knob recall/độ trễ"""
+        with self._write_lock:
+            self.index_mode = mode
+            self.index_params = params
+            self.rebuild_index()
+
+    def _save_snapshot_file(self):
+        """
+        Ghi snapshot hiện tại ra đĩa để lần khởi động sau mở bằng mmap.
+
+        Có thể chạy trên thread hẹn giờ nên không truy vấn DB (db_uid đã đọc sẵn).
+        """
+        snapshot = self._snapshot
+        self._snapshot_dirty = False
+        if self.snapshot_path and snapshot.version is not None:
+            save_gallery_snapshot(snapshot.gallery, self.snapshot_path, snapshot.version,
+                                  self._db_uid, DESCRIPTOR_VERSION, snapshot.index.layout())
+
+    def _schedule_snapshot_save(self):
+        """Đánh dấu snapshot trên đĩa là cũ và hẹn ghi lại (gộp các thay đổi trong snapshot_save_delay giây)"""
+        if not self.snapshot_path:
+            return
+        self._snapshot_dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.snapshot_save_delay, self.flush_snapshot)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush_snapshot(self):
+        """
+        Ghi ngay snapshot đang chờ (gọi khi đóng ứng dụng, trước khi đóng DB).
+
+        Nếu snapshot không kịp ghi, lần khởi động sau thấy users_version lệch và
+        đọc lại từ DB, nên bỏ lỡ một lần ghi không làm sai dữ liệu.
+        """
+        with self._write_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._snapshot_dirty:
+                self._save_snapshot_file()
+
     def load_known_faces(self):
-        """Tải vector đặc trưng Zernike từ DB"""
-        self.known_face_encodings = []
-        self.known_face_ids = []
-        self.known_face_names = []
-        all_users = self.db_manager.get_all_users()
-        for user in all_users:
-            features = user.get('features')
-            if features:
-                # Deserialize numpy array từ BLOB
-                import pickle
-                try:
-                    features_array = pickle.loads(features)
-                    self.known_face_encodings.append(np.array(features_array))
-                    self.known_face_ids.append(user['id'])
-                    self.known_face_names.append(user['name'])
-                except Exception as e:
-                    logger.warning(f"Failed to deserialize features for user {user['id']}: {e}")
-        logger.info(f"Loaded {len(self.known_face_encodings)} known faces (Zernike).")
-
-    def recognize(self, frame):
-        """Nhận diện khuôn mặt trên frame bằng Zernike Moments"""
+        """
+        Tải toàn bộ vector đặc trưng Zernike.
+
+        Ưu tiên mở snapshot trên đĩa bằng mmap nếu nó khớp users_version của DB
+        (thời gian khởi động không phụ thuộc kích thước gallery); nếu không thì
+        đọc lại từ DB và ghi snapshot mới.
+        """
+        with self._write_lock:
+            version = self.db_manager.get_users_version()
+            self._db_uid = self.db_manager.get_database_uid()
+            if self.snapshot_path:
+                loaded = load_gallery_snapshot(self.snapshot_path, version, self._db_uid, DESCRIPTOR_VERSION)
+                if loaded is not None:
+                    gallery, index_layout = loaded
+                    self._publish(gallery, version, index_layout=index_layout)
+                    logger.info(f"Loaded {len(gallery)} known faces from gallery snapshot (mmap).")
+                    return
+            encodings, ids, names, categories = [], [], [], []
+            reextracted = skipped = 0
+            all_users = self.db_manager.get_all_users()
+            for user in all_users:
+                features = user.get('features')
+                if features is None:
+                    continue
+                if user.get('descriptor_version') != DESCRIPTOR_VERSION:
+                    # Vector của descriptor khác không so sánh được với frame hiện tại
+                    features = self._reextract_template(user)
+                    if features is None:
+                        skipped += 1
+                        continue
+                    reextracted += 1
+                encodings.append(features)
+                ids.append(user['id'])
+                names.append(user['name'])
+                categories.append(user['category'])
+            if reextracted:
+                logger.info(f"Re-extracted {reextracted} template(s) with Zernike descriptor v{DESCRIPTOR_VERSION}.")
+                # Ghi đặc trưng mới đã tăng users_version
+                version = self.db_manager.get_users_version()
+            if skipped:
+                logger.warning(f"{skipped} template(s) use an outdated Zernike descriptor and their image could not be "
+                               f"re-read; they are excluded from matching until re-enrolled.")
+            self._publish(FaceGallery(encodings, ids, names, categories), version)
+            self._save_snapshot_file()
+        logger.info(f"Loaded {len(encodings)} known faces (Zernike).")
+
+    def _reextract_template(self, user):
+        """
+        Trích xuất lại template từ ảnh đăng ký (users.image_path) bằng descriptor hiện tại và lưu vào DB.
+
+        Dùng cho mọi template có descriptor_version khác DESCRIPTOR_VERSION, để khi
+        thay đổi cách tính đặc trưng thì gallery cũ được nâng cấp ngay khi khởi động.
+
+        Returns:
+            Vector đặc trưng mới, hoặc None nếu không đọc được ảnh / không thấy khuôn mặt
+        """
+        image_path = user.get('image_path')
+        if not image_path or not os.path.exists(image_path):
+            return None
+        image = cv2.imread(image_path)
+        if image is None:
+            return None
+        features = get_face_moments_zernike(image)
+        if features is None:
+            return None
+        self.db_manager.update_user_features(user['id'], features, descriptor_version=DESCRIPTOR_VERSION)
+        return features
+
+    def refresh_known_faces(self):
+        """
+        Đồng bộ gallery với DB chỉ khi bảng users đã thay đổi kể từ lần đồng bộ trước.
+
+        Returns:
+            True nếu đã tải lại
+        """
+        with self._write_lock:
+            if self.db_manager.get_users_version() == self.gallery_version:
+                return False
+            self.load_known_faces()
+            return True
+
+    def add_template(self, user_id, name, category, features):
+        """Thêm template của một người vào gallery mà không tải lại toàn bộ DB"""
+        with self._write_lock:
+            gallery = self._snapshot.gallery.with_template(user_id, name, category, features)
+            self._publish(gallery, self.db_manager.get_users_version(), retrain=False)
+            self._schedule_snapshot_save()
+        logger.info(f"Template added for user {user_id} ({len(gallery)} known faces)")
+
+    def remove_user(self, user_id):
+        """Xóa mọi template của một người khỏi gallery"""
+        with self._write_lock:
+            snapshot = self._snapshot
+            gallery = snapshot.gallery.without_user(user_id)
+            removed = len(snapshot.gallery) - len(gallery)
+            self._publish(gallery, self.db_manager.get_users_version(), retrain=False)
+            self._schedule_snapshot_save()
+        logger.info(f"Removed {removed} template(s) of user {user_id}")
+
+    def update_category(self, user_id, category):
+        """Cập nhật phân loại (whitelist/blacklist) của một người trong gallery"""
+        with self._write_lock:
+            gallery = self._snapshot.gallery.with_category(user_id, category)
+            self._publish(gallery, self.db_manager.get_users_version(), retrain=False)
+            self._schedule_snapshot_save()
+
+    def recognize(self, frame, regions=None, tracker=None, profile=None):
+        """
+        Nhận diện khuôn mặt trên frame bằng Zernike Moments.
+
+        Args:
+            frame: Ảnh BGR
+            regions: Vùng (x, y, w, h) cần quét, ví dụ từ MotionGate; None = toàn frame
+            tracker: FaceTracker của camera (None = nhận diện lại mọi khuôn mặt)
+            profile: DetectionProfile của camera (None = mặc định)
+
+        Returns:
+            Danh sách dict: location, name, user_id, category, detection_type
+            ('known'/'suspicious'/'unknown'/'low_quality'), distance, track_id (None nếu
+            không theo vết), quality (lý do bị cổng chất lượng loại, None nếu đạt)
+        """
+        return self.recognize_faces([self.detect_faces(frame, regions, profile)], [tracker], [profile])[0]
+
+    def detect_faces(self, frame, regions=None, profile=None):
+        """
+        Bước 1: phát hiện khuôn mặt trên frame BGR.
+
+        Args:
+            frame: Ảnh BGR
+            regions: Vùng (x, y, w, h) cần quét; None = toàn frame, [] = bỏ qua frame
+            profile: DetectionProfile của camera (độ phân giải phát hiện...)
+
+        Returns:
+            (gray, faces) - ảnh xám (None nếu bỏ qua) và mảng (K, 4) các (x, y, w, h)
+        """
+        if regions is not None and len(regions) == 0:
+            return None, np.empty((0, 4), dtype=np.int32)
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 8)
-        results = []
-        for (x, y, w, h) in faces:
-            roi_gray = gray[y:y+h, x:x+w]
-            current_features = get_face_moments_zernike(roi_gray)
-            best_match = "Unknown"
-            user_id = None
-            min_dist = float('inf')
-            for idx, known_vec in enumerate(self.known_face_encodings):
-                dist = np.linalg.norm(known_vec - current_features)
-                if dist < min_dist:
-                    min_dist = dist
-                    best_idx = idx
+        faces = face_cascade_provider.detect_regions(gray, regions, 1.1, 8, profile=profile)
+        return gray, faces
+
+    def recognize_faces(self, detections, trackers=None, profiles=None, extractor=None):
+        """
+        Bước 2: trích xuất và so khớp khuôn mặt của nhiều frame trong một lô.
+
+        ROI của mọi frame (có thể từ nhiều camera) được gộp vào một lần trích
+        xuất Zernike và một lần tìm kiếm trên chỉ mục, rồi chia lại theo frame.
+        Với tracker, chỉ khuôn mặt của track mới hoặc tới hạn xác minh lại được
+        trích xuất + so khớp; khuôn mặt khác dùng lại danh tính đã lưu của track.
+        Frame bị cổng chuyển động bỏ qua (ảnh None) không làm thay đổi tracker.
+
+        Khuôn mặt cần nhận diện được qua cổng chất lượng (profile.quality) trước;
+        khuôn mặt bị loại không được trích xuất / so khớp: trả kết quả 'low_quality',
+        hoặc danh tính đã lưu nếu track của nó từng được nhận diện.
+
+        Args:
+            detections: Danh sách (image, faces); image là ảnh xám từ detect_faces hoặc frame BGR
+            trackers: Danh sách FaceTracker hoặc None theo frame
+            profiles: Danh sách DetectionProfile hoặc None theo frame (cổng chất lượng)
+            extractor: Hàm (needed) -> (features_batch, rejections) thay cho extract_faces,
+                ví dụ để trích xuất trong process worker; needed là danh sách faces cần
+                nhận diện theo frame
+
+        Returns:
+            Danh sách kết quả, phần tử i ứng với detections[i] (cùng định dạng recognize)
+        """
+        if trackers is None:
+            trackers = [None] * len(detections)
+        if profiles is None:
+            profiles = [None] * len(detections)
+
+        associations = []
+        needed = []
+        for (image, faces), tracker in zip(detections, trackers):
+            if tracker is None or image is None:
+                pairs = [(None, True)] * len(faces)
+            else:
+                pairs = tracker.associate(faces)
+            associations.append(pairs)
+            needed.append([face for face, (_, needs) in zip(faces, pairs) if needs])
+        if extractor is None:
+            features_batch, rejections = self.extract_faces(
+                [image for image, _ in detections], needed, profiles)
+        else:
+            features_batch, rejections = extractor(needed)
+        matches = self._match(features_batch)
+
+        all_results = []
+        for (_, faces), pairs, reasons, tracker in zip(detections, associations, rejections, trackers):
+            reasons = iter(reasons)
+            results = []
+            for (x, y, w, h), (track, needs) in zip(faces, pairs):
+                location = (y, x+w, y+h, x)  # (top, right, bottom, left)
+                reason = next(reasons) if needs else None
+                if needs and reason is None:
+                    result = self._make_result(location, *next(matches))
+                    result['track_id'] = track.track_id if track is not None else None
+                    if track is not None:
+                        tracker.update(track, result)
+                elif needs and (track is None or track.result is None):
+                    # Track giữ trạng thái chưa nhận diện cho tới khi có frame đạt chất lượng
+                    result = self._make_low_quality_result(location, reason)
+                    result['track_id'] = track.track_id if track is not None else None
+                else:
+                    result = dict(track.result, location=location)
+                results.append(result)
+            all_results.append(results)
+        return all_results
+
+    def extract_faces(self, images, faces_per_frame, profiles=None):
+        """
+        Cổng chất lượng + trích xuất Zernike cho các khuôn mặt chỉ định, gộp một lô.
+
+        Args:
+            images: Danh sách ảnh (xám hoặc BGR) theo frame
+            faces_per_frame: Danh sách faces (x, y, w, h) cần trích xuất của từng frame
+            profiles: Danh sách DetectionProfile hoặc None theo frame (cổng chất lượng)
+
+        Returns:
+            (features_batch, rejections) - cùng định dạng tham số của match_faces
+        """
+        if profiles is None:
+            profiles = [None] * len(images)
+        rois = []
+        rejections = []
+        for image, faces, profile in zip(images, faces_per_frame, profiles):
+            frame_rois, reasons = select_face_rois(image, faces, profile)
+            rois.extend(frame_rois)
+            rejections.append(reasons)
+        return get_faces_moments_zernike_batch(rois), rejections
+
+    def match_faces(self, faces_per_frame, features_batch, rejections=None):
+        """
+        So khớp đặc trưng đã trích xuất sẵn (ví dụ từ process worker) với gallery.
+
+        Args:
+            faces_per_frame: Danh sách faces (x, y, w, h) của từng frame
+            features_batch: numpy array (số khuôn mặt đạt chất lượng, D), theo đúng thứ tự faces_per_frame
+            rejections: Danh sách lý do bị cổng chất lượng loại (None = đạt) theo từng khuôn mặt
+                của từng frame; khuôn mặt bị loại không có dòng trong features_batch
+
+        Returns:
+            Danh sách kết quả theo frame (cùng định dạng recognize, không theo vết)
+        """
+        if rejections is None:
+            rejections = [[None] * len(faces) for faces in faces_per_frame]
+        matches = self._match(features_batch)
+        all_results = []
+        for faces, reasons in zip(faces_per_frame, rejections):
+            results = []
+            for (x, y, w, h), reason in zip(faces, reasons):
+                location = (y, x+w, y+h, x)
+                if reason is None:
+                    result = self._make_result(location, *next(matches))
+                else:
+                    result = self._make_low_quality_result(location, reason)
+                result['track_id'] = None
+                results.append(result)
+            all_results.append(results)
+        return all_results
+
+    def _match(self, features_batch):
+        """Tìm kiếm cả lô trên chỉ mục, sinh (name, user_id, category, distance) theo thứ tự"""
+        # Đọc snapshot một lần: gallery và chỉ mục luôn khớp nhau dù có thread khác đang cập nhật
+        snapshot = self._snapshot
+        gallery = snapshot.gallery
+        best_idx, best_dist, _ = snapshot.index.search(features_batch)
+        for idx, min_dist in zip(best_idx, best_dist):
             if min_dist < self.THRESHOLD:
-                best_match = self.known_face_names[best_idx]
-                user_id = self.known_face_ids[best_idx]
-            results.append({
-                'location': (y, x+w, y+h, x),  # (top, right, bottom, left)
-                'name': best_match,
-                'user_id': user_id,
-                'distance': min_dist
-            })
-        return results
+                yield gallery.names[idx], gallery.ids[idx], gallery.categories[idx], float(min_dist)
+            else:
+                yield "Unknown", None, None, float(min_dist)
+
+    def _make_result(self, location, name, user_id, category, distance):
+        return {
+            'location': location,
+            'name': name,
+            'user_id': user_id,
+            'category': category,
+            'detection_type': self.classify(user_id, category),
+            'distance': distance,
+            'quality': None
+        }
+
+    def _make_low_quality_result(self, location, reason):
+        """Kết quả cho khuôn mặt bị cổng chất lượng loại: chỉ để hiển thị, không ghi lịch sử"""
+        return {
+            'location': location,
+            'name': None,
+            'user_id': None,
+            'category': None,
+            'detection_type': 'low_quality',
+            'distance': None,
+            'quality': reason
+        }
+
+    @staticmethod
+    def classify(user_id, category):
+        """Phân loại kết quả: 'known', 'suspicious' (blacklist) hoặc 'unknown'"""
+        if user_id is None:
+            return 'unknown'
+        return 'suspicious' if category == 'blacklist' else 'known'
 
     def encode_face_from_image(self, image_path):
         """Trích xuất encoding Zernike từ ảnh file. Trả về vector nếu tìm thấy, ngược lại trả về None."""
@@ -77,8 +471,7 @@ class FaceRecognizer:
                 logger.warning(f"Không tìm thấy ảnh: {image_path}")
                 return None
             gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            faces = face_cascade.detectMultiScale(gray, 1.1, 8)
+            faces = face_cascade_provider.detect(gray, 1.1, 8)
             if len(faces) == 0:
                 logger.warning(f"Không tìm thấy khuôn mặt trong ảnh: {image_path}")
                 return None
@@ -0,0 +1,165 @@
+"""
+Module theo vết khuôn mặt giữa các frame (IoU / tâm hộp)
+Danh tính và khoảng cách được lưu theo track, nên Zernike + so khớp chỉ chạy
+cho track mới hoặc khi tới hạn xác minh lại
+"""
+
+import itertools
+import logging
+import numpy as np
+from config.config import TRACKING, camera_settings
+
+logger = logging.getLogger(__name__)
+
+
+class FaceTrack:
+    """Một khuôn mặt đang được theo vết"""
+
+    def __init__(self, track_id: int, box):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)  # (x, y, w, h)
+        self.result = None  # Kết quả nhận diện gần nhất (dict như recognize)
+        self.frames_since_verify = 0
+        self.misses = 0  # Số frame liên tiếp không thấy khuôn mặt
+        self.hits = 0
+
+    @property
+    def needs_recognition(self) -> bool:
+        return self.result is None
+
+
+def _iou_matrix(boxes_a, boxes_b):
+    """Ma trận IoU giữa hai danh sách hộp (x, y, w, h)"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+    inter_w = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    inter_h = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    inter = inter_w * inter_h
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+class FaceTracker:
+    """
+    Bộ theo vết nhiều khuôn mặt của một camera.
+
+    Mỗi frame, khuôn mặt phát hiện được ghép với track đang có theo IoU (tham
+    lam, cặp IoU cao nhất trước); khuôn mặt còn lại được ghép theo khoảng cách
+    tâm hộp (nhỏ hơn centroid_ratio x kích thước track). Khuôn mặt không ghép
+    được tạo track mới; track mất dấu quá max_misses frame bị xoá.
+
+    Track cần nhận diện (trích xuất + so khớp) khi mới tạo hoặc sau mỗi
+    reverify_interval frame; các frame khác dùng lại danh tính đã lưu.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, centroid_ratio: float = 0.5,
+                 max_misses: int = 5, reverify_interval: int = 15):
+        """
+        Args:
+            iou_threshold: IoU tối thiểu để ghép khuôn mặt với track
+            centroid_ratio: Khoảng cách tâm tối đa (tỷ lệ cạnh hộp) khi ghép theo tâm
+            max_misses: Số frame liên tiếp mất dấu trước khi xoá track
+            reverify_interval: Số frame giữa hai lần nhận diện lại một track
+        """
+        self.iou_threshold = iou_threshold
+        self.centroid_ratio = centroid_ratio
+        self.max_misses = max_misses
+        self.reverify_interval = reverify_interval
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self.recognized = 0  # Số khuôn mặt phải trích xuất + so khớp
+        self.reused = 0  # Số khuôn mặt dùng lại danh tính của track
+
+    def associate(self, faces):
+        """
+        Ghép khuôn mặt của frame hiện tại với các track.
+
+        Args:
+            faces: Danh sách/mảng (x, y, w, h)
+
+        Returns:
+            Danh sách (track, needs_recognition) theo thứ tự faces
+        """
+        faces = [tuple(int(v) for v in face) for face in faces]
+        assigned = [None] * len(faces)
+        free_tracks = set(range(len(self.tracks)))
+
+        if faces and self.tracks:
+            iou = _iou_matrix(faces, [t.box for t in self.tracks])
+            for flat in np.argsort(-iou, axis=None):
+                f, t = np.unravel_index(flat, iou.shape)
+                if iou[f, t] < self.iou_threshold:
+                    break
+                if assigned[f] is None and t in free_tracks:
+                    assigned[f] = self.tracks[t]
+                    free_tracks.discard(t)
+
+            # Ghép theo tâm cho khuôn mặt di chuyển nhanh (IoU thấp)
+            for f, face in enumerate(faces):
+                if assigned[f] is not None or not free_tracks:
+                    continue
+                cx, cy = face[0] + face[2] / 2, face[1] + face[3] / 2
+                best, best_dist = None, None
+                for t in free_tracks:
+                    x, y, w, h = self.tracks[t].box
+                    dist = np.hypot(cx - (x + w / 2), cy - (y + h / 2))
+                    if dist <= self.centroid_ratio * max(w, h) and (best_dist is None or dist < best_dist):
+                        best, best_dist = t, dist
+                if best is not None:
+                    assigned[f] = self.tracks[best]
+                    free_tracks.discard(best)
+
+        # Track không được ghép: tăng số lần mất dấu, xoá nếu quá hạn
+        for t in free_tracks:
+            self.tracks[t].misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        associations = []
+        for face, track in zip(faces, assigned):
+            if track is None:
+                track = FaceTrack(next(self._ids), face)
+                self.tracks.append(track)
+            else:
+                track.box = face
+                track.misses = 0
+                track.frames_since_verify += 1
+            track.hits += 1
+            needs = track.needs_recognition or track.frames_since_verify >= self.reverify_interval
+            if needs:
+                self.recognized += 1
+            else:
+                self.reused += 1
+            associations.append((track, needs))
+        return associations
+
+    def update(self, track: FaceTrack, result: dict):
+        """Lưu kết quả nhận diện mới nhất cho track"""
+        if track.result is not None and track.result['user_id'] != result['user_id']:
+            logger.debug(f"Track {track.track_id}: identity changed {track.result['name']} -> {result['name']}")
+        track.result = result
+        track.frames_since_verify = 0
+
+    def get_stats(self) -> dict:
+        """Thống kê: số track đang hoạt động, số khuôn mặt nhận diện lại / dùng lại danh tính"""
+        return {
+            'active_tracks': len(self.tracks),
+            'recognized': self.recognized,
+            'reused': self.reused,
+        }
+
+
+def create_face_tracker(camera_id=None):
+    """
+    Tạo FaceTracker cho camera theo TRACKING trong config.
+
+    Returns:
+        FaceTracker hoặc None nếu tắt theo vết
+    """
+    settings = camera_settings(TRACKING, camera_id)
+    if settings is None:
+        return None
+    return FaceTracker(**settings)
@@ -1,14 +1,17 @@
 """
 Tab 2: Cài Đặt Camera
-Quản lý danh sách camera: Thêm, Sửa, Xóa, Test kết nối RTSP
+Quản lý danh sách camera: Thêm, Sửa, Xóa, Test kết nối RTSP, vùng phát hiện
 """
 
 import customtkinter as ctk
 from tkinter import messagebox
+import tkinter as tk
+from PIL import Image, ImageTk
 import threading
 import cv2
 import logging
 from typing import Optional
+from detection_mask import DetectionMask
 
 logger = logging.getLogger(__name__)
 
@@ -281,6 +284,17 @@ class CameraSetupTab(ctk.CTkFrame):
                 fg_color=("red", "#8B0000")
             )
             delete_btn.pack(side="left", padx=2)
+            
+            mask_btn = ctk.CTkButton(
+                action_frame,
+                text="🎭",  # Vùng phát hiện
+                command=lambda cid=camera['id'], cname=camera['name'], curl=camera['rtsp_url']:
+                    self._edit_masks(cid, cname, curl),
+                width=40,
+                height=28,
+                font=("Arial", 10)
+            )
+            mask_btn.pack(side="left", padx=2)
     
     def _test_connection(self):
         """Test kết nối RTSP"""
@@ -488,6 +502,10 @@ class CameraSetupTab(ctk.CTkFrame):
                 messagebox.showerror("Lỗi", f"❌ Lỗi xóa camera: {str(e)}")
                 logger.error(f"Error deleting camera: {e}")
     
+    def _edit_masks(self, camera_id: int, camera_name: str, camera_url: str):
+        """Mở cửa sổ vẽ vùng phát hiện (include/exclude) của camera"""
+        DetectionMaskEditor(self, self.db_manager, self.camera_manager, camera_id, camera_name, camera_url)
+    
     def _cancel_edit(self):
         """Hủy chỉnh sửa"""
         self.editing_camera_id = None
@@ -497,4 +515,178 @@ class CameraSetupTab(ctk.CTkFrame):
         
         self.add_btn.configure(state="normal")
         self.update_btn.configure(state="disabled")
-        self.cancel_btn.configure(state="disabled")
\ No newline at end of file
+        self.cancel_btn.configure(state="disabled")
+
+
+class DetectionMaskEditor(ctk.CTkToplevel):
+    """
+    Cửa sổ vẽ vùng phát hiện của một camera.
+    
+    Click chuột trái để thêm đỉnh, chuột phải (hoặc nút "Đóng Đa Giác") để hoàn
+    tất đa giác. Vùng phát hiện (xanh): Haar chỉ quét trong các vùng này; vùng
+    loại trừ (đỏ): khuôn mặt có tâm nằm trong bị bỏ qua.
+    """
+    
+    CANVAS_WIDTH = 800
+    CANVAS_HEIGHT = 450
+    MODES = {"✅ Vùng Phát Hiện": 'include', "🚫 Vùng Loại Trừ": 'exclude'}
+    COLORS = {'include': "#2ecc71", 'exclude': "#e74c3c"}
+    
+    def __init__(self, parent, db_manager, camera_manager, camera_id: int, camera_name: str, camera_url: str):
+        super().__init__(parent)
+        self.db_manager = db_manager
+        self.camera_manager = camera_manager
+        self.camera_id = camera_id
+        self.camera_url = camera_url
+        
+        masks = db_manager.get_camera_masks(camera_id) or {}
+        self.polygons = {
+            'include': [list(map(tuple, p)) for p in masks.get('include', [])],
+            'exclude': [list(map(tuple, p)) for p in masks.get('exclude', [])],
+        }
+        self.current = []  # Các đỉnh (chuẩn hoá) của đa giác đang vẽ
+        self.photo = None
+        # Vùng ảnh trên canvas (x, y, w, h); mặc định 16:9 toàn canvas khi chưa có ảnh
+        self.image_box = (0, 0, self.CANVAS_WIDTH, self.CANVAS_HEIGHT)
+        
+        self.title(f"Vùng Phát Hiện - {camera_name}")
+        self.resizable(False, False)
+        self._setup_ui()
+        self._redraw()
+        self._load_snapshot()
+        self.after(100, self.grab_set)
+    
+    def _setup_ui(self):
+        """Thiết lập giao diện"""
+        toolbar = ctk.CTkFrame(self, fg_color="transparent")
+        toolbar.pack(fill="x", padx=10, pady=(10, 5))
+        
+        self.mode_selector = ctk.CTkSegmentedButton(toolbar, values=list(self.MODES))
+        self.mode_selector.set("✅ Vùng Phát Hiện")
+        self.mode_selector.pack(side="left", padx=5)
+        
+        for text, command in (("🔒 Đóng Đa Giác", self._close_polygon),
+                              ("↩️ Hoàn Tác", self._undo),
+                              ("🗑️ Xóa Hết", self._clear)):
+            ctk.CTkButton(toolbar, text=text, command=command, width=110, height=30,
+                          font=("Arial", 10)).pack(side="left", padx=5)
+        
+        self.canvas = tk.Canvas(self, width=self.CANVAS_WIDTH, height=self.CANVAS_HEIGHT,
+                                bg="gray15", highlightthickness=0, cursor="crosshair")
+        self.canvas.pack(padx=10, pady=5)
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Button-3>", lambda event: self._close_polygon())
+        
+        bottom = ctk.CTkFrame(self, fg_color="transparent")
+        bottom.pack(fill="x", padx=10, pady=(5, 10))
+        
+        self.status_label = ctk.CTkLabel(
+            bottom,
+            text="Chuột trái: thêm đỉnh • Chuột phải: đóng đa giác",
+            font=("Arial", 10),
+            text_color="gray"
+        )
+        self.status_label.pack(side="left", padx=5)
+        
+        ctk.CTkButton(bottom, text="❌ Hủy", command=self.destroy, width=80, height=32,
+                      font=("Arial", 10)).pack(side="right", padx=5)
+        ctk.CTkButton(bottom, text="💾 Lưu", command=self._save, width=80, height=32,
+                      font=("Arial", 10), fg_color=("green", "#1f6723")).pack(side="right", padx=5)
+    
+    def _load_snapshot(self):
+        """Lấy một frame làm nền: frame đang capture nếu có, nếu không thì đọc một frame RTSP"""
+        packet = self.camera_manager.get_frame_packet(self.camera_id)
+        if packet is not None:
+            with packet:
+                self._show_snapshot(packet.frame)
+            return
+        
+        self.status_label.configure(text="⏳ Đang lấy ảnh từ camera...")
+        
+        def grab():
+            cap = cv2.VideoCapture(self.camera_url)
+            ret, frame = cap.read() if cap.isOpened() else (False, None)
+            cap.release()
+            try:
+                self.after(0, lambda: self._show_snapshot(frame if ret else None))
+            except tk.TclError:
+                pass  # Cửa sổ đã đóng
+        
+        threading.Thread(target=grab, daemon=True).start()
+    
+    def _show_snapshot(self, frame):
+        if not self.winfo_exists():
+            return
+        if frame is None:
+            self.status_label.configure(text="⚠️ Không lấy được ảnh camera - vẫn có thể vẽ vùng")
+            return
+        height, width = frame.shape[:2]
+        scale = min(self.CANVAS_WIDTH / width, self.CANVAS_HEIGHT / height)
+        disp_w, disp_h = int(width * scale), int(height * scale)
+        rgb = cv2.cvtColor(cv2.resize(frame, (disp_w, disp_h), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+        self.photo = ImageTk.PhotoImage(Image.fromarray(rgb))
+        self.image_box = ((self.CANVAS_WIDTH - disp_w) // 2, (self.CANVAS_HEIGHT - disp_h) // 2, disp_w, disp_h)
+        self.status_label.configure(text="Chuột trái: thêm đỉnh • Chuột phải: đóng đa giác")
+        self._redraw()
+    
+    def _to_canvas(self, point):
+        x, y, w, h = self.image_box
+        return (x + point[0] * w, y + point[1] * h)
+    
+    def _on_click(self, event):
+        x, y, w, h = self.image_box
+        nx = min(1.0, max(0.0, (event.x - x) / w))
+        ny = min(1.0, max(0.0, (event.y - y) / h))
+        self.current.append((round(nx, 4), round(ny, 4)))
+        self._redraw()
+    
+    def _close_polygon(self):
+        if len(self.current) < 3:
+            self.status_label.configure(text="⚠️ Đa giác cần ít nhất 3 đỉnh")
+            return
+        self.polygons[self.MODES[self.mode_selector.get()]].append(self.current)
+        self.current = []
+        self._redraw()
+    
+    def _undo(self):
+        """Xoá đỉnh cuối của đa giác đang vẽ, hoặc đa giác vừa đóng của chế độ hiện tại"""
+        if self.current:
+            self.current.pop()
+        elif self.polygons[self.MODES[self.mode_selector.get()]]:
+            self.polygons[self.MODES[self.mode_selector.get()]].pop()
+        self._redraw()
+    
+    def _clear(self):
+        self.polygons = {'include': [], 'exclude': []}
+        self.current = []
+        self._redraw()
+    
+    def _redraw(self):
+        self.canvas.delete("all")
+        if self.photo is not None:
+            x, y, _, _ = self.image_box
+            self.canvas.create_image(x, y, image=self.photo, anchor="nw")
+        for kind, polygons in self.polygons.items():
+            for polygon in polygons:
+                points = [c for point in polygon for c in self._to_canvas(point)]
+                self.canvas.create_polygon(points, outline=self.COLORS[kind], fill=self.COLORS[kind],
+                                           stipple="gray25", width=2)
+        if self.current:
+            color = self.COLORS[self.MODES[self.mode_selector.get()]]
+            points = [self._to_canvas(point) for point in self.current]
+            if len(points) > 1:
+                self.canvas.create_line([c for point in points for c in point], fill=color, width=2, dash=(4, 2))
+            for (px, py) in points:
+                self.canvas.create_oval(px - 3, py - 3, px + 3, py + 3, fill=color, outline="")
+    
+    def _save(self):
+        """Lưu vùng phát hiện vào DB (đa giác đang vẽ dở sẽ bị bỏ)"""
+        mask = DetectionMask(self.polygons['include'], self.polygons['exclude'])
+        if self.db_manager.update_camera_masks(self.camera_id, mask.to_dict() if mask else None):
+            messagebox.showinfo("Thành Công", "✅ Đã lưu vùng phát hiện!\n"
+                                "Áp dụng khi bắt đầu giám sát camera lần tới.", parent=self)
+            logger.info(f"Detection masks saved for camera {self.camera_id}: "
+                        f"{len(mask.include)} include, {len(mask.exclude)} exclude")
+            self.destroy()
+        else:
+            messagebox.showerror("Lỗi", "❌ Không lưu được vùng phát hiện!", parent=self)
@@ -10,7 +10,7 @@ import cv2
 import logging
 import os
 from typing import Optional
-from zernike_utils import get_face_moments_zernike
+from zernike_utils import get_face_moments_zernike, DESCRIPTOR_VERSION
 
 logger = logging.getLogger(__name__)
 
@@ -320,9 +320,9 @@ class FaceDBTab(ctk.CTkFrame):
                 messagebox.showwarning("Cảnh báo", "Tên người đã tồn tại!")
                 return
             # Lưu features (thay vì encoding)
-            self.db_manager.update_user_features(user_id, encoding)
-            # Reload features từ DB
-            self.face_recognizer.load_known_faces()
+            self.db_manager.update_user_features(user_id, encoding, descriptor_version=DESCRIPTOR_VERSION)
+            # Cập nhật gallery của bộ nhận diện (chỉ thêm template mới)
+            self.face_recognizer.add_template(user_id, name, category, encoding)
             messagebox.showinfo("Thành Công", f"✅ Thêm '{name}' thành công!")
             self._clear_form()
             self._load_user_list()
@@ -437,8 +437,8 @@ class FaceDBTab(ctk.CTkFrame):
         try:
             self.db_manager.update_user_category(user_id, new_category)
             
-            # Reload features từ DB
-            self.face_recognizer.load_known_faces()
+            # Cập nhật phân loại trong gallery
+            self.face_recognizer.update_category(user_id, new_category)
             
             messagebox.showinfo("Thành Công", "✅ Cập nhật phân loại thành công!")
             self._load_user_list()
@@ -455,8 +455,8 @@ class FaceDBTab(ctk.CTkFrame):
             try:
                 self.db_manager.delete_user(user_id)
                 
-                # Reload features từ DB
-                self.face_recognizer.load_known_faces()
+                # Xóa template khỏi gallery
+                self.face_recognizer.remove_user(user_id)
                 
                 messagebox.showinfo("Thành Công", "✅ Xóa người thành công!")
                 self._load_user_list()
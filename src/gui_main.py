@@ -151,6 +151,10 @@ class MainApp(ctk.CTk):
             if hasattr(self, 'camera_manager'):
                 self.camera_manager.stop_all()
             
+            # Ghi snapshot gallery đang chờ (cần DB còn mở)
+            if hasattr(self, 'face_recognizer'):
+                self.face_recognizer.flush_snapshot()
+            
             # Đóng database
             if hasattr(self, 'db_manager'):
                 self.db_manager.close()
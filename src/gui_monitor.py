@@ -11,6 +11,11 @@ import threading
 import time
 import logging
 from datetime import datetime, timedelta
+from motion_gate import create_motion_gate
+from face_tracker import create_face_tracker
+from cadence_governor import get_cadence_governor
+from camera_handler import SubscriptionClosed
+from face_detector import create_detection_profile, create_face_size_model
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +30,10 @@ class MonitorTab(ctk.CTkFrame):
     - Bên phải: Thông tin, cảnh báo
     """
     
+    # Kích thước khung hiển thị video
+    DISPLAY_WIDTH = 700
+    DISPLAY_HEIGHT = 500
+    
     def __init__(self, parent, db_manager, face_recognizer, camera_manager):
         """
         Khởi tạo Monitor Tab.
@@ -45,6 +54,14 @@ class MonitorTab(ctk.CTkFrame):
         self.selected_camera_id = None
         self.is_monitoring = False
         self.monitor_thread = None
+        self.subscription = None  # CameraSubscription của camera đang giám sát
+        self.motion_gate = None  # MotionGate của camera đang giám sát (None = tắt)
+        self.face_tracker = None  # FaceTracker của camera đang giám sát (None = tắt)
+        self.cadence_governor = None  # CadenceGovernor: frame nào chạy phát hiện, frame nào chỉ hiển thị
+        # Khoá của tab trong governor dùng chung (tách khỏi khoá camera_id của bộ lập lịch lưới)
+        self.cadence_key = None
+        self.detection_profile = None  # DetectionProfile của camera đang giám sát
+        self.face_size_model = None  # FaceSizeModel: dải kích thước khuôn mặt đã học (None = tắt)
         self.stop_monitor_event = threading.Event()
         
         # Cache ảnh để hiển thị
@@ -256,12 +273,23 @@ class MonitorTab(ctk.CTkFrame):
             self._add_alert("❌ Không tìm thấy URL camera!")
             return
 
-        # QUAN TRỌNG: Ra lệnh cho CameraManager kết nối RTSP
-        self.camera_manager.start_camera(self.selected_camera_id, camera_info['rtsp_url'])
+        # QUAN TRỌNG: Đăng ký nhận frame (CameraManager kết nối RTSP nếu chưa chạy)
+        self.subscription = self.camera_manager.subscribe(self.selected_camera_id, camera_info['rtsp_url'])
+        if self.subscription is None:
+            self._add_alert("❌ Không kết nối được camera!")
+            return
 
         self.is_monitoring = True
         self.stop_monitor_event.clear()
-        self.face_recognizer.load_known_faces()
+        self.face_recognizer.refresh_known_faces()
+        self.motion_gate = create_motion_gate(self.selected_camera_id)
+        self.face_tracker = create_face_tracker(self.selected_camera_id)
+        self.cadence_governor = get_cadence_governor()
+        self.cadence_key = ('monitor', self.selected_camera_id)
+        self.detection_profile = create_detection_profile(self.selected_camera_id, self.db_manager)
+        self.face_size_model = create_face_size_model(self.selected_camera_id)
+        if self.cadence_governor is not None:
+            self.cadence_governor.register(self.cadence_key)
         
         self.monitor_thread = threading.Thread(target=self._monitoring_loop, daemon=True)
         self.monitor_thread.start()
@@ -286,7 +314,7 @@ class MonitorTab(ctk.CTkFrame):
         self.stop_monitor_event.clear()
         
         # Tải lại dữ liệu khuôn mặt nếu cần
-        self.face_recognizer.load_known_faces()
+        self.face_recognizer.refresh_known_faces()
         
         # Bắt đầu luồng monitoring
         self.monitor_thread = threading.Thread(target=self._monitoring_loop, daemon=True)
@@ -305,22 +333,51 @@ class MonitorTab(ctk.CTkFrame):
         Chạy trong thread riêng để không block GUI
         """
         try:
+            subscription = self.subscription
+            governor = self.cadence_governor
+            cadence_key = self.cadence_key
+            detections = []
             while not self.stop_monitor_event.is_set() and self.is_monitoring:
-                # Lấy frame từ camera
-                frame = self.camera_manager.get_frame(self.selected_camera_id)
-                if frame is None:
-                    time.sleep(0.01)
+                # Chờ frame mới từ camera (mỗi frame chỉ xử lý một lần)
+                packet = subscription.get_next_frame(timeout=0.5)
+                if packet is None:
                     continue
-                # Nhận diện khuôn mặt
-                detections = self.face_recognizer.recognize(frame)
-                # Vẽ kết quả lên frame
-                annotated_frame = self._draw_detections(frame, detections)
+                # Buffer frame được trả lại cho pool ngay khi không còn đọc tới frame
+                with packet:
+                    frame = packet.frame
+                    # Frame chỉ hiển thị: vẽ lại kết quả gần nhất, không phát hiện/ghi nhận
+                    if governor is not None and not governor.should_detect(cadence_key, packet.timestamp):
+                        self._display_frame(self._draw_detections(frame, detections))
+                        continue
+                    # Nhận diện khuôn mặt
+                    start = time.perf_counter()
+                    regions = self.motion_gate.regions(frame) if self.motion_gate is not None else None
+                    profile = self.detection_profile
+                    if self.face_size_model is not None:
+                        profile = self.face_size_model.apply(profile)
+                    detections = self.face_recognizer.recognize(frame, regions, self.face_tracker, profile)
+                    if self.face_size_model is not None:
+                        self.face_size_model.observe([d['location'][1] - d['location'][3] for d in detections],
+                                                     [d['track_id'] for d in detections])
+                    if governor is not None:
+                        motion = None if regions is None else len(regions) > 0
+                        governor.record(cadence_key, packet.timestamp,
+                                        time.perf_counter() - start, len(detections), motion)
+                    # Vẽ kết quả lên frame
+                    annotated_frame = self._draw_detections(frame, detections)
                 # Hiển thị
                 self._display_frame(annotated_frame)
                 # Ghi lại sự kiện cảnh báo
                 for detection in detections:
-                    self._process_detection(detection)
-                time.sleep(0.01)
+                    # Khuôn mặt kém chất lượng chỉ hiển thị, không ghi lịch sử
+                    if detection['detection_type'] != 'low_quality':
+                        self._process_detection(detection)
+        
+        except SubscriptionClosed:
+            # Camera bị xoá / dừng từ nơi khác (không phải nút Dừng): kết thúc giám sát và trả UI về trạng thái dừng
+            if not self.stop_monitor_event.is_set():
+                logger.info(f"Camera {self.selected_camera_id}: subscription closed, monitoring stopped")
+                self.after(0, self._stop_monitoring)
         
         except Exception as e:
             logger.error(f"Error in monitoring loop: {e}")
@@ -331,15 +388,21 @@ class MonitorTab(ctk.CTkFrame):
     
     def _draw_detections(self, frame: np.ndarray, detections: list) -> np.ndarray:
         """
-        Vẽ khung mặt và nhãn lên frame.
+        Thu nhỏ frame về khung hiển thị (700x500) rồi vẽ khung mặt và nhãn lên bản thu nhỏ.
+        Frame từ CameraManager là view chỉ đọc dùng chung giữa các consumer nên
+        không bao giờ vẽ trực tiếp lên đó (và không cần copy bản full-res).
         """
-        annotated = frame.copy()
+        h, w = frame.shape[:2]
+        scale = min(self.DISPLAY_WIDTH / w, self.DISPLAY_HEIGHT / h)
+        annotated = cv2.resize(frame, (int(w * scale), int(h * scale)))
         for detection in detections:
-            top, right, bottom, left = detection['location']
+            top, right, bottom, left = (int(v * scale) for v in detection['location'])
             name = detection['name']
-            # Màu sắc: người quen xanh lá, lạ vàng
+            # Màu sắc: người quen xanh lá, lạ vàng, kém chất lượng (không nhận diện) xám
             color = (0, 255, 0) if name != "Unknown" else (0, 255, 255)
             label = name if name else "Unknown"
+            if detection['detection_type'] == 'low_quality':
+                color, label = (128, 128, 128), f"? {detection['quality']}"
             cv2.rectangle(annotated, (left, top), (right, bottom), color, 2)
             font = cv2.FONT_HERSHEY_SIMPLEX
             font_scale = 0.6
@@ -358,18 +421,15 @@ class MonitorTab(ctk.CTkFrame):
         Chuyển từ OpenCV (BGR) sang PIL (RGB) để hiển thị trên tkinter
         """
         try:
-            # Khung cố định
-            FIXED_WIDTH = 700
-            FIXED_HEIGHT = 500
+            FIXED_WIDTH = self.DISPLAY_WIDTH
+            FIXED_HEIGHT = self.DISPLAY_HEIGHT
             
+            # Frame đã được _draw_detections thu nhỏ vừa khung; chỉ resize nếu còn lớn hơn
             h, w = frame.shape[:2]
-            
-            # Resize frame để vừa với khung cố định (giữ tỷ lệ)
-            scale = min(FIXED_WIDTH / w, FIXED_HEIGHT / h)
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            
-            frame_resized = cv2.resize(frame, (new_w, new_h))
+            if w > FIXED_WIDTH or h > FIXED_HEIGHT:
+                scale = min(FIXED_WIDTH / w, FIXED_HEIGHT / h)
+                frame = cv2.resize(frame, (int(w * scale), int(h * scale)))
+            new_h, new_w = frame.shape[:2]
             
             # Tạo canvas cố định và đặt frame vào giữa
             canvas = np.ones((FIXED_HEIGHT, FIXED_WIDTH, 3), dtype=np.uint8) * 30
@@ -378,7 +438,7 @@ class MonitorTab(ctk.CTkFrame):
             y_offset = (FIXED_HEIGHT - new_h) // 2
             x_offset = (FIXED_WIDTH - new_w) // 2
             
-            canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = frame_resized
+            canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = frame
             
             # Chuyển BGR sang RGB
             frame_rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
@@ -395,7 +455,13 @@ class MonitorTab(ctk.CTkFrame):
             
             # Cập nhật thông tin
             camera_info = self.camera_manager.get_camera_info(self.selected_camera_id)
-            if camera_info:
+            if self.cadence_governor is not None:
+                stats = self.cadence_governor.get_stats()['cameras'].get(self.cadence_key)
+                if stats:
+                    self.info_label.configure(
+                        text=f"FPS: {stats['input_fps']:.1f} | Phát hiện: {stats['detection_fps']:.1f} FPS"
+                             f" | {stats['cost_ms']:.0f} ms")
+            elif camera_info:
                 fps = camera_info.get('fps', 0)
                 frame_count = camera_info.get('frame_count', 0)
                 self.info_label.configure(text=f"FPS: {fps} | Frame: {frame_count}")
@@ -408,6 +474,7 @@ class MonitorTab(ctk.CTkFrame):
         try:
             name = detection['name']
             user_id = detection['user_id']
+            detection_type = detection['detection_type']
             
             # Gọi lại thread chính để xử lý
             timestamp = datetime.now().strftime("%H:%M:%S")
@@ -416,31 +483,23 @@ class MonitorTab(ctk.CTkFrame):
                 camera_id=self.selected_camera_id,
                 user_id=user_id,
                 user_name=name,
+                detection_type=detection_type,
                 timestamp=timestamp
             ))
         
         except Exception as e:
             logger.error(f"Error processing detection: {e}")
 
-    def _safe_log_detection(self, camera_id, user_id, user_name, timestamp):
+    def _safe_log_detection(self, camera_id, user_id, user_name, detection_type, timestamp):
         """Ghi detection an toàn từ thread chính"""
         try:
-            if user_name == "Unknown":
-                detection_type = 'unknown'
-                message = "👤 Phát hiện người lạ"
+            # Phân loại đã có sẵn trong kết quả nhận diện (không cần truy vấn DB)
+            if detection_type == 'suspicious':
+                message = f"⚠️ CẢNH BÁO: Phát hiện người tình nghi: {user_name}"
+            elif detection_type == 'known':
+                message = f"✅ Phát hiện người quen: {user_name}"
             else:
-                # Kiểm tra category từ database
-                if user_id:
-                    user_info = self.db_manager.get_user_by_id(user_id)
-                    if user_info and user_info['category'] == 'blacklist':
-                        detection_type = 'suspicious'
-                        message = f"⚠️ CẢNH BÁO: Phát hiện người tình nghi: {user_name}"
-                    else:
-                        detection_type = 'known'
-                        message = f"✅ Phát hiện người quen: {user_name}"
-                else:
-                    detection_type = 'unknown'
-                    message = f"👤 Phát hiện người không xác định: {user_name}"
+                message = "👤 Phát hiện người lạ"
             
             # Kiểm tra xem có nên ghi nhận lại sau 60 giây không
             # Dùng in-memory tracking thay vì query database
@@ -497,12 +556,18 @@ class MonitorTab(ctk.CTkFrame):
         self.stop_monitor_event.set()
         self.is_monitoring = False
         
-        # Dừng luồng đọc camera của CameraManager
-        self.camera_manager.stop_camera(self.selected_camera_id)
+        # Huỷ đăng ký; CameraManager chỉ ngắt RTSP khi không còn ai xem camera
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
         
         if self.monitor_thread:
             self.monitor_thread.join(timeout=2)
         
+        # Trả phần ngân sách CPU của tab cho các camera khác trong governor dùng chung
+        if self.cadence_governor is not None:
+            self.cadence_governor.unregister(self.cadence_key)
+        
         # Xóa ảnh cũ trên UI
         self.video_label.configure(image="", text="Đã dừng giám sát")
         
@@ -7,10 +7,9 @@ import customtkinter as ctk
 from PIL import Image, ImageTk
 import cv2
 import numpy as np
-import threading
-import time
 import logging
 from datetime import datetime, timedelta
+from inference_scheduler import InferenceScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +23,10 @@ class MonitorGridTab(ctk.CTkFrame):
     - Giữa/Phải: Grid layout hiển thị các camera đã chọn (2x2)
     """
     
+    # Kích thước khung hiển thị video
+    DISPLAY_WIDTH = 350
+    DISPLAY_HEIGHT = 250
+    
     def __init__(self, parent, db_manager, face_recognizer, camera_manager):
         """
         Khởi tạo Monitor Grid Tab.
@@ -43,8 +46,9 @@ class MonitorGridTab(ctk.CTkFrame):
         # Trạng thái
         self.selected_cameras = {}  # {camera_id: is_selected}
         self.monitoring_cameras = {}  # {camera_id: is_monitoring}
-        self.monitor_threads = {}  # {camera_id: thread}
-        self.stop_monitor_events = {}  # {camera_id: threading.Event}
+        # Một thread lập lịch chung nhận diện theo lô cho mọi camera (thay cho mỗi camera một thread)
+        self.scheduler = InferenceScheduler(face_recognizer, camera_manager)
+        self.last_detections = {}  # {camera_id: kết quả nhận diện gần nhất} cho frame chỉ hiển thị
         self.last_detection_time = {}  # {(camera_id, user_name): datetime}
         
         self._setup_ui()
@@ -265,43 +269,22 @@ class MonitorGridTab(ctk.CTkFrame):
             logger.error(f"Camera {camera_id} not found")
             return
         
-        # Khởi tạo events
-        if camera_id not in self.stop_monitor_events:
-            self.stop_monitor_events[camera_id] = threading.Event()
-        
-        self.stop_monitor_events[camera_id].clear()
-        
-        # Bắt đầu camera manager
-        self.camera_manager.start_camera(camera_id, camera_info['rtsp_url'])
-        
-        # Khởi tạo monitoring
+        # Đăng ký camera với bộ lập lịch nhận diện chung (dùng chung kết nối nếu tab khác đang xem)
+        self.face_recognizer.refresh_known_faces()
+        if not self.scheduler.register(camera_id, self._on_camera_result, camera_info['rtsp_url']):
+            logger.error(f"Failed to subscribe to camera {camera_id}")
+            return
         self.monitoring_cameras[camera_id] = True
-        self.face_recognizer.load_known_faces()
-        
-        # Tạo thread monitoring
-        thread = threading.Thread(
-            target=self._monitoring_loop,
-            args=(camera_id,),
-            daemon=True
-        )
-        self.monitor_threads[camera_id] = thread
-        thread.start()
         
         logger.info(f"Started monitoring camera {camera_id}")
     
     def _stop_camera_monitoring(self, camera_id: int):
         """Dừng giám sát camera"""
-        if camera_id in self.stop_monitor_events:
-            self.stop_monitor_events[camera_id].set()
-        
         self.monitoring_cameras[camera_id] = False
         
-        # Dừng camera manager
-        self.camera_manager.stop_camera(camera_id)
-        
-        # Chờ thread
-        if camera_id in self.monitor_threads:
-            self.monitor_threads[camera_id].join(timeout=2)
+        # Gỡ khỏi bộ lập lịch; camera chỉ dừng khi subscriber cuối cùng rời đi
+        self.scheduler.unregister(camera_id)
+        self.last_detections.pop(camera_id, None)
         
         # Xóa ảnh
         idx = self._get_camera_index(camera_id)
@@ -318,48 +301,52 @@ class MonitorGridTab(ctk.CTkFrame):
         except ValueError:
             return None
     
-    def _monitoring_loop(self, camera_id: int):
-        """Luồng giám sát cho mỗi camera"""
-        try:
-            while not self.stop_monitor_events[camera_id].is_set() and self.monitoring_cameras.get(camera_id, False):
-                # Lấy frame
-                frame = self.camera_manager.get_frame(camera_id)
-                if frame is None:
-                    time.sleep(0.01)
-                    continue
-                
-                # Nhận diện khuôn mặt
-                detections = self.face_recognizer.recognize(frame)
-                
-                # Vẽ detection
-                annotated_frame = self._draw_detections(frame, detections)
-                
-                # Hiển thị
-                idx = self._get_camera_index(camera_id)
-                if idx is not None:
-                    self._display_frame(annotated_frame, idx)
-                
-                # Ghi nhận detection
-                for detection in detections:
-                    self._process_detection(camera_id, detection)
-                
-                time.sleep(0.01)
+    def _on_camera_result(self, camera_id: int, packet, detections):
+        """
+        Callback của bộ lập lịch: hiển thị và ghi nhận kết quả nhận diện một frame.
+        detections là None với frame chỉ hiển thị: vẽ lại kết quả gần nhất, không ghi nhận.
+        """
+        if not self.monitoring_cameras.get(camera_id, False):
+            return
         
-        except Exception as e:
-            logger.error(f"Error in monitoring loop for camera {camera_id}: {e}")
+        display_only = detections is None
+        if display_only:
+            detections = self.last_detections.get(camera_id, [])
+        else:
+            self.last_detections[camera_id] = detections
+        
+        # Vẽ detection
+        annotated_frame = self._draw_detections(packet.frame, detections)
+        
+        # Hiển thị
+        idx = self._get_camera_index(camera_id)
+        if idx is not None:
+            self._display_frame(annotated_frame, idx)
         
-        finally:
-            self.monitoring_cameras[camera_id] = False
+        # Ghi nhận detection
+        if display_only:
+            return
+        for detection in detections:
+            # Khuôn mặt kém chất lượng chỉ hiển thị, không ghi lịch sử
+            if detection['detection_type'] != 'low_quality':
+                self._process_detection(camera_id, detection)
     
     def _draw_detections(self, frame: np.ndarray, detections: list) -> np.ndarray:
-        """Vẽ khung mặt lên frame"""
-        annotated = frame.copy()
+        """
+        Thu nhỏ frame về khung hiển thị (350x250) rồi vẽ khung mặt và nhãn lên bản thu nhỏ.
+        Frame từ CameraManager là view chỉ đọc dùng chung giữa các consumer nên
+        không bao giờ vẽ trực tiếp lên đó (và không cần copy bản full-res).
+        """
+        h, w = frame.shape[:2]
+        scale = min(self.DISPLAY_WIDTH / w, self.DISPLAY_HEIGHT / h)
+        annotated = cv2.resize(frame, (int(w * scale), int(h * scale)))
         for detection in detections:
-            top, right, bottom, left = detection['location']
+            top, right, bottom, left = (int(v * scale) for v in detection['location'])
             name = detection['name']
             color = (0, 255, 0) if name != "Unknown" else (0, 255, 255)
             label = name if name else "Unknown"
-            
+            if detection['detection_type'] == 'low_quality':
+                color, label = (128, 128, 128), f"? {detection['quality']}"
             cv2.rectangle(annotated, (left, top), (right, bottom), color, 2)
             font = cv2.FONT_HERSHEY_SIMPLEX
             font_scale = 0.5
@@ -370,21 +357,20 @@ class MonitorGridTab(ctk.CTkFrame):
             cv2.rectangle(annotated, text_bg_coords, text_end_coords, color, -1)
             text_coords = (left + 5, top - 10)
             cv2.putText(annotated, label, text_coords, font, font_scale, (255, 255, 255), font_thickness)
-        
         return annotated
     
     def _display_frame(self, frame: np.ndarray, idx: int):
         """Hiển thị frame lên grid"""
         try:
-            FIXED_WIDTH = 350
-            FIXED_HEIGHT = 250
+            FIXED_WIDTH = self.DISPLAY_WIDTH
+            FIXED_HEIGHT = self.DISPLAY_HEIGHT
             
+            # Frame đã được _draw_detections thu nhỏ vừa khung; chỉ resize nếu còn lớn hơn
             h, w = frame.shape[:2]
-            scale = min(FIXED_WIDTH / w, FIXED_HEIGHT / h)
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            
-            frame_resized = cv2.resize(frame, (new_w, new_h))
+            if w > FIXED_WIDTH or h > FIXED_HEIGHT:
+                scale = min(FIXED_WIDTH / w, FIXED_HEIGHT / h)
+                frame = cv2.resize(frame, (int(w * scale), int(h * scale)))
+            new_h, new_w = frame.shape[:2]
             
             # Tạo canvas cố định
             canvas = np.ones((FIXED_HEIGHT, FIXED_WIDTH, 3), dtype=np.uint8) * 30
@@ -392,7 +378,7 @@ class MonitorGridTab(ctk.CTkFrame):
             y_offset = (FIXED_HEIGHT - new_h) // 2
             x_offset = (FIXED_WIDTH - new_w) // 2
             
-            canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = frame_resized
+            canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = frame
             
             # Chuyển đổi
             frame_rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
@@ -411,24 +397,13 @@ class MonitorGridTab(ctk.CTkFrame):
         try:
             name = detection['name']
             user_id = detection['user_id']
+            detection_type = detection['detection_type']
             
             # Kiểm tra 60 giây
             should_log = self._should_log_detection_memory(camera_id, name, threshold_seconds=60)
             
             if should_log:
-                # Ghi database
-                if name == "Unknown":
-                    detection_type = 'unknown'
-                else:
-                    if user_id:
-                        user_info = self.db_manager.get_user_by_id(user_id)
-                        if user_info and user_info['category'] == 'blacklist':
-                            detection_type = 'suspicious'
-                        else:
-                            detection_type = 'known'
-                    else:
-                        detection_type = 'unknown'
-                
+                # Ghi database (phân loại đã có sẵn trong kết quả nhận diện)
                 self.db_manager.log_detection(
                     camera_id=camera_id,
                     detection_type=detection_type,
@@ -461,5 +436,6 @@ class MonitorGridTab(ctk.CTkFrame):
         for camera_id in list(self.monitoring_cameras.keys()):
             if self.monitoring_cameras[camera_id]:
                 self._stop_camera_monitoring(camera_id)
+        self.scheduler.stop()
         
         logger.info("MonitorGridTab cleaned up")
@@ -0,0 +1,282 @@
+"""
+Module lập lịch nhận diện tập trung cho nhiều camera
+Một thread duy nhất lấy frame mới nhất của mọi camera đang chạy, phát hiện khuôn mặt
+từng frame, rồi gộp ROI của tất cả camera vào một lần trích xuất + so khớp
+"""
+
+import threading
+import time
+import logging
+from config.config import SCHEDULER
+from recognition_pool import create_recognition_backend
+from motion_gate import create_motion_gate
+from face_tracker import create_face_tracker
+from cadence_governor import get_cadence_governor
+from face_detector import create_detection_profile, create_face_size_model
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledCamera:
+    """Trạng thái lập lịch của một camera"""
+
+    def __init__(self, camera_id, subscription, callback, priority: float, motion_gate=None, tracker=None,
+                 profile=None, size_model=None):
+        self.camera_id = camera_id
+        self.subscription = subscription
+        self.callback = callback
+        self.priority = priority
+        self.motion_gate = motion_gate  # MotionGate hoặc None (luôn quét toàn frame)
+        self.tracker = tracker  # FaceTracker hoặc None (nhận diện lại mọi khuôn mặt)
+        self.profile = profile  # DetectionProfile (độ phân giải phát hiện...)
+        self.size_model = size_model  # FaceSizeModel hoặc None (không học dải kích thước khuôn mặt)
+        self.credit = 0.0  # Tích luỹ priority mỗi vòng, được xử lý khi >= 1
+        self.processed = 0  # Số frame đã nhận diện
+        self.deferred = 0  # Số vòng có frame mới nhưng chưa tới lượt
+
+
+class InferenceScheduler:
+    """
+    Bộ lập lịch nhận diện dùng chung cho nhiều camera.
+
+    Mỗi vòng:
+    1. Mỗi camera được cộng priority vào credit (giới hạn max(1, priority)).
+    2. Các camera có credit >= 1 và có frame chưa xử lý được chọn theo thứ tự
+       round-robin (điểm bắt đầu xoay mỗi vòng), camera credit cao hơn đứng trước;
+       tối đa max_cameras_per_batch camera mỗi lô, mỗi camera được chọn trừ 1 credit.
+    3. Phát hiện khuôn mặt từng frame, rồi trích xuất + so khớp mọi ROI trong một lần
+       và trả kết quả về callback của từng camera. Phát hiện và trích xuất chạy
+       trong process hiện tại hoặc trong pool process (ADVANCED['num_workers']).
+
+    Priority 1 = mọi frame mới đều được xử lý, 0.5 = tối đa mỗi 2 vòng,
+    > 1 = được ưu tiên khi lô đã đầy.
+    """
+
+    def __init__(self, face_recognizer, camera_manager, max_cameras_per_batch: int = None,
+                 idle_timeout: float = None, backend=None, governor=None):
+        """
+        Args:
+            face_recognizer: FaceRecognizer
+            camera_manager: CameraManager
+            backend: Backend nhận diện (mặc định tạo theo ADVANCED['num_workers'])
+            governor: CadenceGovernor điều tiết nhịp phát hiện (mặc định governor dùng chung của
+                process theo CADENCE; None nếu tắt)
+            max_cameras_per_batch: Số camera tối đa mỗi lô (mặc định theo SCHEDULER)
+            idle_timeout: Giây chờ frame mới khi không có việc (mặc định theo SCHEDULER)
+        """
+        self.face_recognizer = face_recognizer
+        self.camera_manager = camera_manager
+        self.backend = backend or create_recognition_backend(face_recognizer)
+        self.governor = governor or get_cadence_governor()
+        self.max_cameras_per_batch = max_cameras_per_batch or SCHEDULER.get('max_cameras_per_batch', 16)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else SCHEDULER.get('idle_timeout', 0.5)
+
+        self.cameras = {}  # {camera_id: ScheduledCamera}
+        self._order = []  # Thứ tự round-robin
+        self._start = 0
+        self._lock = threading.Lock()
+        self._frame_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.batch_count = 0
+        self.batched_frames = 0
+
+    def register(self, camera_id, callback, rtsp_url=None, priority: float = None) -> bool:
+        """
+        Đăng ký camera vào bộ lập lịch (tự subscribe CameraManager).
+
+        Args:
+            camera_id: ID camera
+            callback: Hàm callback(camera_id, packet, detections) gọi trên thread lập lịch;
+                detections là None với frame chỉ hiển thị (governor bỏ qua phát hiện);
+                packet.frame chỉ hợp lệ trong lúc callback chạy (buffer được trả cho pool sau đó)
+            rtsp_url: URL RTSP (mặc định lấy từ CameraManager)
+            priority: Trọng số ưu tiên (mặc định theo SCHEDULER)
+
+        Returns:
+            True nếu đăng ký thành công
+        """
+        if priority is None:
+            priority = SCHEDULER.get('camera_priorities', {}).get(camera_id, SCHEDULER.get('default_priority', 1.0))
+        subscription = self.camera_manager.subscribe(camera_id, rtsp_url)
+        if subscription is None:
+            return False
+
+        with self._lock:
+            old = self.cameras.pop(camera_id, None)
+            if old is not None:
+                self._order.remove(camera_id)
+            self.cameras[camera_id] = ScheduledCamera(camera_id, subscription, callback, priority,
+                                                      create_motion_gate(camera_id),
+                                                      create_face_tracker(camera_id),
+                                                      create_detection_profile(camera_id,
+                                                                               self.camera_manager.db_manager),
+                                                      create_face_size_model(camera_id))
+            self._order.append(camera_id)
+        if self.governor is not None:
+            self.governor.register(camera_id)
+        if old is not None:
+            old.subscription.close()
+
+        self._frame_event.set()
+        self.start()
+        logger.info(f"Camera {camera_id} registered with scheduler (priority {priority})")
+        return True
+
+    def unregister(self, camera_id):
+        """Gỡ camera khỏi bộ lập lịch và huỷ subscribe"""
+        with self._lock:
+            camera = self.cameras.pop(camera_id, None)
+            if camera is None:
+                return
+            self._order.remove(camera_id)
+        if self.governor is not None:
+            self.governor.unregister(camera_id)
+        camera.subscription.close()
+        logger.info(f"Camera {camera_id} unregistered from scheduler")
+
+    def set_priority(self, camera_id, priority: float):
+        """Đổi trọng số ưu tiên của camera"""
+        with self._lock:
+            if camera_id in self.cameras:
+                self.cameras[camera_id].priority = priority
+
+    def start(self):
+        """Khởi động thread lập lịch (nếu chưa chạy)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self.camera_manager.add_frame_listener(self._frame_event)
+        self._thread = threading.Thread(target=self._run, name="InferenceScheduler", daemon=True)
+        self._thread.start()
+        logger.info("Inference scheduler started")
+
+    def stop(self):
+        """Dừng thread lập lịch và huỷ subscribe mọi camera"""
+        self._stop_event.set()
+        self._frame_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self.camera_manager.remove_frame_listener(self._frame_event)
+        for camera_id in list(self.cameras):
+            self.unregister(camera_id)
+        self.backend.shutdown()
+        logger.info("Inference scheduler stopped")
+
+    def _select(self):
+        """
+        Chọn các camera (và frame) cho lô kế tiếp theo round-robin có trọng số.
+
+        Returns:
+            (selected, display_only) - danh sách (camera, packet) cần phát hiện và
+            danh sách (camera, packet) governor cho là chỉ hiển thị
+        """
+        with self._lock:
+            count = len(self._order)
+            if count == 0:
+                return [], []
+            self._start %= count
+            rotated = self._order[self._start:] + self._order[:self._start]
+            self._start += 1
+            cameras = [self.cameras[camera_id] for camera_id in rotated]
+
+        for camera in cameras:
+            camera.credit = min(camera.credit + camera.priority, max(1.0, camera.priority))
+        eligible = sorted((c for c in cameras if c.credit >= 1.0), key=lambda c: -c.credit)
+
+        selected = []
+        display_only = []
+        for camera in eligible:
+            if len(selected) >= self.max_cameras_per_batch:
+                # Có frame nhưng lô đã đầy: giữ credit để vòng sau được ưu tiên
+                camera.deferred += 1
+                continue
+            packet = camera.subscription.poll()
+            if packet is None:
+                continue
+            if self.governor is not None and not self.governor.should_detect(camera.camera_id, packet.timestamp):
+                display_only.append((camera, packet))
+                continue
+            camera.credit -= 1.0
+            selected.append((camera, packet))
+        return selected, display_only
+
+    def _run(self):
+        """Vòng lặp chính của thread lập lịch"""
+        while not self._stop_event.is_set():
+            # Clear trước khi poll: frame đến sau thời điểm này sẽ đánh thức lần chờ bên dưới
+            self._frame_event.clear()
+            selected, display_only = self._select()
+            if not selected and not display_only:
+                self._frame_event.wait(self.idle_timeout)
+                continue
+            for camera, packet in display_only:
+                with packet:
+                    self._deliver(camera, packet, None)
+            if not selected:
+                continue
+            try:
+                self._process_batch(selected)
+            except Exception as e:
+                logger.error(f"Error in scheduler batch: {e}")
+            finally:
+                # Trả buffer frame cho pool của camera sau khi callback đã vẽ xong
+                for _, packet in selected:
+                    packet.release()
+
+    def _process_batch(self, selected):
+        """Phát hiện từng frame, nhận diện cả lô, rồi trả kết quả cho từng camera"""
+        start = time.perf_counter()
+        frames = [packet.frame for _, packet in selected]
+        # Cổng chuyển động: frame đứng yên không chạy Haar, frame có chuyển động chỉ quét vùng chuyển động
+        regions = [camera.motion_gate.regions(packet.frame) if camera.motion_gate is not None else None
+                   for camera, packet in selected]
+        trackers = [camera.tracker for camera, _ in selected]
+        # Dải kích thước khuôn mặt đã học thu hẹp khoảng scale của cascade
+        profiles = [camera.size_model.apply(camera.profile) if camera.size_model is not None else camera.profile
+                    for camera, _ in selected]
+        results = self.backend.recognize_frames(frames, regions, trackers, profiles)
+        # Chi phí của lô được chia đều cho các frame trong lô
+        cost = (time.perf_counter() - start) / len(selected)
+        self.batch_count += 1
+        self.batched_frames += len(selected)
+
+        for (camera, packet), camera_regions, camera_results in zip(selected, regions, results):
+            camera.processed += 1
+            if camera.size_model is not None:
+                camera.size_model.observe([r['location'][1] - r['location'][3] for r in camera_results],
+                                          [r['track_id'] for r in camera_results])
+            if self.governor is not None:
+                motion = None if camera_regions is None else len(camera_regions) > 0
+                self.governor.record(camera.camera_id, packet.timestamp, cost, len(camera_results), motion)
+            self._deliver(camera, packet, camera_results)
+
+    def _deliver(self, camera, packet, detections):
+        """Gọi callback của camera, không để lỗi callback làm dừng bộ lập lịch"""
+        try:
+            camera.callback(camera.camera_id, packet, detections)
+        except Exception as e:
+            logger.error(f"Camera {camera.camera_id}: error in scheduler callback: {e}")
+
+    def get_stats(self) -> dict:
+        """Thống kê: số lô, số frame trung bình mỗi lô; mỗi camera: frame đã xử lý / bị hoãn, cổng chuyển động, theo vết, dải kích thước khuôn mặt"""
+        with self._lock:
+            cameras = {
+                camera_id: {
+                    'priority': c.priority,
+                    'processed': c.processed,
+                    'deferred': c.deferred,
+                    'motion': c.motion_gate.get_stats() if c.motion_gate is not None else None,
+                    'tracking': c.tracker.get_stats() if c.tracker is not None else None,
+                    'face_size': c.size_model.get_stats() if c.size_model is not None else None,
+                }
+                for camera_id, c in self.cameras.items()
+            }
+        return {
+            'batches': self.batch_count,
+            'avg_batch_size': self.batched_frames / self.batch_count if self.batch_count else 0.0,
+            'cameras': cameras,
+            'cadence': self.governor.get_stats() if self.governor is not None else None,
+        }
@@ -0,0 +1,144 @@
+"""
+Module cổng chuyển động (motion gate) đặt trước bước phát hiện khuôn mặt
+Frame được thu nhỏ rồi so sánh với frame trước (frame difference) hoặc qua bộ
+trừ nền MOG2; chỉ frame có chuyển động mới chạy Haar, và chỉ trong vùng chuyển động
+"""
+
+import logging
+import cv2
+from config.config import MOTION, camera_settings
+from box_utils import merge_boxes
+
+logger = logging.getLogger(__name__)
+
+
+class MotionGate:
+    """
+    Cổng chuyển động của một camera.
+
+    regions(frame) trả về:
+    - [] nếu không có chuyển động (bỏ qua phát hiện khuôn mặt cho frame này)
+    - danh sách (x, y, w, h) theo toạ độ frame gốc, đã nới rộng và gộp các vùng chồng nhau
+
+    Vùng chuyển động gần nhất được giữ thêm hold_frames frame sau khi cảnh đứng yên,
+    để người vừa dừng lại trước camera vẫn được nhận diện.
+    """
+
+    def __init__(self, method: str = 'diff', scale_width: int = 160, diff_threshold: int = 25,
+                 min_area_ratio: float = 0.002, padding: float = 0.25, hold_frames: int = 5,
+                 full_frame_ratio: float = 0.6, mog2_history: int = 500, mog2_var_threshold: float = 16):
+        """
+        Args:
+            method: 'diff' (hiệu hai frame liên tiếp) hoặc 'mog2' (trừ nền MOG2)
+            scale_width: Chiều rộng frame thu nhỏ dùng để dò chuyển động
+            diff_threshold: Ngưỡng sai khác mức xám (chế độ 'diff')
+            min_area_ratio: Diện tích vùng chuyển động tối thiểu (tỷ lệ so với frame)
+            padding: Nới rộng mỗi vùng theo tỷ lệ kích thước vùng (bao trọn khuôn mặt)
+            hold_frames: Số frame giữ vùng chuyển động sau khi cảnh đứng yên
+            full_frame_ratio: Tổng diện tích vùng vượt tỷ lệ này thì quét cả frame
+            mog2_history, mog2_var_threshold: Tham số MOG2
+        """
+        self.method = method
+        self.scale_width = scale_width
+        self.diff_threshold = diff_threshold
+        self.min_area_ratio = min_area_ratio
+        self.padding = padding
+        self.hold_frames = hold_frames
+        self.full_frame_ratio = full_frame_ratio
+        self.subtractor = None
+        if method == 'mog2':
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=mog2_history, varThreshold=mog2_var_threshold, detectShadows=False)
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+        self._previous = None
+        self._last_regions = []
+        self._hold = 0
+        self.hits = 0  # Frame có chuyển động (chạy phát hiện)
+        self.skips = 0  # Frame đứng yên (bỏ qua)
+
+    def _motion_mask(self, small):
+        """Mặt nạ nhị phân các pixel chuyển động trên frame thu nhỏ"""
+        if self.subtractor is not None:
+            mask = self.subtractor.apply(small)
+            return cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        previous, self._previous = self._previous, small
+        if previous is None:
+            return None
+        diff = cv2.absdiff(small, previous)
+        _, mask = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+        return cv2.dilate(mask, self.kernel, iterations=2)
+
+    def regions(self, frame):
+        """
+        Tìm vùng chuyển động trên frame BGR.
+
+        Returns:
+            Danh sách (x, y, w, h) theo toạ độ frame gốc; [] nếu không có chuyển động
+        """
+        height, width = frame.shape[:2]
+        scale = width / self.scale_width
+        small = cv2.resize(frame, (self.scale_width, max(1, int(round(height / scale)))),
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        mask = self._motion_mask(small)
+        if mask is None:
+            # Frame đầu tiên chưa có gì để so sánh: quét toàn bộ
+            boxes = [(0, 0, width, height)]
+        else:
+            min_area = self.min_area_ratio * small.shape[0] * small.shape[1]
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            boxes = [self._to_frame(cv2.boundingRect(c), scale, width, height)
+                     for c in contours if cv2.contourArea(c) >= min_area]
+            boxes = merge_boxes(boxes)
+            if sum(w * h for (_, _, w, h) in boxes) > self.full_frame_ratio * width * height:
+                boxes = [(0, 0, width, height)]
+
+        if boxes:
+            self._last_regions = boxes
+            self._hold = self.hold_frames
+        elif self._hold > 0:
+            self._hold -= 1
+            boxes = self._last_regions
+
+        if boxes:
+            self.hits += 1
+        else:
+            self.skips += 1
+        return boxes
+
+    def _to_frame(self, box, scale, width, height):
+        """Đổi hộp từ frame thu nhỏ về frame gốc và nới rộng theo padding"""
+        x, y, w, h = box
+        pad_x = w * self.padding + 1
+        pad_y = h * self.padding + 1
+        x0 = max(0, int((x - pad_x) * scale))
+        y0 = max(0, int((y - pad_y) * scale))
+        x1 = min(width, int((x + w + pad_x) * scale))
+        y1 = min(height, int((y + h + pad_y) * scale))
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def get_stats(self) -> dict:
+        """Thống kê: số frame có chuyển động / bị bỏ qua và tỷ lệ bỏ qua"""
+        total = self.hits + self.skips
+        return {
+            'hits': self.hits,
+            'skips': self.skips,
+            'skip_ratio': self.skips / total if total else 0.0,
+        }
+
+
+def create_motion_gate(camera_id=None):
+    """
+    Tạo MotionGate cho camera theo MOTION trong config.
+
+    Cấu hình chung có thể bị ghi đè theo camera qua MOTION['cameras'][camera_id].
+
+    Returns:
+        MotionGate hoặc None nếu camera không bật cổng chuyển động
+    """
+    settings = camera_settings(MOTION, camera_id)
+    if settings is None:
+        return None
+    return MotionGate(**settings)
@@ -0,0 +1,303 @@
+"""
+Module backend nhận diện: chạy trong process GUI hoặc trong pool process worker
+- InProcessBackend: phát hiện + trích xuất + so khớp ngay trong process hiện tại
+- ProcessPoolBackend: phát hiện + trích xuất trong các process worker, frame truyền
+  qua multiprocessing.shared_memory thay vì pickle; so khớp (và theo vết) ở process chính
+"""
+
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from config.config import ADVANCED
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessBackend:
+    """Backend mặc định: gọi thẳng FaceRecognizer trong thread hiện tại"""
+
+    num_workers = 1
+
+    def __init__(self, face_recognizer):
+        self.face_recognizer = face_recognizer
+
+    def recognize_frames(self, frames, regions=None, trackers=None, profiles=None):
+        """
+        Nhận diện một lô frame BGR, trả danh sách kết quả theo frame.
+
+        Args:
+            frames: Danh sách frame BGR
+            regions: Danh sách vùng quét theo frame (None = toàn bộ mọi frame)
+            trackers: Danh sách FaceTracker hoặc None theo frame
+            profiles: Danh sách DetectionProfile hoặc None theo frame
+        """
+        if regions is None:
+            regions = [None] * len(frames)
+        if profiles is None:
+            profiles = [None] * len(frames)
+        return self.face_recognizer.recognize_faces(
+            [self.face_recognizer.detect_faces(f, r, p) for f, r, p in zip(frames, regions, profiles)],
+            trackers, profiles)
+
+    def shutdown(self):
+        pass
+
+
+# ==================== WORKER ====================
+# Các hàm dưới đây chạy trong process worker
+
+_worker_segments = {}  # {tên shared memory: SharedMemory} - giữ kết nối giữa các task
+
+
+def _worker_init():
+    """Khởi tạo worker: mỗi process chỉ dùng 1 thread OpenCV để các worker không tranh CPU"""
+    cv2.setNumThreads(1)
+
+
+def _worker_frame(segment_name, shape, dtype):
+    """View numpy vào frame nằm trong shared memory (giữ kết nối segment giữa các task)"""
+    segment = _worker_segments.get(segment_name)
+    if segment is None:
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _worker_segments[segment_name] = segment
+    return np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _worker_detect_and_extract(segment_name, shape, dtype, regions=None, extract=True, profile=None):
+    """
+    Phát hiện khuôn mặt (trong regions nếu có) và trích xuất Zernike cho frame nằm trong shared memory.
+
+    Args:
+        extract: False = chỉ phát hiện (process chính theo vết rồi gửi lại các khuôn mặt
+            cần nhận diện cho _worker_extract)
+        profile: DetectionProfile của camera (kèm cổng chất lượng nếu có)
+
+    Returns:
+        (faces, features, rejections) - numpy array (K, 4) int32, (M, D) float64 của M khuôn
+        mặt đạt chất lượng và danh sách K lý do bị loại (None = đạt); hai phần sau là None
+        nếu extract=False
+    """
+    # Import trong worker để process chính không phải tải cascade khi chỉ dùng pool
+    from face_detector import face_cascade_provider
+    from face_recognizer import select_face_rois
+    from zernike_utils import get_faces_moments_zernike_batch
+
+    frame = _worker_frame(segment_name, shape, dtype)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    del frame  # Không giữ view vào shared memory sau khi đã chuyển sang ảnh xám
+    faces = face_cascade_provider.detect_regions(gray, regions, 1.1, 8, profile=profile)
+    if not extract:
+        return faces, None, None
+    rois, rejections = select_face_rois(gray, faces, profile)
+    return faces, get_faces_moments_zernike_batch(rois), rejections
+
+
+def _worker_extract(segment_name, shape, dtype, faces, profile=None):
+    """
+    Cổng chất lượng + trích xuất Zernike cho các khuôn mặt chỉ định của frame trong shared memory.
+
+    Dùng khi theo vết: chỉ khuôn mặt của track mới / tới hạn xác minh lại được gửi sang.
+
+    Returns:
+        (features, rejections) - (M, D) float64 của M khuôn mặt đạt chất lượng và danh sách
+        lý do bị loại (None = đạt) theo từng khuôn mặt
+    """
+    from face_recognizer import select_face_rois
+    from zernike_utils import get_faces_moments_zernike_batch
+
+    frame = _worker_frame(segment_name, shape, dtype)
+    rois, rejections = select_face_rois(frame, faces, profile)
+    del frame
+    # ROI đã là bản sao xám (cvtColor), không còn tham chiếu tới shared memory
+    return get_faces_moments_zernike_batch(rois), rejections
+
+
+# ==================== PROCESS POOL BACKEND ====================
+
+class FrameSlot:
+    """Một vùng shared memory tái sử dụng để truyền frame sang worker"""
+
+    def __init__(self, size: int):
+        self.segment = shared_memory.SharedMemory(create=True, size=size)
+        self.size = size
+
+    def write(self, frame):
+        """Copy frame vào shared memory (một lần memcpy, không pickle)"""
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.segment.buf)
+        view[...] = frame
+        del view
+
+    def close(self):
+        self.segment.close()
+        self.segment.unlink()
+
+
+class ProcessPoolBackend:
+    """
+    Backend nhận diện bằng pool process.
+
+    Haar detection và trích xuất Zernike (phần tốn CPU) chạy song song trong
+    num_workers process, mỗi frame một task. Frame được copy vào một FrameSlot
+    shared memory dùng lại giữa các lô; worker chỉ nhận tên slot + shape, và chỉ
+    trả về toạ độ khuôn mặt và vector đặc trưng (vài trăm byte).
+
+    So khớp thực hiện ở process chính trên snapshot gallery bất biến của
+    FaceRecognizer (một phép nhân ma trận cho cả lô), nên gallery không bị
+    copy sang worker và mọi cập nhật gallery có hiệu lực ngay.
+
+    Khi theo vết, lô chạy hai lượt: worker phát hiện, process chính ghép track
+    (trạng thái tracker chỉ nằm ở process chính), rồi worker trích xuất riêng
+    các khuôn mặt cần nhận diện từ cùng FrameSlot.
+    """
+
+    def __init__(self, face_recognizer, num_workers: int):
+        self.face_recognizer = face_recognizer
+        self.num_workers = num_workers
+        self.executor = self._create_executor()
+        self._free_slots = []
+        self._slots_lock = threading.Lock()
+        self._closed = False
+        logger.info(f"Process pool recognition backend started with {num_workers} workers")
+
+    def _create_executor(self):
+        # spawn: an toàn với process GUI nhiều thread (fork có thể sao chép lock đang bị giữ)
+        return ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_worker_init,
+        )
+
+    def _acquire_slot(self, nbytes: int) -> FrameSlot:
+        with self._slots_lock:
+            for i, slot in enumerate(self._free_slots):
+                if slot.size >= nbytes:
+                    return self._free_slots.pop(i)
+        return FrameSlot(nbytes)
+
+    def _release_slot(self, slot: FrameSlot):
+        with self._slots_lock:
+            if self._closed:
+                slot.close()
+            else:
+                self._free_slots.append(slot)
+
+    def recognize_frames(self, frames, regions=None, trackers=None, profiles=None):
+        """
+        Nhận diện một lô frame BGR, trả danh sách kết quả theo frame.
+
+        Frame có regions rỗng (không chuyển động) không được gửi sang worker.
+        Khi có tracker, worker phát hiện trước; sau khi process chính ghép track,
+        ROI của riêng các track mới / tới hạn xác minh lại được gửi lại worker để
+        qua cổng chất lượng và trích xuất, FrameSlot được giữ tới hết lượt này.
+        """
+        if regions is None:
+            regions = [None] * len(frames)
+        if profiles is None:
+            profiles = [None] * len(frames)
+        tracking = trackers is not None and any(t is not None for t in trackers)
+        empty = (np.empty((0, 4), dtype=np.int32), np.empty((0, 0)), [])
+        slots = []
+        try:
+            futures = []
+            for frame, frame_regions, profile in zip(frames, regions, profiles):
+                if frame_regions is not None and len(frame_regions) == 0:
+                    futures.append(None)
+                    slots.append(None)
+                    continue
+                slot = self._acquire_slot(frame.nbytes)
+                slots.append(slot)
+                slot.write(frame)
+                futures.append(self.executor.submit(
+                    _worker_detect_and_extract, slot.segment.name, frame.shape, frame.dtype.str,
+                    frame_regions, not tracking, profile))
+            extracted = [future.result() if future is not None else empty for future in futures]
+        except BrokenProcessPool:
+            self._restart_executor()
+            for slot in slots:
+                if slot is not None:
+                    self._release_slot(slot)
+            return InProcessBackend(self.face_recognizer).recognize_frames(frames, regions, trackers, profiles)
+
+        try:
+            if tracking:
+                # Frame bị bỏ qua giữ ảnh None để tracker không bị đổi trạng thái
+                detections = [(frame if future is not None else None, faces)
+                              for frame, future, (faces, _, _) in zip(frames, futures, extracted)]
+                return self.face_recognizer.recognize_faces(
+                    detections, trackers, profiles,
+                    extractor=lambda needed: self._extract_needed(frames, slots, needed, profiles))
+        finally:
+            for slot in slots:
+                if slot is not None:
+                    self._release_slot(slot)
+
+        faces_per_frame = [faces for faces, _, _ in extracted]
+        features = [features for _, features, _ in extracted if len(features)]
+        features_batch = np.vstack(features) if features else np.empty((0, 0))
+        rejections = [rejections for _, _, rejections in extracted]
+        return self.face_recognizer.match_faces(faces_per_frame, features_batch, rejections)
+
+    def _extract_needed(self, frames, slots, needed, profiles):
+        """
+        Lượt hai khi theo vết: trích xuất các khuôn mặt cần nhận diện trong worker.
+
+        Tracker đã được ghép ở lượt này nên khi pool hỏng không thể chạy lại cả lô;
+        phần trích xuất còn lại được làm ngay trong process chính.
+        """
+        try:
+            futures = []
+            for frame, slot, faces, profile in zip(frames, slots, needed, profiles):
+                if len(faces) == 0:
+                    futures.append(None)
+                    continue
+                futures.append(self.executor.submit(
+                    _worker_extract, slot.segment.name, frame.shape, frame.dtype.str,
+                    np.asarray(faces, dtype=np.int32), profile))
+            extracted = [future.result() if future is not None else (None, [])
+                         for future in futures]
+        except BrokenProcessPool:
+            self._restart_executor()
+            return self.face_recognizer.extract_faces(frames, needed, profiles)
+        features = [features for features, _ in extracted if features is not None and len(features)]
+        features_batch = np.vstack(features) if features else np.empty((0, 0))
+        return features_batch, [rejections for _, rejections in extracted]
+
+    def _restart_executor(self):
+        # Worker chết (OOM, crash OpenCV...): dựng lại pool, lô này xử lý ngay trong process
+        logger.error("Recognition worker pool broken, restarting it")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._create_executor()
+
+    def shutdown(self):
+        """Dừng các worker và giải phóng shared memory"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self._slots_lock:
+            self._closed = True
+            for slot in self._free_slots:
+                slot.close()
+            self._free_slots.clear()
+        logger.info("Process pool recognition backend stopped")
+
+
+def create_recognition_backend(face_recognizer, num_workers: int = None):
+    """
+    Tạo backend nhận diện theo ADVANCED['num_workers'].
+
+    Args:
+        face_recognizer: FaceRecognizer
+        num_workers: Số process worker (mặc định theo config; <= 1 = chạy trong process)
+
+    Returns:
+        InProcessBackend hoặc ProcessPoolBackend
+    """
+    if num_workers is None:
+        num_workers = ADVANCED.get('num_workers', 1)
+    if num_workers <= 1:
+        return InProcessBackend(face_recognizer)
+    return ProcessPoolBackend(face_recognizer, num_workers)
@@ -5,46 +5,212 @@ Module tiện ích trích xuất đặc trưng Zernike Moments
 
 import cv2
 import numpy as np
-import mahotas
+from functools import lru_cache
+from math import factorial, pi
+from face_detector import face_cascade_provider
 
 # Cấu hình Zernike
 RADIUS = 100
 DEGREE = 8
+ROI_SIZE = 200  # ROI được resize về ROI_SIZE x ROI_SIZE trước khi tính moments
+# Phiên bản descriptor, lưu kèm template trong DB; tăng mỗi khi cách tính đặc trưng thay đổi.
+# Template mang phiên bản khác được trích xuất lại từ ảnh đăng ký khi nạp gallery.
+# 1 = mahotas.features.zernike_moments mặc định (tâm khối lượng của ROI)
+DESCRIPTOR_VERSION = 1
+CHUNK_SIZE = 4  # Số ROI mỗi lần tính trong moments_batch
+_DISK_LIMIT = 1.0 + np.finfo(np.float64).eps
 
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+def _poly_mul(p, q):
+    """Nhân hai đa thức hai biến dạng mảng hệ số c[a, b] của x^a y^b"""
+    out = np.zeros((p.shape[0] + q.shape[0] - 1, p.shape[1] + q.shape[1] - 1), dtype=np.complex128)
+    for (a, b), coef in np.ndenumerate(p):
+        if coef != 0:
+            out[a:a + q.shape[0], b:b + q.shape[1]] += coef * q
+    return out
+
+
+class ZernikeBasis:
+    """
+    Hệ số Zernike tính sẵn cho bộ tham số (size, radius, degree).
+
+    Mỗi đa thức Zernike V*_nl là đa thức bậc <= degree theo toạ độ chuẩn hoá
+    (x, y) quanh tâm, nên moment Z_nl là tổ hợp tuyến tính cố định của các
+    moment đơn thức M_ab = sum f * x^a * y^b trong đường tròn bán kính radius.
+    Vì x chỉ phụ thuộc cột và y chỉ phụ thuộc hàng, M = Y^T (f * đường tròn) X
+    chỉ là hai phép nhân ma trận nhỏ với bất kỳ tâm nào, nên tâm được lấy theo
+    tâm khối lượng của từng ROI như mahotas.features.zernike_moments mặc định
+    (hoặc tâm truyền vào, tương đương tham số cm của mahotas).
+    """
+
+    def __init__(self, size=ROI_SIZE, radius=RADIUS, degree=DEGREE):
+        self.size = size
+        self.radius = radius
+        self.degree = degree
+        self._coords = np.arange(size, dtype=np.float64)
+        self._powers = np.arange(degree + 1)
+
+        # Hệ số (n + 1) / pi * conj(R_nl(rho) * e^(i*l*theta)) = (n + 1) / pi * sum_m c_m (x^2 + y^2)^k (x - iy)^l
+        r2 = np.zeros((3, 3), dtype=np.complex128)
+        r2[2, 0] = r2[0, 2] = 1  # x^2 + y^2
+        conj_a = np.zeros((2, 2), dtype=np.complex128)
+        conj_a[1, 0], conj_a[0, 1] = 1, -1j  # x - iy
+        rows = []
+        for n in range(degree + 1):
+            for l in range(n + 1):
+                if (n - l) % 2 == 0:
+                    angular = np.ones((1, 1), dtype=np.complex128)
+                    for _ in range(l):
+                        angular = _poly_mul(angular, conj_a)
+                    poly = np.zeros((degree + 1, degree + 1), dtype=np.complex128)
+                    for m in range((n - l) // 2 + 1):
+                        coef = (-1) ** m * factorial(n - m) / (
+                            factorial(m) * factorial((n - 2 * m + l) // 2) * factorial((n - 2 * m - l) // 2)
+                        )
+                        term = angular
+                        for _ in range((n - l) // 2 - m):
+                            term = _poly_mul(term, r2)
+                        poly[:term.shape[0], :term.shape[1]] += coef * term
+                    rows.append((n + 1) / pi * poly.ravel())
+        self.coefficients = np.array(rows)  # (D, (degree + 1)^2) complex, cột a * (degree + 1) + b
+        self.dim = len(rows)
+
+    def _centers(self, row_sums, col_sums, totals):
+        """Tâm khối lượng (hàng, cột) của từng ROI, như mahotas.center_of_mass"""
+        rows = row_sums @ self._coords / totals
+        cols = col_sums @ self._coords / totals
+        return np.stack([rows, cols], axis=1)
+
+    def moments_batch(self, stack, centers=None):
+        """
+        Tính Zernike moments (độ lớn) cho cả chồng ROI.
+
+        Chồng ROI được xử lý theo từng nhóm CHUNK_SIZE ảnh để các mảng trung gian
+        float64 (CHUNK_SIZE x size x size) nằm gọn trong cache.
+
+        Args:
+            stack: numpy array (N, size, size) các ROI xám
+            centers: (N, 2) tâm (hàng, cột) từng ROI; None = tâm khối lượng
+
+        Returns:
+            numpy array (N, D) float64
+        """
+        count = stack.shape[0]
+        result = np.zeros((count, self.dim))
+        if centers is not None:
+            centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        for start in range(0, count, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, count)
+            result[start:end] = self._moments_chunk(stack[start:end],
+                                                    None if centers is None else centers[start:end])
+        return result
+
+    def _moments_chunk(self, stack, centers):
+        pixels = stack.astype(np.float64)
+        row_sums = pixels.sum(axis=2)
+        totals = row_sums.sum(axis=1)
+        valid = totals > 0
+        result = np.zeros((len(pixels), self.dim))
+        if not valid.any():
+            return result
+        if not valid.all():
+            pixels, row_sums, totals = pixels[valid], row_sums[valid], totals[valid]
+            if centers is not None:
+                centers = centers[valid]
+        if centers is None:
+            centers = self._centers(row_sums, pixels.sum(axis=1), totals)
+
+        # Toạ độ chuẩn hoá theo hàng / cột (tính giống mahotas để biên đường tròn trùng khớp)
+        ys = (self._coords[None, :] - centers[:, 0:1]) / self.radius  # (N, size)
+        xs = (self._coords[None, :] - centers[:, 1:2]) / self.radius
+        # mahotas giữ điểm có sqrt(x^2 + y^2) <= 1; với sqrt làm tròn đúng, điều đó tương
+        # đương x^2 + y^2 <= 1 + eps, so sánh trên bình phương không cần sqrt
+        inside = xs[:, None, :] ** 2 <= (_DISK_LIMIT - ys ** 2)[:, :, None]
+        pixels *= inside
+
+        y_powers = ys[:, None, :] ** self._powers[None, :, None]  # (N, degree + 1, size)
+        x_powers = xs[:, None, :] ** self._powers[None, :, None]
+        monomials = y_powers @ pixels @ x_powers.transpose(0, 2, 1)  # (N, b, a)
+        monomials = monomials.transpose(0, 2, 1).reshape(len(pixels), -1)  # cột a * (degree + 1) + b
+        weights = monomials[:, 0]  # M_00 = tổng điểm ảnh trong đường tròn
+        magnitudes = np.abs(monomials @ self.coefficients.T)
+        nonzero = weights > 0
+        magnitudes[nonzero] /= weights[nonzero, None]
+        magnitudes[~nonzero] = 0.0
+        result[valid] = magnitudes
+        return result
+
+    def moments(self, roi, center=None):
+        """
+        Tính vector Zernike moments (độ lớn) cho một ROI xám size x size.
+
+        Args:
+            center: (hàng, cột) tâm; None = tâm khối lượng (mặc định của mahotas)
+
+        Returns:
+            numpy array (D,) float64
+        """
+        return self.moments_batch(roi[None], None if center is None else [center])[0]
+
+
+@lru_cache(maxsize=None)
+def get_zernike_basis(size=ROI_SIZE, radius=RADIUS, degree=DEGREE):
+    """Lấy (hoặc dựng lần đầu) ZernikeBasis dùng chung cho bộ tham số (size, radius, degree)."""
+    return ZernikeBasis(size, radius, degree)
 
 
 def get_face_moments_zernike(img_or_roi_gray, radius=RADIUS, degree=DEGREE):
     """
     Trích xuất đặc trưng trực giao Zernike từ ảnh hoặc ROI.
-    
+
     Args:
         img_or_roi_gray: Ảnh BGR hoặc ROI xám
         radius: Bán kính Zernike
         degree: Bậc Zernike
-    
+
     Returns:
         Vector Zernike Moments (numpy array) hoặc None nếu không tìm thấy khuôn mặt
     """
     # Nếu input là ảnh BGR (3 kênh), phát hiện khuôn mặt
     if len(img_or_roi_gray.shape) == 3:
         gray = cv2.cvtColor(img_or_roi_gray, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.1, 8)
-        
+        faces = face_cascade_provider.detect(gray, 1.1, 8)
+
         if len(faces) == 0:
             return None
-        
+
         # Lấy khuôn mặt lớn nhất
         (x, y, w, h) = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)[0]
         roi_gray = gray[y:y+h, x:x+w]
     else:
         # Input đã là ROI xám
         roi_gray = img_or_roi_gray
-    
+
     # Resize về kích thước cố định
-    roi_resized = cv2.resize(roi_gray, (200, 200))
-    
-    # Tính Zernike Moments
-    z_moments = mahotas.features.zernike_moments(roi_resized, radius, degree=degree)
-    
-    return np.array(z_moments)
+    roi_resized = cv2.resize(roi_gray, (ROI_SIZE, ROI_SIZE))
+
+    # Tính Zernike Moments bằng ma trận cơ sở tính sẵn
+    return get_zernike_basis(ROI_SIZE, radius, degree).moments(roi_resized)
+
+
+def get_faces_moments_zernike_batch(rois_gray, radius=RADIUS, degree=DEGREE):
+    """
+    Trích xuất Zernike moments cho nhiều ROI xám cùng lúc.
+
+    Các ROI được resize thẳng vào một mảng (N, ROI_SIZE, ROI_SIZE) cấp phát sẵn,
+    sau đó toàn bộ được chiếu lên ma trận cơ sở trong một lần.
+
+    Args:
+        rois_gray: Danh sách ROI xám (kích thước bất kỳ)
+        radius: Bán kính Zernike
+        degree: Bậc Zernike
+
+    Returns:
+        numpy array (N, D), hàng i ứng với rois_gray[i]
+    """
+    basis = get_zernike_basis(ROI_SIZE, radius, degree)
+    stack = np.empty((len(rois_gray), ROI_SIZE, ROI_SIZE), dtype=np.uint8)
+    for i, roi in enumerate(rois_gray):
+        cv2.resize(roi, (ROI_SIZE, ROI_SIZE), dst=stack[i])
+    return basis.moments_batch(stack)
+
@@ -0,0 +1,12 @@
+"""
+Cấu hình pytest: các module trong src/ import lẫn nhau theo tên phẳng
+(VD: from face_detector import ...) và đọc config.config từ thư mục gốc
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'src')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
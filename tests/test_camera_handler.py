@@ -0,0 +1,118 @@
+"""Kiểm tra subscription đếm tham chiếu và tái sử dụng buffer frame theo lease của CameraManager"""
+
+import time
+
+import numpy as np
+import pytest
+
+import camera_handler
+from camera_handler import CameraManager, FramePool, SubscriptionClosed
+
+SHAPE = (4, 4, 3)
+
+
+class FakeCapture:
+    """VideoCapture giả: mỗi frame được tô bằng số thứ tự của nó, ghi thẳng vào buffer truyền vào"""
+
+    def __init__(self, url):
+        self.count = 0
+        self.released = False
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return 0  # Nguồn live: không giữ nhịp FPS
+
+    def read(self, image=None):
+        time.sleep(0.005)
+        self.count += 1
+        frame = np.empty(SHAPE, dtype=np.uint8) if image is None else image
+        frame[...] = self.count % 256
+        return True, frame
+
+    def grab(self):
+        return True
+
+    def retrieve(self, image=None):
+        return self.read(image)
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(camera_handler.cv2, 'VideoCapture', FakeCapture)
+    manager = CameraManager(None, decode_on_demand=False)
+    yield manager
+    manager.stop_all()
+
+
+def test_camera_runs_until_last_unsubscribe(manager):
+    first = manager.subscribe(1, 'fake://1')
+    second = manager.subscribe(1)
+    assert manager.get_subscriber_count(1) == 2
+    capture = manager.captures[1]
+
+    first.close()
+    assert manager.is_running(1)
+    packet = second.get_next_frame(timeout=1.0)
+    assert packet is not None
+    packet.release()
+
+    second.close()
+    assert not manager.is_running(1)
+    assert manager.get_subscriber_count(1) == 0
+    assert capture.released
+
+
+def test_closed_subscription_raises(manager):
+    subscription = manager.subscribe(1, 'fake://1')
+    with subscription.get_next_frame(timeout=1.0) as packet:
+        assert packet.seq > 0
+    subscription.close()
+    with pytest.raises(SubscriptionClosed):
+        subscription.get_next_frame(timeout=0.1)
+    assert subscription.poll() is None
+
+
+def test_leased_frame_is_not_overwritten(manager):
+    subscription = manager.subscribe(1, 'fake://1')
+    packet = subscription.get_next_frame(timeout=1.0)
+    held = packet.frame.copy()
+
+    # Đợi capture quay hết vòng buffer vài lần trong khi packet vẫn được giữ
+    for _ in range(20):
+        with subscription.get_next_frame(timeout=1.0):
+            pass
+    np.testing.assert_array_equal(packet.frame, held)
+    assert manager.get_capture_stats(1)['allocations'] > 0
+
+    packet.release()
+    allocations = manager.get_capture_stats(1)['allocations']
+    for _ in range(20):
+        with subscription.get_next_frame(timeout=1.0):
+            pass
+    # Khi mọi packet đã release, vòng buffer được tái sử dụng thay vì cấp phát thêm
+    assert manager.get_capture_stats(1)['allocations'] <= allocations + 1
+    subscription.close()
+
+
+def test_pool_never_hands_out_a_leased_buffer():
+    pool = FramePool(size=2)
+    published = None
+    held_frame, held_lease = None, None
+    for i in range(10):
+        buf = pool.acquire()
+        if held_lease is not None:
+            assert buf is not held_frame
+        frame, lease = pool.commit(buf, np.zeros(SHAPE, dtype=np.uint8) if buf is None else buf)
+        if published is not None:
+            published.release()  # Frame cũ thôi được công bố
+        published = lease
+        if i == 2:
+            # Consumer giữ frame thứ 3 suốt phần còn lại
+            held_frame, held_lease = frame, lease
+            held_lease.acquire()
+    assert held_lease.in_use
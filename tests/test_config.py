@@ -0,0 +1,25 @@
+"""Kiểm tra gộp cấu hình chung với phần ghi đè theo camera"""
+
+from config.config import camera_settings
+
+SECTION = {
+    'enabled': False,
+    'threshold': 10,
+    'learning': {'enabled': True, 'window': 100},
+    'cameras': {
+        2: {'enabled': True, 'threshold': 20},
+        3: {'learning': {'enabled': False}},
+    },
+}
+
+
+def test_camera_override_and_switch():
+    assert camera_settings(SECTION, 1) is None
+    assert camera_settings(SECTION, 2) == {'threshold': 20, 'learning': {'enabled': True, 'window': 100}}
+    assert camera_settings({'threshold': 10}, 1) == {'threshold': 10}
+
+
+def test_nested_key_uses_nested_override():
+    assert camera_settings(SECTION, 1, key='learning') == {'window': 100}
+    assert camera_settings(SECTION, 3, key='learning') is None
+    assert camera_settings({}, 1, key='learning') == {}
@@ -0,0 +1,65 @@
+"""Kiểm tra chuyển đổi BLOB đặc trưng pickle cũ sang float32 thô"""
+
+import os
+import pickle
+
+import numpy as np
+
+from database import FEATURE_DTYPE, LEGACY_DESCRIPTOR_VERSION, DatabaseManager
+
+
+class _Exploit:
+    """Pickle gọi os.system khi được giải nén bằng pickle.loads thông thường"""
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return os.system, (f'touch {self.marker}',)
+
+
+def _store_legacy_blob(db, user_id, blob):
+    """Ghi BLOB như phiên bản cũ: pickle, chưa có feature_dtype/feature_dim"""
+    db.conn.execute('''
+        UPDATE users SET features = ?, feature_dtype = NULL, feature_dim = NULL, descriptor_version = NULL
+        WHERE id = ?
+    ''', (blob, user_id))
+    db.conn.commit()
+
+
+def test_pickled_features_are_migrated_to_float32(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'data' / 'test.db'))
+    alice = db.add_user('alice', 'whitelist', None)
+    legacy = np.linspace(0.0, 1.0, 25)
+    _store_legacy_blob(db, alice, pickle.dumps(legacy))
+
+    assert db.migrate_pickled_features() == 1
+
+    row = db.conn.execute(
+        'SELECT features, feature_dtype, feature_dim, descriptor_version FROM users WHERE id = ?',
+        (alice,)).fetchone()
+    assert row[1:] == (FEATURE_DTYPE, 25, LEGACY_DESCRIPTOR_VERSION)
+    assert len(row[0]) == 25 * 4
+    features = db.get_user_features(alice)
+    assert features.dtype == np.float32
+    np.testing.assert_allclose(features, legacy, rtol=1e-6)
+    # Đã chuyển đổi thì lần chạy sau không còn gì để làm
+    assert db.migrate_pickled_features() == 0
+    db.close()
+
+
+def test_pickle_with_disallowed_global_is_rejected(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'data' / 'test.db'))
+    mallory = db.add_user('mallory', 'blacklist', None)
+    marker = tmp_path / 'executed'
+    _store_legacy_blob(db, mallory, pickle.dumps(_Exploit(marker)))
+
+    assert db.migrate_pickled_features() == 0
+
+    assert not marker.exists()
+    # Dòng hỏng được đánh dấu feature_dim = 0 và bị bỏ qua khi nạp đặc trưng
+    row = db.conn.execute('SELECT feature_dim FROM users WHERE id = ?', (mallory,)).fetchone()
+    assert row[0] == 0
+    assert db.get_user_features(mallory) is None
+    assert mallory not in db.get_all_user_features()
+    db.close()
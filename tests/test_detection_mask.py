@@ -0,0 +1,45 @@
+"""Kiểm tra vùng phát hiện đa giác include/exclude"""
+
+import numpy as np
+
+from detection_mask import DetectionMask
+
+WIDTH, HEIGHT = 1000, 500
+LEFT_HALF = [[0, 0], [0.5, 0], [0.5, 1], [0, 1]]
+DOOR = [[0.1, 0.1], [0.2, 0.1], [0.2, 0.3], [0.1, 0.3]]
+
+
+def test_filter_keeps_faces_centred_inside_include_and_outside_exclude():
+    mask = DetectionMask(include=[LEFT_HALF], exclude=[DOOR])
+    faces = [
+        (300, 200, 40, 40),  # Trong nửa trái
+        (700, 200, 40, 40),  # Ngoài vùng include
+        (130, 80, 40, 40),  # Tâm trong vùng exclude
+        (480, 200, 60, 60),  # Vắt qua biên, tâm (510, 230) nằm ngoài
+    ]
+    kept = mask.filter(faces, WIDTH, HEIGHT)
+    assert kept.dtype == np.int32
+    assert kept.tolist() == [[300, 200, 40, 40]]
+
+
+def test_exclude_only_mask_keeps_rest_of_frame():
+    mask = DetectionMask(exclude=[DOOR])
+    kept = mask.filter([(700, 200, 40, 40), (130, 80, 40, 40)], WIDTH, HEIGHT)
+    assert kept.tolist() == [[700, 200, 40, 40]]
+    assert mask.clip_regions(None, WIDTH, HEIGHT) is None
+
+
+def test_clip_regions_limits_scan_to_include_bounds():
+    mask = DetectionMask(include=[LEFT_HALF])
+    # boundingRect tính cả cột pixel biên x = 500; chiều cao bị cắt theo frame
+    assert mask.clip_regions(None, WIDTH, HEIGHT) == [(0, 0, 501, 500)]
+    regions = [(400, 100, 300, 100), (800, 0, 100, 100)]
+    assert mask.clip_regions(regions, WIDTH, HEIGHT) == [(400, 100, 101, 100)]
+    assert mask.clip_regions([(800, 0, 100, 100)], WIDTH, HEIGHT) == []
+
+
+def test_degenerate_polygons_are_ignored_and_round_trip():
+    mask = DetectionMask.from_dict({'include': [LEFT_HALF, [[0, 0], [1, 1]]], 'exclude': []})
+    assert len(mask.include) == 1
+    assert DetectionMask.from_dict(mask.to_dict()).to_dict() == mask.to_dict()
+    assert not DetectionMask()
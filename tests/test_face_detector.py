@@ -0,0 +1,30 @@
+"""Kiểm tra chia ô phát hiện của CascadeProvider"""
+
+import numpy as np
+
+from face_detector import CascadeProvider, DetectionProfile
+
+
+def _scanned_shapes(profile):
+    provider = CascadeProvider(tile_workers=1)
+    shapes = []
+
+    def fake_detect(image, scale_factor, min_neighbors, **kwargs):
+        shapes.append(image.shape)
+        return np.empty((0, 4), dtype=np.int32)
+
+    provider.detect = fake_detect
+    provider.detect_regions(np.zeros((400, 600), dtype=np.uint8), profile=profile)
+    return shapes
+
+
+def test_tiling_needs_bounded_face_size():
+    # Không chặn cạnh khuôn mặt: khuôn mặt lớn vắt qua đường nối sẽ không nằm trọn trong ô nào
+    assert _scanned_shapes(DetectionProfile(tile_grid=(2, 2))) == [(400, 600)]
+
+
+def test_tile_overlap_covers_largest_face():
+    shapes = _scanned_shapes(DetectionProfile(tile_grid=(2, 2), tile_overlap=0.0, max_face_size=150))
+    assert len(shapes) == 4
+    # Ô 300x200 nới thêm maxSize (150) về phía phải / dưới, cắt theo biên ảnh
+    assert shapes[0] == (350, 450)
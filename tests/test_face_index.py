@@ -0,0 +1,55 @@
+"""Kiểm tra chỉ mục IVF đối chiếu với quét toàn bộ và dựng lại từ snapshot mmap"""
+
+import numpy as np
+import pytest
+
+from face_gallery import FaceGallery, save_gallery_snapshot, load_gallery_snapshot
+from face_index import ExactIndex, IVFIndex
+
+
+def _clustered_gallery(count=2000, dim=25, clusters=40, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0, 1, (clusters, dim))
+    labels = rng.integers(0, clusters, count)
+    encodings = centres[labels] + rng.normal(0, 0.15, (count, dim))
+    gallery = FaceGallery(list(encodings), list(range(count)), [f'user{i}' for i in range(count)],
+                          ['whitelist'] * count)
+    queries = centres[rng.integers(0, clusters, 200)] + rng.normal(0, 0.15, (200, dim))
+    return gallery, queries.astype(np.float32)
+
+
+def test_ivf_probing_every_list_equals_exact():
+    gallery, queries = _clustered_gallery()
+    ivf = IVFIndex(gallery, nlist=32, nprobe=32, min_size=0)
+    exact_idx, exact_dist, exact_second = ExactIndex(gallery).search(queries)
+    ivf_idx, ivf_dist, ivf_second = ivf.search(queries)
+    np.testing.assert_array_equal(ivf_idx, exact_idx)
+    np.testing.assert_allclose(ivf_dist, exact_dist, rtol=1e-5)
+    np.testing.assert_allclose(ivf_second, exact_second, rtol=1e-4)
+
+
+def test_ivf_recall_with_few_probes():
+    gallery, queries = _clustered_gallery()
+    exact_idx = ExactIndex(gallery).search(queries)[0]
+    ivf_idx = IVFIndex(gallery, nlist=32, nprobe=4, min_size=0).search(queries)[0]
+    assert np.mean(ivf_idx == exact_idx) >= 0.95
+
+
+def test_ivf_rebuilt_from_snapshot_without_training_or_copy(tmp_path, monkeypatch):
+    gallery, queries = _clustered_gallery()
+    ivf = IVFIndex(gallery, nlist=32, nprobe=4, min_size=0)
+    base = str(tmp_path / 'gallery')
+    assert save_gallery_snapshot(gallery, base, 7, 42, 1, ivf.layout())
+
+    loaded, layout = load_gallery_snapshot(base, 7, 42, 1)
+    monkeypatch.setattr(IVFIndex, '_train', lambda self, data: pytest.fail('retrained'))
+    monkeypatch.setattr(IVFIndex, '_assign', lambda self, data: pytest.fail('reassigned'))
+    rebuilt = IVFIndex(loaded, nprobe=4, min_size=0, centroids=layout['centroids'], offsets=layout['offsets'])
+    assert rebuilt.matrix is loaded.matrix
+    assert isinstance(rebuilt.matrix, np.memmap)
+
+    # Cùng cụm được quét nên kết quả (theo user_id) giống hệt chỉ mục gốc
+    original_idx = ivf.search(queries)[0]
+    rebuilt_idx = rebuilt.search(queries)[0]
+    assert [gallery.ids[i] for i in original_idx] == [loaded.ids[i] for i in rebuilt_idx]
+
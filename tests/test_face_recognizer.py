@@ -0,0 +1,80 @@
+"""Kiểm tra FaceRecognizer xử lý template trích xuất bằng descriptor cũ"""
+
+import cv2
+import numpy as np
+
+import face_recognizer as face_recognizer_module
+from database import DatabaseManager
+from face_recognizer import FaceRecognizer
+from zernike_utils import DESCRIPTOR_VERSION
+
+
+def test_stale_templates_are_reextracted_or_excluded(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path / 'data' / 'test.db'))
+    image_path = str(tmp_path / 'alice.png')
+    cv2.imwrite(image_path, np.full((50, 50, 3), 128, dtype=np.uint8))
+    alice = db.add_user('alice', 'whitelist', image_path)
+    bob = db.add_user('bob', 'blacklist', str(tmp_path / 'missing.png'))
+    current = db.add_user('carol', 'whitelist', None)
+    dim = 25
+    db.update_user_features(alice, np.ones(dim), descriptor_version=DESCRIPTOR_VERSION + 1)
+    db.update_user_features(bob, np.ones(dim), descriptor_version=DESCRIPTOR_VERSION + 1)
+    db.update_user_features(current, np.full(dim, 3.0), descriptor_version=DESCRIPTOR_VERSION)
+
+    fresh = np.full(dim, 2.0)
+    monkeypatch.setattr(face_recognizer_module, 'get_face_moments_zernike', lambda image: fresh)
+    recognizer = FaceRecognizer(db)
+
+    # alice: trích xuất lại từ ảnh; bob: không có ảnh nên bị loại khỏi so khớp
+    assert sorted(recognizer.gallery.ids) == sorted([alice, current])
+    user = db.get_user_by_id(alice)
+    assert user['descriptor_version'] == DESCRIPTOR_VERSION
+    np.testing.assert_allclose(user['features'], fresh)
+    assert recognizer.gallery_version == db.get_users_version()
+    db.close()
+
+
+def test_snapshot_writes_are_deferred_and_checked_against_descriptor(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'data' / 'test.db'))
+    dim = 25
+    alice = db.add_user('alice', 'whitelist', None)
+    db.update_user_features(alice, np.ones(dim), descriptor_version=DESCRIPTOR_VERSION)
+    recognizer = FaceRecognizer(db)
+    recognizer.snapshot_save_delay = 60
+    manifest_path = recognizer.snapshot_path + '.json'
+    written = open(manifest_path).read()
+
+    # Thêm người chỉ hẹn ghi; file trên đĩa đổi khi flush
+    bob = db.add_user('bob', 'blacklist', None)
+    db.update_user_features(bob, np.full(dim, 2.0), descriptor_version=DESCRIPTOR_VERSION)
+    recognizer.add_template(bob, 'bob', 'blacklist', np.full(dim, 2.0))
+    assert open(manifest_path).read() == written
+    recognizer.flush_snapshot()
+    assert open(manifest_path).read() != written
+    assert face_recognizer_module.load_gallery_snapshot(
+        recognizer.snapshot_path, db.get_users_version(), db.get_database_uid(), DESCRIPTOR_VERSION) is not None
+
+    # Snapshot ghi bằng descriptor khác không được mở bằng mmap
+    assert face_recognizer_module.load_gallery_snapshot(
+        recognizer.snapshot_path, db.get_users_version(), db.get_database_uid(), DESCRIPTOR_VERSION + 1) is None
+    db.close()
+
+
+def test_deferred_snapshot_save_runs_on_timer_thread(tmp_path, caplog):
+    db = DatabaseManager(str(tmp_path / 'data' / 'test.db'))
+    dim = 25
+    recognizer = FaceRecognizer(db)
+    recognizer.snapshot_save_delay = 0.05
+    bob = db.add_user('bob', 'blacklist', None)
+    db.update_user_features(bob, np.full(dim, 2.0), descriptor_version=DESCRIPTOR_VERSION)
+    recognizer.add_template(bob, 'bob', 'blacklist', np.full(dim, 2.0))
+
+    # Để timer tự ghi (thread khác thread tạo kết nối sqlite)
+    timer = recognizer._save_timer
+    timer.join(5)
+    assert not timer.is_alive()
+    assert 'Error' not in caplog.text
+    gallery, _ = face_recognizer_module.load_gallery_snapshot(
+        recognizer.snapshot_path, db.get_users_version(), db.get_database_uid(), DESCRIPTOR_VERSION)
+    assert list(gallery.ids) == [bob]
+    db.close()
@@ -0,0 +1,61 @@
+"""Kiểm tra ghép khuôn mặt với track (IoU / tâm hộp), xác minh lại và xoá track mất dấu"""
+
+from face_tracker import FaceTracker
+
+
+def _result(user_id, name):
+    return {'user_id': user_id, 'name': name}
+
+
+def test_overlapping_faces_keep_their_track_and_reuse_identity():
+    tracker = FaceTracker(reverify_interval=3)
+    (alice, needs), (bob, _) = tracker.associate([(100, 100, 80, 80), (400, 100, 80, 80)])
+    assert needs and alice.track_id != bob.track_id
+    tracker.update(alice, _result(1, 'alice'))
+    tracker.update(bob, _result(2, 'bob'))
+
+    # Thứ tự phát hiện đảo lại, hộp dịch nhẹ: IoU vẫn ghép đúng track
+    pairs = tracker.associate([(405, 102, 80, 80), (104, 98, 80, 80)])
+    assert [track for track, _ in pairs] == [bob, alice]
+    assert [needs for _, needs in pairs] == [False, False]
+    assert alice.box == (104, 98, 80, 80)
+    assert tracker.get_stats() == {'active_tracks': 2, 'recognized': 2, 'reused': 2}
+
+
+def test_fast_moving_face_is_matched_by_centroid():
+    tracker = FaceTracker(iou_threshold=0.3, centroid_ratio=0.5)
+    (track, _), = tracker.associate([(100, 100, 100, 100)])
+    # IoU = 0.18 < ngưỡng, nhưng tâm chỉ lệch 45 px < 0.5 * 100
+    (moved, _), = tracker.associate([(145, 100, 100, 100)])
+    assert moved is track
+    # Quá xa: tạo track mới
+    (other, needs), = tracker.associate([(600, 100, 100, 100)])
+    assert other is not track and needs
+
+
+def test_track_is_reverified_after_interval():
+    tracker = FaceTracker(reverify_interval=3)
+    (track, _), = tracker.associate([(0, 0, 50, 50)])
+    tracker.update(track, _result(1, 'alice'))
+    needs = [tracker.associate([(0, 0, 50, 50)])[0][1] for _ in range(3)]
+    assert needs == [False, False, True]
+    tracker.update(track, _result(1, 'alice'))
+    assert not tracker.associate([(0, 0, 50, 50)])[0][1]
+
+
+def test_lost_track_expires_after_max_misses():
+    tracker = FaceTracker(max_misses=2)
+    (track, _), = tracker.associate([(0, 0, 50, 50)])
+    tracker.update(track, _result(1, 'alice'))
+    for _ in range(2):
+        tracker.associate([])
+    assert tracker.tracks == [track]
+    # Xuất hiện lại trước hạn: vẫn là track cũ, bộ đếm mất dấu về 0
+    (again, needs), = tracker.associate([(0, 0, 50, 50)])
+    assert again is track and not needs and track.misses == 0
+
+    for _ in range(3):
+        tracker.associate([])
+    assert tracker.tracks == []
+    (fresh, needs), = tracker.associate([(0, 0, 50, 50)])
+    assert fresh is not track and needs